@@ -0,0 +1,284 @@
+"""
+并发基准测试套件：多线程/多进程、Zipf/均匀分布、可配置读写失效比例、TTL 抖动，
+以及基于内存 FakeDB（可注入延迟）的 get_with_fallback / batch_sync / query。
+输出 p50/p99 延迟、吞吐与每条目字节数，并写入 JSON 结果文件，可与历史结果对比。
+
+用法：
+    python benchmarks/bench_suite.py --quick
+    python benchmarks/bench_suite.py --workloads read_zipf,fallback_zipf --threads 1,4 --processes 2
+    python benchmarks/bench_suite.py --compare benchmarks/results/base.json
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import random
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+from bisect import bisect_left
+from itertools import accumulate
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+from src.cache_manager import CacheManager
+from src.cache_sync import CacheSync
+from src.structured_query import StructuredQuery
+from fake_db import FakeDB, make_config
+
+TABLE = 'bench'
+FIELDS = ['name', 'status', 'score']
+
+# 工作负载：mix 为 (读, 写, 失效) 比例；ttl 为写入 TTL（秒）；db_latency 为 FakeDB 注入延迟（秒）
+WORKLOADS = {
+    'read_zipf': {'kind': 'mix', 'dist': 'zipf', 'mix': (0.95, 0.05, 0.0)},
+    'read_uniform': {'kind': 'mix', 'dist': 'uniform', 'mix': (0.95, 0.05, 0.0)},
+    'mixed_zipf': {'kind': 'mix', 'dist': 'zipf', 'mix': (0.7, 0.2, 0.1)},
+    'ttl_churn': {'kind': 'mix', 'dist': 'zipf', 'mix': (0.5, 0.5, 0.0), 'ttl': 0.002},
+    'fallback_zipf': {'kind': 'fallback', 'dist': 'zipf', 'db_latency': 0.0005},
+    'batch_sync': {'kind': 'batch_sync', 'db_latency': 0.0},
+    'query': {'kind': 'query', 'dist': 'zipf', 'db_latency': 0.0005},
+}
+
+class KeyGenerator:
+    """
+    主键生成器：uniform 为均匀分布，zipf 按 1/rank^s 的累积分布二分采样（热点集中在小主键）。
+    """
+    def __init__(self, n, dist='uniform', s=1.1, seed=None):
+        self.n = n
+        self.dist = dist
+        self.random = random.Random(seed)
+        if dist == 'zipf':
+            self.cdf = list(accumulate(1.0 / (rank ** s) for rank in range(1, n + 1)))
+            self.total = self.cdf[-1]
+
+    def next(self):
+        if self.dist == 'zipf':
+            return bisect_left(self.cdf, self.random.random() * self.total)
+        return self.random.randrange(self.n)
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+def make_db(keys, latency):
+    return FakeDB({TABLE: {i: {'name': f'user{i}', 'status': i % 10, 'score': i * 1.5} for i in range(keys)}},
+                  latency=latency)
+
+def table_config(**extra):
+    return make_config([dict({'table': TABLE, 'key_field': 'id', 'fields': FIELDS, 'ttl': 600,
+                              'negative_ttl': 30}, **extra)], no_db_mode=False)
+
+def _run_threads(threads, ops, fn):
+    """
+    fn(seed) 返回单次操作函数，在 threads 个线程中各执行 ops 次，返回 (耗时, 采样延迟列表[ns])。
+    """
+    samples = []
+    lock = threading.Lock()
+    barrier = threading.Barrier(threads + 1)
+
+    def worker(seed):
+        local = []
+        step = fn(seed)
+        barrier.wait()
+        for _ in range(ops):
+            start = time.perf_counter_ns()
+            step()
+            local.append(time.perf_counter_ns() - start)
+        with lock:
+            samples.extend(local)
+
+    workers = [threading.Thread(target=worker, args=(seed,)) for seed in range(threads)]
+    for t in workers:
+        t.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for t in workers:
+        t.join()
+    return time.perf_counter() - start, samples
+
+def _mix_step_factory(cache, conf, keys):
+    read, write, _ = conf['mix']
+    ttl = conf.get('ttl', 600)
+
+    def factory(seed):
+        gen = KeyGenerator(keys, conf['dist'], seed=seed)
+        # 操作类型与主键使用不同的随机序列，避免二者相关
+        rng = random.Random(~seed)
+
+        def step():
+            key = gen.next()
+            r = rng.random()
+            if r < read:
+                cache.get(TABLE, key, 'name')
+            elif r < read + write:
+                cache.set(TABLE, key, 'name', f'user{key}', ttl)
+            else:
+                cache.invalidate(TABLE, key)
+        return step
+    return factory
+
+def run_workload(name, conf, threads, keys, ops):
+    """
+    在当前进程中运行一个工作负载，返回 {elapsed, ops, samples, bytes_per_entry, extra}。
+    """
+    kind = conf['kind']
+    db = make_db(keys, conf.get('db_latency', 0.0))
+    config = table_config()
+    cache = CacheManager(config)
+    extra = {}
+    if kind == 'mix':
+        cache.set_many(TABLE, [(i, 'name', f'user{i}') for i in range(keys)], conf.get('ttl', 600))
+        if conf.get('ttl'):
+            cache.start_expiry()
+        elapsed, samples = _run_threads(threads, ops, _mix_step_factory(cache, conf, keys))
+        cache.stop_expiry()
+        stats = cache.get_stats()
+        extra['expired'] = stats['expired']
+        extra['hit_rate'] = stats['hit_rate']
+    elif kind == 'fallback':
+        sync = CacheSync(cache, db_client=db, config_loader=config)
+
+        def factory(seed):
+            gen = KeyGenerator(keys, conf['dist'], seed=seed)
+            return lambda: sync.get_with_fallback(TABLE, gen.next(), 'name')
+        elapsed, samples = _run_threads(threads, ops, factory)
+        extra['db_calls'] = len(db.calls)
+        extra['hit_rate'] = cache.get_stats()['hit_rate']
+    elif kind == 'batch_sync':
+        sync = CacheSync(cache, db_client=db, config_loader=config)
+        start = time.perf_counter()
+        rows = sync.batch_sync(TABLE)
+        elapsed = time.perf_counter() - start
+        samples = [int(elapsed * 1e9)]
+        extra['rows_per_sec'] = rows / elapsed if elapsed else 0.0
+        ops, threads = rows, 1
+    elif kind == 'query':
+        sq = StructuredQuery(cache, db_client=db, config_loader=config)
+
+        def factory(seed):
+            gen = KeyGenerator(10, conf['dist'], seed=seed)
+            return lambda: sq.query(TABLE, {'status': gen.next()}, ['id', 'name'], limit=20)
+        elapsed, samples = _run_threads(threads, ops, factory)
+        extra['db_calls'] = len(db.calls)
+    else:
+        raise ValueError(f'未知的工作负载类型: {kind}')
+    return {'elapsed': elapsed, 'ops': ops * threads, 'samples': samples, 'extra': extra}
+
+def bytes_per_entry(keys, limit=20000):
+    """
+    用 tracemalloc 测量写入 min(keys, limit) 行全部字段后的每行内存占用。
+    """
+    n = min(keys, limit)
+    cache = CacheManager(table_config())
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    cache.set_many(TABLE, [(i, f, f'user{i}' if f == 'name' else i) for i in range(n) for f in FIELDS], 600)
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return used / n
+
+def _process_entry(args):
+    name, conf, threads, keys, ops = args
+    result = run_workload(name, conf, threads, keys, ops)
+    # 进程间只回传采样的一部分延迟，避免大量数据序列化
+    result['samples'] = result['samples'][::max(1, len(result['samples']) // 50000)]
+    return result
+
+def run(name, threads, processes, keys, ops, entry_bytes=0.0):
+    conf = WORKLOADS[name]
+    if processes <= 1:
+        results = [run_workload(name, conf, threads, keys, ops)]
+    else:
+        ctx = multiprocessing.get_context('fork')
+        with ctx.Pool(processes) as pool:
+            results = pool.map(_process_entry, [(name, conf, threads, keys, ops)] * processes)
+    samples = sorted(s for r in results for s in r['samples'])
+    elapsed = max(r['elapsed'] for r in results)
+    total_ops = sum(r['ops'] for r in results)
+    extra = {}
+    for r in results:
+        for key, value in r['extra'].items():
+            extra[key] = extra.get(key, 0) + value / len(results)
+    return {
+        'workload': name,
+        'threads': threads,
+        'processes': processes,
+        'keys': keys,
+        'ops': total_ops,
+        'throughput': total_ops / elapsed if elapsed else 0.0,
+        'p50_us': percentile(samples, 0.50) / 1000,
+        'p99_us': percentile(samples, 0.99) / 1000,
+        'bytes_per_entry': entry_bytes,
+        'extra': extra
+    }
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                                text=True, timeout=5).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        commit = ''
+    return {'python': platform.python_version(), 'platform': platform.platform(),
+            'cpus': os.cpu_count(), 'commit': commit, 'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S')}
+
+def compare(results, baseline_path, threshold):
+    """
+    与历史结果对比：吞吐下降或 p99 上升超过 threshold 视为回退，返回回退项列表。
+    """
+    with open(baseline_path, 'r', encoding='utf-8') as f:
+        baseline = {(r['workload'], r['threads'], r['processes']): r for r in json.load(f)['results']}
+    regressions = []
+    for r in results:
+        base = baseline.get((r['workload'], r['threads'], r['processes']))
+        if base is None:
+            continue
+        tput = r['throughput'] / base['throughput'] - 1 if base['throughput'] else 0.0
+        p99 = r['p99_us'] / base['p99_us'] - 1 if base['p99_us'] else 0.0
+        flag = tput < -threshold or p99 > threshold
+        print(f"{r['workload']:<15} t={r['threads']:<2} p={r['processes']:<2} "
+              f"throughput {tput:+.1%}  p99 {p99:+.1%}{'  REGRESSION' if flag else ''}")
+        if flag:
+            regressions.append(r)
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='pg-cache 并发基准测试')
+    parser.add_argument('--workloads', default=','.join(WORKLOADS))
+    parser.add_argument('--threads', default='1,4')
+    parser.add_argument('--processes', type=int, default=1)
+    parser.add_argument('--keys', type=int, default=100000)
+    parser.add_argument('--ops', type=int, default=50000, help='每线程操作数')
+    parser.add_argument('--quick', action='store_true', help='小规模快速运行')
+    parser.add_argument('--output', default=os.path.join(ROOT, 'benchmarks', 'results',
+                                                         time.strftime('%Y%m%d-%H%M%S') + '.json'))
+    parser.add_argument('--compare', help='对比的历史结果 JSON')
+    parser.add_argument('--threshold', type=float, default=0.1, help='回退判定阈值（比例）')
+    args = parser.parse_args(argv)
+    if args.quick:
+        args.keys, args.ops = 5000, 2000
+    entry_bytes = bytes_per_entry(args.keys)
+    results = []
+    for name in args.workloads.split(','):
+        # batch_sync 为单次全表同步，不随线程数变化
+        thread_counts = [1] if WORKLOADS[name]['kind'] == 'batch_sync' else [int(t) for t in args.threads.split(',')]
+        for threads in thread_counts:
+            result = run(name, threads, args.processes, args.keys, args.ops, entry_bytes)
+            results.append(result)
+            print(f"{name:<15} t={threads:<2} p={args.processes:<2} {result['throughput']:>12,.0f} ops/s  "
+                  f"p50 {result['p50_us']:8.2f}us  p99 {result['p99_us']:8.2f}us  "
+                  f"{result['bytes_per_entry']:,.0f} B/entry  {result['extra']}")
+    os.makedirs(os.path.dirname(args.output), exist_ok=True)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump({'environment': environment(), 'results': results}, f, indent=2)
+    print(f'结果已写入 {args.output}')
+    if args.compare:
+        return 1 if compare(results, args.compare, args.threshold) else 0
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -2,8 +2,11 @@ import time
 import json
 import os
 import sys
-sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
-from cache_manager import CacheManager
+import threading
+import tracemalloc
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from src.cache_manager import CacheManager
+from fake_db import make_config
 
 def benchmark_set_get(n=10000):
     cache = CacheManager()
@@ -23,5 +26,67 @@ def benchmark_set_get(n=10000):
     # 导出缓存内容
     cache.dump_cache_to_file('cache_dump_benchmark.json')
 
+def benchmark_concurrent_get(n=100000, thread_counts=(1, 2, 4, 8), shard_counts=(1, 16)):
+    """
+    多线程并发 get 吞吐：对比单分段（等价于全局锁）与多分段。
+    """
+    for shards in shard_counts:
+        cache = CacheManager(shards=shards)
+        for i in range(n):
+            cache.set('bench', i, 'value', i, ttl=60)
+        for threads in thread_counts:
+            per_thread = n // threads
+
+            def worker(offset):
+                for i in range(offset, offset + per_thread):
+                    cache.get('bench', i, 'value')
+
+            workers = [threading.Thread(target=worker, args=(t * per_thread,)) for t in range(threads)]
+            start = time.perf_counter()
+            for t in workers:
+                t.start()
+            for t in workers:
+                t.join()
+            elapsed = time.perf_counter() - start
+            print(f'shards={shards:<3} threads={threads:<2} get QPS: {per_thread * threads / elapsed:,.0f}')
+
+def benchmark_get_many(n=100000, batch=200):
+    """
+    逐条 get 与批量 get_many 的单项开销对比。
+    """
+    cache = CacheManager()
+    cache.set_many('bench', [(i, 'value', i) for i in range(n)], ttl=60)
+    pairs = [(i, 'value') for i in range(n)]
+
+    start = time.perf_counter()
+    for key, field in pairs:
+        cache.get('bench', key, field)
+    single = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for i in range(0, n, batch):
+        cache.get_many('bench', pairs[i:i + batch])
+    batched = time.perf_counter() - start
+    print(f'get x{n}: {single / n * 1e6:.3f}us/item, get_many(batch={batch}): {batched / n * 1e6:.3f}us/item')
+
+def benchmark_memory(n=100000, width=10):
+    """
+    普通存储与紧凑存储（compact: true）的每行内存占用对比。
+    """
+    fields = [f'field{i}' for i in range(width)]
+    for compact in (False, True):
+        config = make_config([{'table': 'bench', 'key_field': 'id', 'fields': fields, 'compact': compact}])
+        cache = CacheManager(config)
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        cache.set_many('bench', [(i, field, idx) for i in range(n) for idx, field in enumerate(fields)], ttl=600)
+        used = tracemalloc.get_traced_memory()[0] - before
+        tracemalloc.stop()
+        print(f'compact={compact!s:<5} rows={n} fields={width}: {used / n:,.0f} bytes/row')
+        del cache
+
 if __name__ == '__main__':
-    benchmark_set_get(100000) 
\ No newline at end of file
+    benchmark_set_get(100000)
+    benchmark_concurrent_get()
+    benchmark_get_many()
+    benchmark_memory()
@@ -0,0 +1,63 @@
+"""
+基准测试用的内存数据库与临时配置，与 tests/helpers.py 相互独立（基准测试不依赖测试代码）。
+"""
+import os
+import re
+import tempfile
+import threading
+import time
+import yaml
+from src.config_loader import ConfigLoader
+
+def make_config(tables, no_db_mode=True, **extra):
+    # 临时配置目录随返回的 ConfigLoader 一起回收（进程退出时兜底删除）
+    tmp = tempfile.TemporaryDirectory(prefix='pg-cache-bench-')
+    with open(os.path.join(tmp.name, 'db.yaml'), 'w', encoding='utf-8') as f:
+        yaml.safe_dump({'postgres': {}}, f)
+    with open(os.path.join(tmp.name, 'cache.yaml'), 'w', encoding='utf-8') as f:
+        yaml.safe_dump(dict(no_db_mode=no_db_mode, cache=tables, **extra), f)
+    config = ConfigLoader(tmp.name)
+    config.tmp_dir = tmp
+    return config
+
+class FakeDB:
+    """
+    内存版只读 PostgresClient，可注入延迟（模拟网络往返）并记录调用。
+    只解析基准测试会产生的查询：SELECT 列 FROM 表 [WHERE 列 = %s [AND ...]] [LIMIT n]。
+    tables: {table: {key: {column: value}}}，主键列名为 key_field
+    """
+    def __init__(self, tables, key_field='id', latency=0):
+        self.tables = tables
+        self.key_field = key_field
+        self.latency = latency
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def query(self, sql, params=None):
+        with self.lock:
+            self.calls.append((sql, params))
+        if self.latency:
+            time.sleep(self.latency)
+        m = re.match(r'SELECT (.+?) FROM (\w+)\s*(?:WHERE (.+?))?(?: LIMIT (\d+))?$', sql.strip())
+        columns = [c.strip() for c in m.group(1).split(',')]
+        conds = [cond.split(' = ')[0] for cond in m.group(3).split(' AND ')] if m.group(3) else []
+        filters = dict(zip(conds, params or ()))
+        table = self.tables.get(m.group(2), {})
+        if self.key_field in filters:
+            # 主键条件直接定位，回源延迟只由 latency 决定
+            key = filters.pop(self.key_field)
+            items = [(key, table[key])] if key in table else []
+        else:
+            items = table.items()
+        rows = [(key, row) for key, row in items
+                if all(self._value(key, row, column) == value for column, value in filters.items())]
+        if m.group(4):
+            rows = rows[:int(m.group(4))]
+        return [tuple(self._value(key, row, column) for column in columns) for key, row in rows]
+
+    def query_one(self, sql, params=None):
+        rows = self.query(sql, params)
+        return rows[0] if rows else None
+
+    def _value(self, key, row, column):
+        return key if column == self.key_field else row.get(column)
@@ -1,51 +1,189 @@
-from src.cache_manager import CacheManager
+import os
+import time
+from src.cache_manager import create_cache_manager
 from src.cache_sync import CacheSync
 from src.cache_consistency import CacheConsistency
 from src.structured_query import StructuredQuery
-from src.config_loader import ConfigLoader
+from src.config_loader import ConfigLoader, ConfigWatcher
+from src.cdc import create_event_source
+from src.monitor import CacheMonitor
 
 class PgCacheAPI:
     """
     对外统一 API 层，封装所有核心功能。
+    配置热加载（reload_config 或 reload.watch 监视文件变化）后运行中的缓存按新配置调整，无需重启。
     """
-    def __init__(self):
-        self.config = ConfigLoader()
+    def __init__(self, config_loader=None):
+        self.config = config_loader or ConfigLoader()
         self.no_db_mode = self.config.get_no_db_mode()
-        self.cache = CacheManager()
+        self.cache = create_cache_manager(self.config)
         self.sync = CacheSync(self.cache, config_loader=self.config)
-        self.consistency = CacheConsistency(self.cache, config_loader=self.config)
+        self.consistency = CacheConsistency(self.cache, config_loader=self.config, db_client=self.sync.db)
         self.structured_query = StructuredQuery(self.cache, config_loader=self.config)
+        self.consistency.add_write_listener(self.structured_query.on_write)
+        metrics = self.config.get_metrics_config()
+        self.monitor = CacheMonitor(self.cache)
+        self.metrics = self.monitor.metrics if metrics.get('enabled', True) else None
+        self.sync.metrics = self.metrics
+        if self.sync.db is not None:
+            self.sync.db.metrics = self.metrics
+        if self.metrics is not None and metrics.get('http_port') is not None:
+            self.monitor.start_http_server(metrics.get('http_host', '0.0.0.0'), metrics['http_port'])
+        snapshot = self.config.get_snapshot_config()
+        if snapshot.get('enabled') and snapshot.get('load_on_start', True) and os.path.exists(snapshot['path']):
+            self.cache.load_snapshot(snapshot['path'])
+        expiry = self.config.get_expiry_config()
+        if expiry.get('enabled'):
+            self.cache.start_expiry(expiry.get('interval', 0.1), expiry.get('slice_items', 256),
+                                    expiry.get('slice_time', 0.001))
+        cdc = self.config.get_cdc_config()
+        if cdc.get('enabled') and not self.no_db_mode:
+            self.consistency.start_cdc(create_event_source(cdc, self.sync.db), cdc.get('mode', 'invalidate'),
+                                       cdc.get('batch_size', 500), cdc.get('poll_timeout', 1.0))
+        self.config.add_reload_listener(self._on_config_reload)
+        reload = self.config.get_reload_config()
+        self.config_watcher = ConfigWatcher(self.config, reload.get('interval', 1.0)).start() \
+            if reload.get('watch') else None
+
+    def close(self):
+        """
+        停止后台任务并刷写写回缓冲，返回仍未写入数据库的失败批次（未启用 write_behind 时为空列表）。
+        """
+        self.monitor.stop_http_server()
+        if self.config_watcher is not None:
+            self.config_watcher.stop()
+        self.config.remove_reload_listener(self._on_config_reload)
+        failed = self.consistency.close()
+        self.sync.close()
+        self.cache.stop_expiry()
+        snapshot = self.config.get_snapshot_config()
+        if snapshot.get('enabled') and snapshot.get('save_on_close', True) and not getattr(self.cache, 'shared', False):
+            self.save_snapshot(snapshot['path'])
+        return failed
 
     # 基础缓存操作
     def get(self, table, key, field):
-        return self.cache.get(table, key, field)
+        metrics = self.metrics
+        if metrics is None:
+            return self.cache.get(table, key, field)
+        start = time.perf_counter()
+        value = self.cache.get(table, key, field)
+        metrics.observe('pg_cache_get_seconds', (table, 'get', 'miss' if value is None else 'hit'),
+                        time.perf_counter() - start)
+        return value
 
     def set(self, table, key, field, value, ttl=None):
         self.cache.set(table, key, field, value, ttl)
 
     def invalidate(self, table, key=None, field=None):
+        """
+        失效缓存并同步失效结构化查询结果：整表失效清除该表全部查询结果，按主键失效只清除可能包含该行的查询。
+        """
         self.cache.invalidate(table, key, field)
+        if key is None:
+            self.structured_query.invalidate_query_cache(table)
+        else:
+            self.structured_query.invalidate_for_write(table, key)
+
+    # 批量缓存操作
+    def get_many(self, table, pairs):
+        return self.cache.get_many(table, pairs)
+
+    def get_row(self, table, key, fields=None):
+        return self.cache.get_row(table, key, fields)
+
+    def set_many(self, table, items, ttl=None):
+        self.cache.set_many(table, items, ttl)
+
+    # 快照
+    def save_snapshot(self, path, tables=None):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        return self.cache.save_snapshot(path, tables)
+
+    def load_snapshot(self, path, tables=None):
+        return self.cache.load_snapshot(path, tables)
+
+    def invalidate_many(self, table, keys, fields=None):
+        """
+        批量失效多个主键，并与 invalidate 一样清除可能包含这些行的结构化查询结果。
+        """
+        self.cache.invalidate_many(table, keys, fields)
+        for key in keys:
+            self.structured_query.invalidate_for_write(table, key)
+
+    def invalidate_prefix(self, table, prefix):
+        """
+        失效主键以 prefix 开头的行（见 CacheManager.invalidate_prefix），并失效该表的结构化查询结果。
+        """
+        self.cache.invalidate_prefix(table, prefix)
+        self.structured_query.invalidate_query_cache(table)
 
     # 回源与同步
     def get_with_fallback(self, table, key, field):
-        return self.sync.get_with_fallback(table, key, field)
+        metrics = self.metrics
+        if metrics is None:
+            return self.sync.get_with_fallback(table, key, field)
+        start = time.perf_counter()
+        value = self.sync.get_with_fallback(table, key, field)
+        metrics.observe('pg_cache_get_seconds', (table, 'get_with_fallback', 'miss' if value is None else 'hit'),
+                        time.perf_counter() - start)
+        return value
+
+    def load_many(self, table, keys):
+        return self.sync.load_many(table, keys)
 
     def batch_sync(self, table, key_range=None):
         return self.sync.batch_sync(table, key_range)
 
-    def get_sync_progress(self, table):
-        return self.sync.get_sync_progress(table)
+    def stream_sync(self, table, key_range=None, chunk_size=None, resume=True):
+        return self.sync.stream_sync(table, key_range, chunk_size, resume)
+
+    def parallel_sync(self, table, partitions=None, workers=None, chunk_size=None):
+        return self.sync.parallel_sync(table, partitions, workers, chunk_size)
+
+    def get_sync_progress(self, table, partitions=False):
+        return self.sync.get_sync_progress(table, partitions)
+
+    def get_sync_state(self, table):
+        return self.sync.get_sync_state(table)
+
+    def get_sync_stats(self):
+        return self.sync.get_stats()
+
+    def get_db_stats(self):
+        """
+        连接池借出/等待统计与准备语句、COPY 计数；无源模式或客户端不支持时返回空字典。
+        """
+        db = self.sync.db
+        return db.get_stats() if db is not None and hasattr(db, 'get_stats') else {}
 
     # 一致性保障
     def update_and_sync(self, table, key, field, value, ttl=None):
         self.consistency.update_and_sync(table, key, field, value, ttl)
 
+    def update_row_and_sync(self, table, key, values, ttl=None):
+        return self.consistency.update_row_and_sync(table, key, values, ttl)
+
+    def flush_writes(self):
+        return self.consistency.flush_writes()
+
+    def get_write_stats(self):
+        return self.consistency.get_write_stats()
+
     def invalidate_on_write(self, table, key, field=None):
         self.consistency.invalidate_on_write(table, key, field)
 
     def manual_invalidate(self, table, key=None, field=None):
         self.consistency.manual_invalidate(table, key, field)
 
+    def start_cdc(self, source, mode='invalidate', batch_size=500, poll_timeout=1.0):
+        return self.consistency.start_cdc(source, mode, batch_size, poll_timeout)
+
+    def get_cdc_stats(self):
+        return self.consistency.cdc.get_stats() if self.consistency.cdc else None
+
     # 结构化查询
     def query(self, table, filters, fields, limit=None, offset=None, cache_result=True, ttl=None):
         return self.structured_query.query(table, filters, fields, limit, offset, cache_result, ttl)
@@ -53,6 +191,32 @@ class PgCacheAPI:
     def invalidate_query_cache(self, table):
         self.structured_query.invalidate_query_cache(table)
 
+    def invalidate_queries_for_write(self, table, key=None, values=None):
+        return self.structured_query.invalidate_for_write(table, key, values)
+
+    def is_resident(self, table):
+        return self.cache.is_resident(table)
+
+    # 配置热加载
+    def reload_config(self):
+        """
+        重新读取配置文件并调整运行中的缓存（见 CacheManager.apply_config），返回新的 CompiledConfig。
+        """
+        return self.config.reload()
+
+    def _on_config_reload(self, old, new):
+        self.cache.apply_config(old, new)
+        removed_tables, removed_fields, _ = old.diff(new)
+        for table in removed_tables + list(removed_fields):
+            self.structured_query.invalidate_query_cache(table)
+
+    # 监控
+    def get_metrics(self):
+        return self.monitor.get_metrics()
+
+    def export_metrics(self):
+        return self.monitor.export_prometheus()
+
     def is_no_db_mode(self):
         return self.no_db_mode
 
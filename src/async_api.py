@@ -0,0 +1,221 @@
+import asyncio
+from src.cache_manager import create_cache_manager, ABSENT, NEGATIVE
+from src.cache_consistency import CacheConsistency
+from src.cache_sync import lookup_refresh, field_query, fill_field, sync_query, fill_rows
+from src.structured_query import StructuredQuery, QUERY_FIELD
+from src.config_loader import ConfigLoader
+from src.single_flight import AsyncSingleFlight
+
+class AsyncPgCacheAPI:
+    """
+    asyncio 版 API：缓存读写与 PgCacheAPI 共用同一套内存结构（同步调用，不 await），
+    回源、同步与结构化查询经异步连接池（默认 AsyncPostgresClient，基于 asyncpg）执行，不阻塞事件循环。
+    get_with_fallback / query 命中缓存时不经过任何 await；并发未命中按 key 合并为同一个 Future。
+    refresh_ahead / stale_grace 与 CacheSync 语义相同，后台刷新以 Task 执行，并发数受 refresh.workers 限制。
+    """
+    def __init__(self, config_loader=None, db_client=None, cache_manager=None):
+        self.config = config_loader or ConfigLoader()
+        self.no_db_mode = self.config.get_no_db_mode()
+        if self.no_db_mode:
+            self.db = None
+        elif db_client is not None:
+            self.db = db_client
+        else:
+            from src.async_db_client import AsyncPostgresClient
+            self.db = AsyncPostgresClient(self.config)
+        self.cache = cache_manager or create_cache_manager(self.config)
+        self.consistency = CacheConsistency(self.cache, config_loader=self.config)
+        # 复用查询计划、缓存与依赖索引（plan/statement/store/finish），数据库访问由本类异步完成
+        self.structured_query = StructuredQuery(self.cache, db_client=self.db, config_loader=self.config)
+        self.consistency.add_write_listener(self.structured_query.on_write)
+        expiry = self.config.get_expiry_config()
+        if expiry.get('enabled'):
+            self.cache.start_expiry(expiry.get('interval', 0.1), expiry.get('slice_items', 256),
+                                    expiry.get('slice_time', 0.001))
+        self.flight = AsyncSingleFlight()
+        self.sync_progress = {}  # {table: last_synced_key}
+        self.negative_hits = 0
+        refresh = self.config.get_refresh_config()
+        self.refresh_workers = refresh.get('workers', 4)
+        self.refresh_max_pending = refresh.get('max_pending', 1000)
+        self.refresh_semaphore = None  # 首次刷新时在事件循环中创建
+        self.refreshing = {}  # {(table, key, field): Task}
+        self.refresh_stats = {}  # {table: {refreshes, refresh_failures, refresh_dropped, stale_serves}}
+        self.config.add_reload_listener(self._on_config_reload)
+
+    async def close(self):
+        self.config.remove_reload_listener(self._on_config_reload)
+        tasks = list(self.refreshing.values())
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+        self.cache.stop_expiry()
+        if self.db is not None and hasattr(self.db, 'close'):
+            await self.db.close()
+
+    # 基础缓存操作（同步，不涉及 IO）
+    def get(self, table, key, field):
+        return self.cache.get(table, key, field)
+
+    def set(self, table, key, field, value, ttl=None):
+        self.cache.set(table, key, field, value, ttl)
+
+    def invalidate(self, table, key=None, field=None):
+        """
+        失效缓存并同步失效结构化查询结果：整表失效清除该表全部查询结果，按主键失效只清除可能包含该行的查询。
+        """
+        self.cache.invalidate(table, key, field)
+        if key is None:
+            self.structured_query.invalidate_query_cache(table)
+        else:
+            self.structured_query.invalidate_for_write(table, key)
+
+    def invalidate_prefix(self, table, prefix):
+        self.cache.invalidate_prefix(table, prefix)
+        self.structured_query.invalidate_query_cache(table)
+
+    def get_many(self, table, pairs):
+        return self.cache.get_many(table, pairs)
+
+    def set_many(self, table, items, ttl=None):
+        self.cache.set_many(table, items, ttl)
+
+    # 回源与同步
+    async def get_with_fallback(self, table, key, field):
+        ahead = self.config.get_compiled().refresh_ahead.get(table)
+        if ahead is None:
+            value = self.cache.lookup(table, key, field)
+        else:
+            value = self._lookup_refresh(table, key, field, ahead)
+        if value is NEGATIVE:
+            self.negative_hits += 1
+            return None
+        if value is not ABSENT:
+            return value
+        if self.no_db_mode:
+            return None
+        cache_conf = self._get_cache_conf(table)
+        if not cache_conf or field not in cache_conf['fields']:
+            return None
+        return await self.flight.do((table, key, field), lambda: self._load_field(table, key, field, cache_conf))
+
+    def _lookup_refresh(self, table, key, field, ahead):
+        value, due, stale = lookup_refresh(self.cache, table, key, field, ahead)
+        if not due or self.no_db_mode:
+            return value
+        stats = self.refresh_stats.setdefault(table, {'refreshes': 0, 'refresh_failures': 0,
+                                                      'refresh_dropped': 0, 'stale_serves': 0})
+        flight_key = (table, key, field)
+        if flight_key not in self.refreshing:
+            if len(self.refreshing) >= self.refresh_max_pending:
+                stats['refresh_dropped'] += 1
+            else:
+                task = asyncio.get_running_loop().create_task(self._refresh_field(table, key, field, stats))
+                self.refreshing[flight_key] = task
+                task.add_done_callback(lambda _: self.refreshing.pop(flight_key, None))
+        if stale:
+            stats['stale_serves'] += 1
+        return value
+
+    async def _refresh_field(self, table, key, field, stats):
+        if self.refresh_semaphore is None:
+            self.refresh_semaphore = asyncio.Semaphore(self.refresh_workers)
+        cache_conf = self._get_cache_conf(table)
+        if not cache_conf or field not in cache_conf['fields']:
+            return
+        async with self.refresh_semaphore:
+            try:
+                await self._load_field(table, key, field, cache_conf)
+                stats['refreshes'] += 1
+            except Exception:
+                stats['refresh_failures'] += 1
+
+    async def _load_field(self, table, key, field, cache_conf):
+        row = await self.db.query_one(field_query(table, field, cache_conf), (key,))
+        return fill_field(self.cache, table, key, field, cache_conf, row)
+
+    async def batch_sync(self, table, key_range=None):
+        """
+        批量同步指定表的缓存，key_range: (start, end) 或 None 表示全量；全量同步完成后表被标记为常驻。
+        """
+        cache_conf = self._get_cache_conf(table)
+        if not cache_conf:
+            return 0
+        if self.no_db_mode:
+            self.sync_progress[table] = key_range[1] if key_range else 'ALL'
+            return 0
+        sql, params = sync_query(table, cache_conf, key_range)
+        token = None if key_range else self.cache.residency_token(table)
+        rows = await self.db.query(sql, params)
+        fill_rows(self.cache, table, cache_conf['fields'], rows, cache_conf.get('ttl'))
+        if token is not None:
+            self.cache.mark_resident(table, token)
+        self.sync_progress[table] = key_range[1] if key_range else 'ALL'
+        return len(rows)
+
+    def get_sync_progress(self, table):
+        return self.sync_progress.get(table)
+
+    def get_stats(self):
+        return {
+            'coalesced_waits': self.flight.coalesced,
+            'negative_hits': self.negative_hits,
+            'refresh_in_flight': len(self.refreshing),
+            'refresh': {table: dict(stats) for table, stats in self.refresh_stats.items()}
+        }
+
+    # 结构化查询
+    async def query(self, table, filters, fields, limit=None, offset=None, cache_result=True, ttl=None):
+        sq = self.structured_query
+        plan = sq.plan(table, filters, fields, limit, offset, cache_result, ttl)
+        while not plan.done:
+            # 同一查询键的并发请求合并为一次数据库查询；分页模式下同一查询的不同页共用一次完整结果查询，各自切片
+            stored, rows = await self.flight.do((QUERY_FIELD, table, plan.cache_key), lambda: self._fetch(plan))
+            sq.finish(plan, stored, rows)
+        return plan.result
+
+    async def _fetch(self, plan):
+        sq = self.structured_query
+        sql, params = sq.statement(plan)
+        rows = await self.db.query(sql, params)
+        return sq.store(plan, rows), rows
+
+    def invalidate_query_cache(self, table):
+        self.structured_query.invalidate_query_cache(table)
+
+    # 一致性保障
+    def update_and_sync(self, table, key, field, value, ttl=None):
+        self.consistency.update_and_sync(table, key, field, value, ttl)
+
+    def invalidate_on_write(self, table, key, field=None):
+        self.consistency.invalidate_on_write(table, key, field)
+
+    # 配置热加载
+    def reload_config(self):
+        """
+        重新读取配置文件并调整运行中的缓存，返回新的 CompiledConfig（文件读取为同步操作）。
+        """
+        return self.config.reload()
+
+    def _on_config_reload(self, old, new):
+        self.cache.apply_config(old, new)
+        removed_tables, removed_fields, _ = old.diff(new)
+        for table in removed_tables + list(removed_fields):
+            self.structured_query.invalidate_query_cache(table)
+
+    def is_no_db_mode(self):
+        return self.no_db_mode
+
+    def _get_cache_conf(self, table):
+        return self.config.get_table_config(table)
+
+# 用法示例
+if __name__ == '__main__':
+    import asyncio
+
+    async def main():
+        api = AsyncPgCacheAPI()
+        print('无源数据库模式:', api.is_no_db_mode())
+        print(await api.get_with_fallback('your_table', 1, 'field1'))
+        await api.close()
+
+    asyncio.run(main())
@@ -0,0 +1,65 @@
+import asyncio
+import re
+from functools import lru_cache
+from src.config_loader import ConfigLoader
+
+_PLACEHOLDER = re.compile(r'%s')
+
+@lru_cache(maxsize=1024)
+def to_native_sql(sql):
+    """
+    把 psycopg2 风格的 %s 占位符转换为 asyncpg 的 $1, $2 ...，便于与同步客户端共用 SQL。
+    """
+    counter = iter(range(1, sql.count('%s') + 1))
+    return _PLACEHOLDER.sub(lambda _: f'${next(counter)}', sql)
+
+class AsyncPostgresClient:
+    """
+    基于 asyncpg 的异步连接池客户端，接口与 PostgresClient 对应（SQL 使用 %s 占位符，返回元组）。
+    asyncpg 为可选依赖，首次查询时才导入并创建连接池。
+    """
+    def __init__(self, config_loader=None):
+        config = (config_loader or ConfigLoader()).get_db_config()
+        self.minconn = config.get('minconn', 1)
+        self.maxconn = config.get('maxconn', 10)
+        self.dsn = dict(
+            host=config['host'],
+            port=config['port'],
+            user=config['user'],
+            password=config['password'],
+            database=config['database']
+        )
+        self.pool = None
+        self._pool_lock = None
+
+    async def connect(self):
+        """
+        创建（或返回已创建的）连接池，并发调用只会创建一次。
+        """
+        if self.pool is not None:
+            return self.pool
+        if self._pool_lock is None:
+            self._pool_lock = asyncio.Lock()
+        async with self._pool_lock:
+            if self.pool is None:
+                try:
+                    import asyncpg
+                except ImportError as e:
+                    raise ImportError('AsyncPostgresClient 需要安装 asyncpg：pip install asyncpg') from e
+                self.pool = await asyncpg.create_pool(min_size=self.minconn, max_size=self.maxconn, **self.dsn)
+        return self.pool
+
+    async def query(self, sql, params=None):
+        pool = self.pool or await self.connect()
+        rows = await pool.fetch(to_native_sql(sql), *(params or ()))
+        return [tuple(row) for row in rows]
+
+    async def query_one(self, sql, params=None):
+        pool = self.pool or await self.connect()
+        row = await pool.fetchrow(to_native_sql(sql), *(params or ()))
+        return tuple(row) if row is not None else None
+
+    async def close(self):
+        if self.pool is not None:
+            await self.pool.close()
+            self.pool = None
@@ -0,0 +1,50 @@
+import time
+import threading
+
+class _Batch:
+    __slots__ = ('keys', 'event', 'result', 'error')
+
+    def __init__(self):
+        self.keys = set()
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+class BatchLoader:
+    """
+    微批合并：同一表在时间窗口内的单 key 回源请求合并为一次批量加载。
+    首个到达的线程等待窗口结束后调用 load_fn(table, keys)，其余线程等待并共享结果。
+    load_fn 返回 {key: {field: value}}。
+    """
+    def __init__(self, load_fn):
+        self.load_fn = load_fn
+        self.lock = threading.Lock()
+        self.pending = {}  # {table: 正在收集的批次}
+        self.batches = 0
+        self.merged = 0
+
+    def load(self, table, key, window):
+        with self.lock:
+            batch = self.pending.get(table)
+            leader = batch is None
+            if leader:
+                batch = self.pending[table] = _Batch()
+            else:
+                self.merged += 1
+            batch.keys.add(key)
+        if leader:
+            time.sleep(window)
+            with self.lock:
+                del self.pending[table]
+                self.batches += 1
+            try:
+                batch.result = self.load_fn(table, list(batch.keys))
+            except Exception as e:
+                batch.error = e
+            finally:
+                batch.event.set()
+        else:
+            batch.event.wait()
+        if batch.error is not None:
+            raise batch.error
+        return batch.result.get(key)
@@ -1,36 +1,190 @@
 from src.cache_manager import CacheManager
 from src.config_loader import ConfigLoader
+from src.cdc import CDCConsumer
+from src.write_behind import WriteBehindBuffer, check_fields, update_statements
 
 class CacheConsistency:
     """
     一致性保障层：写操作时同步更新/失效缓存，支持手动/自动失效。
+    自动失效由 CDC 消费者（src/cdc.py）驱动，变更事件经 apply_changes 批量应用。
+    cache.yaml 中 write.mode 决定 update_and_sync 是否写库：none 仅更新缓存（默认），
+    write_through 先同步写库再更新缓存，write_behind 更新缓存后经 WriteBehindBuffer 合并批量写库。
     """
-    def __init__(self, cache_manager=None, config_loader=None):
+    def __init__(self, cache_manager=None, config_loader=None, db_client=None):
         self.cache = cache_manager or CacheManager()
         self.config = config_loader or ConfigLoader()
+        self.db = db_client
+        self.cdc = None
+        self.write_listeners = []  # fn(table, key, values, op)，如结构化查询的依赖失效
+        write = self.config.get_write_config()
+        self.write_mode = write.get('mode', 'none') if db_client is not None else 'none'
+        self.write_behind = None
+        if self.write_mode == 'write_behind':
+            self.write_behind = WriteBehindBuffer(
+                db_client, self._get_cache_conf, write.get('max_batch', 500), write.get('flush_interval', 0.05),
+                write.get('max_pending', 10000), write.get('max_retries', 3), write.get('retry_backoff', 0.1),
+                self._on_missing_rows)
+            self.write_behind.start()
+
+    def add_write_listener(self, listener):
+        self.write_listeners.append(listener)
+
+    def _notify_write(self, table, key=None, values=None, op=None):
+        for listener in self.write_listeners:
+            listener(table, key, values, op)
 
     def update_and_sync(self, table, key, field, value, ttl=None):
         """
-        写操作时同步更新缓存。
+        写操作时同步更新缓存，并按 write.mode 写库。
+        """
+        self.update_row_and_sync(table, key, {field: value}, ttl)
+
+    def update_row_and_sync(self, table, key, values, ttl=None):
+        """
+        更新同一主键的多个字段 values={field: value}，返回是否已更新缓存。
+        写库模式下字段须为 cache.yaml 中配置的 fields，否则抛出 ValueError。
+        write_through 写库失败时失效缓存后重新抛出异常（写入结果未知，不能保留旧值）；
+        数据库中不存在该行时失效缓存并返回 False。
+        write_behind 刷写时发现行已不存在的，由后台线程失效对应主键（见 WriteBehindBuffer.on_missing）。
+        """
+        if self.write_mode == 'write_through':
+            cache_conf = check_fields(self._get_cache_conf(table), table, values)
+            (sql, params), = update_statements(table, cache_conf['key_field'], {key: values})
+            try:
+                updated = self.db.execute(sql, params[0])
+            except Exception:
+                self.invalidate_on_write(table, key)
+                raise
+            if not updated:
+                self.invalidate_on_write(table, key)
+                return False
+        elif self.write_behind is not None:
+            check_fields(self._get_cache_conf(table), table, values)
+        self.cache.set_many(table, [(key, field, value) for field, value in values.items()], ttl)
+        if self.write_behind is not None:
+            # 先写缓存再入缓冲，刷写时发现行不存在所做的失效不会被这次缓存写入覆盖
+            self.write_behind.add(table, key, values)
+        self._notify_write(table, key, values, 'update')
+        return True
+
+    def _on_missing_rows(self, table, keys):
+        # 行已不在数据库中，失效后缓存与数据库一致，不影响表的常驻状态
+        self.cache.invalidate_many(table, keys, deleted=True)
+        for key in keys:
+            self._notify_write(table, key, None, 'update')
+
+    def flush_writes(self):
+        """
+        立即刷写写回缓冲，返回写入的条目数（未启用 write_behind 时返回 0）。
         """
-        self.cache.set(table, key, field, value, ttl)
+        return self.write_behind.flush() if self.write_behind is not None else 0
+
+    def get_write_stats(self):
+        stats = {'mode': self.write_mode}
+        if self.write_behind is not None:
+            stats.update(self.write_behind.get_stats())
+        return stats
+
+    def close(self):
+        """
+        停止 CDC 消费并刷写剩余的写回缓冲，返回仍未写入数据库的失败批次（见 WriteBehindBuffer.close）。
+        """
+        self.stop_cdc()
+        return self.write_behind.close() if self.write_behind is not None else []
 
     def invalidate_on_write(self, table, key, field=None):
         """
         写操作时失效缓存（可选字段级或主键级）。
         """
         self.cache.invalidate(table, key, field)
+        self._notify_write(table, key, None, 'update')
 
     def manual_invalidate(self, table, key=None, field=None):
         """
         手动失效缓存（支持表/主键/字段级）。
         """
         self.cache.invalidate(table, key, field)
+        if key is None:
+            self._notify_write(table)
+        else:
+            self._notify_write(table, key, None, 'update')
 
-    # 预留自动失效接口（如 CDC/触发器集成）
     def auto_invalidate(self, table, key, field=None):
+        """
+        单条变更触发的自动失效。
+        """
         self.invalidate_on_write(table, key, field)
 
+    def apply_changes(self, events, mode='invalidate'):
+        """
+        批量应用 CDC 变更事件。mode='invalidate' 时按主键批量失效；
+        mode='update' 时，表配置了 cdc_update: true 且携带全部配置字段的 insert/update 事件直接原地更新缓存，其余事件失效。
+        事件源的值经 JSON 解码，不含列类型（时间戳为字符串、numeric 为 float），
+        只有字段均为 JSON 原生类型（text、integer、boolean、json）的表才应开启 cdc_update。
+        同一批次内同一主键以最后一条事件为准。
+        """
+        by_table = {}
+        for event in events:
+            by_table.setdefault(event.table, []).append(event)
+        for table, table_events in by_table.items():
+            cache_conf = self._get_cache_conf(table)
+            key_field = cache_conf['key_field'] if cache_conf else None
+            fields = cache_conf['fields'] if cache_conf else []
+            in_place = mode == 'update' and bool(cache_conf) and cache_conf.get('cdc_update', False)
+            invalidate_keys = []
+            deleted_keys = []
+            updates = {}
+            for event in table_events:
+                if event.op == 'truncate':
+                    self.cache.invalidate(table)
+                    self._notify_write(table)
+                    invalidate_keys, deleted_keys, updates = [], [], {}
+                    continue
+                key = event.key if event.key is not None else (event.values or {}).get(key_field)
+                if key is None:
+                    # 无法定位主键时退化为表级失效
+                    self.cache.invalidate(table)
+                    self._notify_write(table)
+                    continue
+                self._notify_write(table, key, event.values, event.op)
+                if event.old_key is not None and event.old_key != key:
+                    self._notify_write(table, event.old_key, None, event.op)
+                    deleted_keys.append(event.old_key)
+                    updates.pop(event.old_key, None)
+                values = event.values or {}
+                if in_place and event.op != 'delete' and all(field in values for field in fields):
+                    updates[key] = values
+                else:
+                    (deleted_keys if event.op == 'delete' else invalidate_keys).append(key)
+                    updates.pop(key, None)
+            if invalidate_keys:
+                self.cache.invalidate_many(table, invalidate_keys)
+            if deleted_keys:
+                # 删除事件后缓存与数据库一致，不影响表的常驻状态
+                self.cache.invalidate_many(table, deleted_keys, deleted=True)
+            if updates:
+                self.cache.set_many(table, [
+                    (key, field, values[field]) for key, values in updates.items() for field in fields
+                ], cache_conf.get('ttl'))
+
+    def start_cdc(self, source, mode='invalidate', batch_size=500, poll_timeout=1.0):
+        """
+        启动 CDC 消费线程，source 为 src.cdc.EventSource 实现。
+        """
+        self.stop_cdc()
+        self.cdc = CDCConsumer(source, self, mode, batch_size, poll_timeout)
+        self.cdc.start()
+        return self.cdc
+
+    def stop_cdc(self):
+        if self.cdc is not None:
+            self.cdc.stop()
+            self.cdc.source.close()
+            self.cdc = None
+
+    def _get_cache_conf(self, table):
+        return self.config.get_table_config(table)
+
 # 用法示例
 if __name__ == '__main__':
     cc = CacheConsistency()
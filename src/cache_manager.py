@@ -1,87 +1,954 @@
+import sys
 import time
+import heapq
 import threading
 from collections import defaultdict
 import json
+from src.codec import EncodedValue, ValueCodec, decode_value
+from src.config_loader import ConfigLoader
+from src.eviction import create_policy
+from src.expiry import ExpiryReaper
+from src.query_engine import ShardIndex, covers_query, select_rows
+from src.reclaim import Reclaimer
+from src.snapshot import read_snapshot, write_snapshot
+from src.storage import (ABSENT, EXPIRED, NEGATIVE, QUERY_FIELD, ROW, CacheEntry, CompactRow, FieldRow,
+                         estimate_size, has_key_prefix, query_namespace)
 
-class CacheEntry:
-    def __init__(self, value, expire_at=None):
-        self.value = value
-        self.expire_at = expire_at  # 绝对过期时间戳
+class CacheShard:
+    """
+    缓存分段：独立的锁、数据、命中统计与淘汰策略，调用方需持有 self.lock。
+    结构: tables[table][key] = FieldRow({field: CacheEntry}) 或 CompactRow（紧凑存储表）
+    配置了 indexes 的表在分段内维护二级索引；数据因淘汰、过期或失效而丢失时累加 index_losses，
+    用于判断全量同步后的表是否仍完整常驻。
+    条目保存逻辑过期时间，普通读取过期即未命中；配置了 stale_grace 的表在宽限期内保留条目，
+    仅 get_expiry 返回，宽限期结束后由读取或过期回收删除。
+    整表失效与 reset 只把表数据从分段中摘下（O(1)），之后的读取立即未命中，摘下的数据交给 reclaimer 在锁外分片释放。
+    主键前缀失效登记到 sweeps，匹配前缀且在失效后未重新写入（不在 reborn 中）的行视为已失效，由清扫任务分批删除。
+    """
+    def __init__(self, limits, layouts=None, index_fields=None, grace=None, reclaimer=None):
+        self.lock = threading.RLock()
+        self.reclaimer = reclaimer
+        self.limits = limits    # {table: (max_entries, max_bytes, eviction)}，本分段分得的份额
+        self.layouts = layouts or {}  # {table: {field: 位置}}，紧凑存储表的字段布局
+        self.index_fields = index_fields or {}  # {table: [索引字段]}
+        self.grace = grace or {}  # {table: stale_grace 秒}
+        self.index_losses = defaultdict(int)    # {table: 数据丢失次数}，只增不减
+        self.epoch = 0      # 前缀失效序号
+        self.tables = None
+        self.reset()
+
+    def _discard(self, *objects):
+        if self.reclaimer is not None:
+            self.reclaimer.release(*objects)
+
+    def reset(self):
+        if self.tables is not None:
+            self._discard(self.tables, self.key_bytes, self.expiry_buckets, self.expiry_heap,
+                          *self.indexes.values(), *self.policies.values())
+        self.tables = {}
+        self.sweeps = {}    # {table: [(主键前缀, 失效序号)]}，清扫完成前匹配的行视为已失效
+        self.reborn = {}    # {table: {key}}，前缀失效后重新写入的主键
+        self.hits = 0
+        self.misses = 0
+        self.policies = {}    # {table: 淘汰策略}
+        self.key_bytes = {}   # {table: {key: 估算字节数}}，仅限有上限的表
+        self.table_bytes = defaultdict(int)
+        self.evictions = defaultdict(int)
+        self.expiry_buckets = {}  # {过期秒: [(table, key, field), ...]}
+        self.expiry_heap = []     # 待处理的过期秒（最小堆）
+        self.expiry_scheduled = 0
+        self.expired = 0
+        self.indexes = {table: ShardIndex(fields) for table, fields in self.index_fields.items()}
+        for table in self.index_fields:
+            self.index_losses[table] += 1
+        for table in self.limits:
+            self.reset_policy(table)
+
+    def reset_policy(self, table):
+        max_entries, _, eviction = self.limits[table]
+        self.policies[table] = create_policy(eviction, max_entries)
+        self.key_bytes[table] = {}
+        self.table_bytes[table] = 0
+
+    def set(self, table, key, field, value, expire_at):
+        keys = self.tables.get(table)
+        if keys is None:
+            keys = self.tables[table] = {}
+        if table in self.sweeps:
+            self._revive(table, key)
+        row = keys.get(key)
+        is_new = row is None
+        if is_new:
+            layout = self.layouts.get(table)
+            row = keys[key] = FieldRow() if layout is None else CompactRow(layout)
+        policy = self.policies.get(table)
+        if policy is None:
+            token = row.write(field, value, expire_at)
+        else:
+            old = row.peek(field)
+            delta = estimate_size(value) - (0 if old is ABSENT else estimate_size(old))
+            if is_new:
+                policy.record_insert(key)
+            else:
+                policy.record_access(key)
+            token = row.write(field, value, expire_at)
+            sizes = self.key_bytes[table]
+            sizes[key] = sizes.get(key, 0) + delta
+            self.table_bytes[table] += delta
+        if expire_at is not None and token is not None:
+            self.schedule_expiry(table, key, token, expire_at + self.grace.get(table, 0))
+        index = self.indexes.get(table)
+        if index is not None:
+            index.add(key, field, value)
+        if policy is not None:
+            self.enforce_limits(table)
+
+    def schedule_expiry(self, table, key, field, expire_at):
+        # 按秒分桶，桶内条目在该秒结束前全部到期
+        second = int(expire_at) + 1
+        bucket = self.expiry_buckets.get(second)
+        if bucket is None:
+            bucket = self.expiry_buckets[second] = []
+            heapq.heappush(self.expiry_heap, second)
+        bucket.append((table, key, field))
+        self.expiry_scheduled += 1
+
+    def expire_due(self, now, max_items, deadline):
+        """
+        回收已到期的条目，最多处理 max_items 个或直到 deadline（perf_counter），返回 (回收数, 处理数)。
+        桶中的条目可能已被覆盖或删除，需重新核对过期时间。
+        """
+        removed = processed = 0
+        heap = self.expiry_heap
+        while heap and heap[0] <= now and processed < max_items:
+            second = heap[0]
+            bucket = self.expiry_buckets[second]
+            while bucket and processed < max_items and time.perf_counter() < deadline:
+                table, key, field = bucket.pop()
+                processed += 1
+                row = self.tables.get(table, {}).get(key)
+                if row is not None:
+                    values = row.expire(field, now - self.grace.get(table, 0))
+                    if values:
+                        self._unindex(table, key, field)
+                        self._after_remove(table, key, row, values)
+                        removed += len(values)
+            if bucket:
+                break
+            heapq.heappop(heap)
+            del self.expiry_buckets[second]
+        self.expiry_scheduled -= processed
+        self.expired += removed
+        return removed, processed
+
+    def expiry_backlog(self, now):
+        return sum(len(self.expiry_buckets[second]) for second in self.expiry_heap if second <= now)
+
+    def is_stale(self, table, key):
+        """
+        主键是否被尚未清扫完成的前缀失效覆盖（失效后重新写入的除外）。
+        """
+        sweeps = self.sweeps.get(table)
+        if not sweeps:
+            return False
+        reborn = self.reborn.get(table)
+        if reborn and key in reborn:
+            return False
+        return any(has_key_prefix(key, prefix) for prefix, _ in sweeps)
+
+    def _row(self, table, key):
+        row = self.tables.get(table, {}).get(key)
+        if row is not None and table in self.sweeps and self.is_stale(table, key):
+            return None
+        return row
+
+    def _revive(self, table, key):
+        # 写入前缀已失效的主键：先删除旧行，之后该主键不再视为失效
+        if not any(has_key_prefix(key, prefix) for prefix, _ in self.sweeps[table]):
+            return
+        reborn = self.reborn.setdefault(table, set())
+        if key in reborn:
+            return
+        if key in self.tables[table]:
+            self.remove_key(table, key, False)
+        reborn.add(key)
+
+    def invalidate_prefix(self, table, prefix):
+        """
+        登记主键前缀失效，返回失效序号（表中无数据时返回 None）。匹配的行立即视为未命中，
+        由 sweep 分批删除，finish_sweep 后注销登记。
+        """
+        if not self.tables.get(table):
+            return None
+        self.epoch += 1
+        self.sweeps.setdefault(table, []).append((prefix, self.epoch))
+        reborn = self.reborn.get(table)
+        if reborn:
+            reborn.difference_update([key for key in reborn if has_key_prefix(key, prefix)])
+        if table in self.indexes:
+            self.index_losses[table] += 1
+        return self.epoch
+
+    def sweep(self, table, keys):
+        """
+        删除一批主键中已被前缀失效的行，返回删除的行数。
+        """
+        rows = self.tables.get(table)
+        if not rows or table not in self.sweeps:
+            return 0
+        removed = 0
+        for key in keys:
+            if key in rows and self.is_stale(table, key):
+                self.remove_key(table, key, False)
+                removed += 1
+        return removed
+
+    def finish_sweep(self, table, epoch):
+        sweeps = [(prefix, e) for prefix, e in self.sweeps.get(table, ()) if e > epoch]
+        if sweeps:
+            self.sweeps[table] = sweeps
+        else:
+            self.sweeps.pop(table, None)
+            self.reborn.pop(table, None)
+
+    def get(self, table, key, field):
+        row = self._row(table, key)
+        if row is not None:
+            value = row.read(field)
+            if value is not ABSENT:
+                if value is not EXPIRED:
+                    self.hits += 1
+                    policy = self.policies.get(table)
+                    if policy is not None:
+                        policy.record_access(key)
+                    return value
+                # 过期则清理（宽限期内保留）
+                if not self._in_grace(table, row, field):
+                    self.remove_field(table, key, field)
+        self.misses += 1
+        return ABSENT
+
+    def _in_grace(self, table, row, field, now=None):
+        grace = self.grace.get(table)
+        return bool(grace) and (now or time.time()) <= row.expire_at_of(field) + grace
+
+    def get_many(self, table, pairs, result):
+        keys = self.tables.get(table)
+        if keys is None:
+            self.misses += len(pairs)
+            return
+        now = time.time()
+        policy = self.policies.get(table)
+        sweeping = table in self.sweeps
+        hits = misses = 0
+        expired = []
+        for key, field in pairs:
+            row = keys.get(key)
+            if sweeping and row is not None and self.is_stale(table, key):
+                row = None
+            value = row.read(field, now) if row is not None else ABSENT
+            if value is ABSENT:
+                misses += 1
+            elif value is EXPIRED:
+                misses += 1
+                expired.append((key, field))
+            else:
+                hits += 1
+                result[(key, field)] = value
+                if policy is not None:
+                    policy.record_access(key)
+        for key, field in expired:
+            # pairs 可能含重复项，前一次失效已删除该字段或整行
+            row = keys.get(key)
+            if row is not None and row.peek(field) is not ABSENT and not self._in_grace(table, row, field, now):
+                self.invalidate(table, key, field)
+        self.hits += hits
+        self.misses += misses
+
+    def get_expiry(self, table, key, field):
+        """
+        与 get 相同，同时返回条目的逻辑过期时间 (value, expire_at)；宽限期内的过期条目仍返回旧值。
+        """
+        row = self._row(table, key)
+        value = row.peek(field) if row is not None else ABSENT
+        if value is ABSENT:
+            self.misses += 1
+            return ABSENT, None
+        expire_at = row.expire_at_of(field)
+        if expire_at is not None and time.time() > expire_at and not self._in_grace(table, row, field):
+            self.remove_field(table, key, field)
+            self.misses += 1
+            return ABSENT, None
+        self.hits += 1
+        policy = self.policies.get(table)
+        if policy is not None:
+            policy.record_access(key)
+        return value, expire_at
+
+    def get_row(self, table, key, fields):
+        row = self._row(table, key)
+        if not row:
+            self.misses += len(fields) if fields else 1
+            return {}
+        now = time.time()
+        result = {}
+        expired = []
+        for field in (fields if fields is not None else [f for f, _, _ in row.entries()]):
+            value = row.read(field, now)
+            if value is EXPIRED:
+                expired.append(field)
+            elif value is not ABSENT:
+                result[field] = value
+        for field in expired:
+            if row.peek(field) is not ABSENT and not self._in_grace(table, row, field, now):
+                self.invalidate(table, key, field)
+        requested = len(fields) if fields is not None else len(result) + len(expired)
+        self.hits += len(result)
+        self.misses += requested - len(result)
+        policy = self.policies.get(table)
+        if result and policy is not None:
+            policy.record_access(key)
+        return result
+
+    def invalidate(self, table, key, field=None, deleted=False):
+        """
+        deleted=True 表示数据库中该行已删除，缓存仍与数据库一致，不计为数据丢失。
+        """
+        if key not in self.tables.get(table, {}):
+            return
+        if field is None:
+            self.remove_key(table, key, not deleted)
+        else:
+            self.remove_field(table, key, field, not deleted)
+
+    def invalidate_table(self, table):
+        # 只摘下表数据，释放交给 reclaimer，持锁时间与表大小无关
+        garbage = [self.tables.pop(table, None)]
+        self.sweeps.pop(table, None)
+        self.reborn.pop(table, None)
+        if table in self.policies:
+            garbage += [self.policies[table], self.key_bytes[table]]
+            self.reset_policy(table)
+        if table in self.indexes:
+            garbage.append(self.indexes[table])
+            self.indexes[table] = ShardIndex(self.index_fields[table])
+            self.index_losses[table] += 1
+        self._discard(*garbage)
+
+    def remove_field(self, table, key, field, lost=True):
+        row = self.tables[table][key]
+        values = row.remove(field)
+        if values:
+            self._unindex(table, key, field, lost)
+            self._after_remove(table, key, row, values)
+
+    def _unindex(self, table, key, field=None, lost=True):
+        index = self.indexes.get(table)
+        if index is not None:
+            if field is ROW:
+                # 紧凑行整行过期时可能仍保留逐字段过期未到的字段
+                row = self.tables[table].get(key)
+                for name in index.fields:
+                    if row is None or row.peek(name) is ABSENT:
+                        index.discard(key, name)
+            else:
+                index.discard(key, field)
+            if lost:
+                self.index_losses[table] += 1
+
+    def _after_remove(self, table, key, row, values):
+        if table in self.policies:
+            delta = sum(estimate_size(value) for value in values)
+            sizes = self.key_bytes[table]
+            sizes[key] = sizes.get(key, 0) - delta
+            self.table_bytes[table] -= delta
+        if not row:
+            self.remove_key(table, key, False)
+
+    def remove_key(self, table, key, lost=True):
+        self.tables[table].pop(key, None)
+        self._unindex(table, key, None, lost)
+        policy = self.policies.get(table)
+        if policy is not None:
+            policy.remove(key)
+            self.table_bytes[table] -= self.key_bytes[table].pop(key, 0)
+
+    def enforce_limits(self, table):
+        max_entries, max_bytes, _ = self.limits[table]
+        policy = self.policies[table]
+        keys = self.tables[table]
+        while ((max_entries is not None and len(keys) > max_entries)
+               or (max_bytes is not None and self.table_bytes[table] > max_bytes)):
+            victim = policy.evict()
+            if victim is None:
+                break
+            keys.pop(victim, None)
+            self.table_bytes[table] -= self.key_bytes[table].pop(victim, 0)
+            self.evictions[table] += 1
+            self._unindex(table, victim)
+
+    def select(self, table, key_field, filters, fields, now, strict):
+        index = self.indexes.get(table)
+        if strict and index is None:
+            return None
+        rows = select_rows(self.tables.get(table, {}), index, key_field, filters, fields, now, strict)
+        if rows and table in self.sweeps:
+            rows = [(key, values) for key, values in rows if not self.is_stale(table, key)]
+        return rows
 
-    def is_expired(self):
-        return self.expire_at is not None and time.time() > self.expire_at
+    def reconcile(self, table, keys, fields, old_ttl, new_ttl, now):
+        """
+        配置热加载后处理一批主键：删除已移出配置的 fields，并把按旧 TTL 写入的条目的过期时间平移为新 TTL
+        （旧配置无 TTL 时无过期时间的条目从 now 起算；负缓存不变）。条目不记录写入时使用的 TTL，
+        显式指定 ttl 写入的条目同样平移。紧凑行整行调整，仍共享一个过期时间。
+        """
+        rows = self.tables.get(table)
+        if rows is None:
+            return
+        grace = self.grace.get(table, 0)
+        delta = None if old_ttl is None else new_ttl - old_ttl
+        start = now + new_ttl if old_ttl is None else None
+        for key in keys:
+            row = rows.get(key)
+            if row is None:
+                continue
+            for field in fields:
+                if row.peek(field) is not ABSENT:
+                    self.remove_field(table, key, field, lost=False)
+            if new_ttl is None or key not in rows:
+                continue
+            for token, expire_at in row.retime(delta, start):
+                self.schedule_expiry(table, key, token, expire_at + grace)
 
 class CacheManager:
     """
     支持表-字段-主键粒度的内存缓存，带 TTL 和命中率统计。
-    结构: cache[table][key][field] = CacheEntry
+    按 (table, key) 哈希分为 N 个独立加锁的分段（cache.yaml 中的 shards，向上取 2 的幂），
+    命中/未命中计数按分段累计，读取统计时再汇总。
+    表可在 cache.yaml 中配置 max_entries（主键数）/max_bytes 上限及 eviction 淘汰策略（lru/tinylfu），
+    超限时按主键整行淘汰；上限按分段数拆分到各分段，各段之和等于配置值。
+    配置 compact: true 的表按 fields 顺序紧凑存储，每个主键一个 CompactRow，字段级读写语义不变。
+    配置 indexes 的表维护哈希二级索引；全量同步后标记为常驻（mark_resident），
+    常驻期间 select 可在本地执行结构化查询，任何淘汰、过期或失效都会使常驻状态失效。
+    配置 stale_grace 的表，带 TTL 的条目过期后再保留 stale_grace 秒：get/get_many/get_row/select 等读取
+    按逻辑过期时间视为未命中，只有 lookup_expiry 在宽限期内仍返回旧值，供回源层返回旧值并后台刷新。
+    配置 encoding 的表（及其结构化查询结果）按 ValueCodec 在锁外编码后写入，读取时在锁外解码；
+    编码字段上的过滤条件无法在本地匹配，select 返回 None 由调用方回源。
+    表级失效与 clear 为 O(1)：各分段摘下表数据后立即未命中，由后台 Reclaimer 分片释放；
+    invalidate_prefix 按主键前缀失效，匹配的行立即未命中，后台分批清扫（清扫完成前 table_size 仍计入这些行）。
     """
-    def __init__(self):
-        self.cache = defaultdict(lambda: defaultdict(dict))
-        self.lock = threading.RLock()
-        self.hits = 0
-        self.misses = 0
+    def __init__(self, config_loader=None, shards=None):
+        self.config = config_loader or ConfigLoader()
+        count = 1
+        while count < (shards or self.config.get_shard_count() or 1):
+            count <<= 1
+        self._mask = count - 1
+        self.limits = self._load_limits()
+        shard_limits = self._shard_limits(count)
+        self.layouts = self._load_layouts()
+        self.index_fields = self._load_index_fields()
+        compiled = self.config.get_compiled()
+        self.grace = dict(compiled.grace)  # 与各分段共享，热加载时原地更新
+        self.columns = compiled.columns
+        self.codecs = self._load_codecs(compiled)
+        reclaim = self.config.get_reclaim_config()
+        self.reclaimer = Reclaimer(reclaim.get('slice_items', 1000), reclaim.get('pause', 0.0005))
+        self.sweep_keys = reclaim.get('sweep_keys', 256)
+        self.shards = [CacheShard(limits, self.layouts, self.index_fields, self.grace, self.reclaimer)
+                       for limits in shard_limits]
+        self.resident = {}  # {table: 标记常驻时各分段的 index_losses}
+        self.reaper = None
+        self.reconciler = None
+
+    def _load_limits(self):
+        limits = {}
+        for conf in self.config.get_cache_config():
+            max_entries = conf.get('max_entries')
+            max_bytes = conf.get('max_bytes')
+            if max_entries or max_bytes:
+                limits[conf['table']] = (max_entries, max_bytes, conf.get('eviction'))
+        return limits
+
+    def _load_layouts(self):
+        compiled = self.config.get_compiled()
+        return {
+            table: compiled.positions[table]
+            for table, conf in compiled.tables.items()
+            if conf.get('compact') and conf.get('fields')
+        }
+
+    def _load_index_fields(self):
+        return {
+            conf['table']: list(conf.get('indexes') or [])
+            for conf in self.config.get_cache_config()
+            if 'indexes' in conf
+        }
+
+    def _load_codecs(self, compiled):
+        codecs = {}
+        for table, conf in compiled.tables.items():
+            codec = ValueCodec.from_config(conf)
+            if codec is None:
+                continue
+            codecs[table] = codec
+            # JSON 会把结果行的元组读回为列表，查询结果只用 pickle 编码
+            if not codec.json and (conf['encoding'] is True or conf['encoding'].get('query_results', True)):
+                codecs[query_namespace(table)] = ValueCodec.from_config(conf, [QUERY_FIELD])
+        return codecs
+
+    def _encode(self, table, field, value):
+        codec = self.codecs.get(table)
+        if codec is None or field not in codec.fields:
+            return value
+        return codec.encode(value)
+
+    def _decode(self, table, value):
+        if value.__class__ is not EncodedValue:
+            return value
+        codec = self.codecs.get(table)
+        return decode_value(value) if codec is None else codec.decode(value)
+
+    def _shard_limits(self, count):
+        """
+        按分段拆分各表上限，返回每个分段一份 {table: (max_entries, max_bytes, eviction)}。
+        每段分得 total // count，余数分给前 total % count 个分段，各段之和恰好等于配置值；
+        份额为 0 的分段不保留该表的条目（上限小于分段数时只有部分分段能缓存）。
+        """
+        def split(total, index):
+            if not total:
+                return None
+            return total // count + (1 if index < total % count else 0)
+        return [
+            {
+                table: (split(max_entries, index), split(max_bytes, index), eviction)
+                for table, (max_entries, max_bytes, eviction) in self.limits.items()
+            }
+            for index in range(count)
+        ]
+
+    def _shard(self, table, key):
+        return self.shards[hash((table, key)) & self._mask]
 
     def set(self, table, key, field, value, ttl=None):
         expire_at = time.time() + ttl if ttl else None
-        with self.lock:
-            self.cache[table][key][field] = CacheEntry(value, expire_at)
+        if self.codecs:
+            value = self._encode(table, field, value)
+        shard = self.shards[hash((table, key)) & self._mask]
+        with shard.lock:
+            shard.set(table, key, field, value, expire_at)
 
     def get(self, table, key, field):
-        with self.lock:
-            entry = self.cache.get(table, {}).get(key, {}).get(field)
-            if entry and not entry.is_expired():
-                self.hits += 1
-                return entry.value
+        shard = self.shards[hash((table, key)) & self._mask]
+        with shard.lock:
+            value = shard.get(table, key, field)
+        if value is ABSENT or value is NEGATIVE:
+            return None
+        return self._decode(table, value)
+
+    def lookup(self, table, key, field):
+        """
+        与 get 相同，但未命中返回 ABSENT、负缓存返回 NEGATIVE，便于区分“缓存了 None”与未命中。
+        """
+        shard = self.shards[hash((table, key)) & self._mask]
+        with shard.lock:
+            value = shard.get(table, key, field)
+        return self._decode(table, value)
+
+    def lookup_expiry(self, table, key, field):
+        """
+        与 lookup 相同，同时返回逻辑过期时间（无 TTL 或未命中为 None）；
+        配置了 stale_grace 的表在逻辑过期后的宽限期内仍返回旧值，由调用方据过期时间判断。
+        """
+        shard = self.shards[hash((table, key)) & self._mask]
+        with shard.lock:
+            value, expire_at = shard.get_expiry(table, key, field)
+        return self._decode(table, value), expire_at
+
+    def _group_by_shard(self, table, items):
+        groups = {}
+        mask = self._mask
+        for item in items:
+            idx = hash((table, item[0])) & mask
+            group = groups.get(idx)
+            if group is None:
+                groups[idx] = [item]
             else:
-                self.misses += 1
-                # 过期则清理
-                if entry:
-                    del self.cache[table][key][field]
-                return None
+                group.append(item)
+        return groups
+
+    def get_many(self, table, pairs):
+        """
+        批量读取 [(key, field), ...]，每个分段只加锁一次。
+        返回 {(key, field): value}，仅包含命中的项。
+        """
+        result = self.lookup_many(table, pairs)
+        return {pair: value for pair, value in result.items() if value is not NEGATIVE}
+
+    def lookup_many(self, table, pairs):
+        """
+        与 get_many 相同，但结果中保留负缓存项（值为 NEGATIVE）。
+        """
+        result = {}
+        for idx, group in self._group_by_shard(table, pairs).items():
+            shard = self.shards[idx]
+            with shard.lock:
+                shard.get_many(table, group, result)
+        if table in self.codecs:
+            for pair, value in result.items():
+                if value.__class__ is EncodedValue:
+                    result[pair] = self._decode(table, value)
+        return result
+
+    def get_row(self, table, key, fields=None):
+        """
+        读取同一主键的多个字段（fields 为 None 时读取全部已缓存字段），返回 {field: value}。
+        """
+        shard = self.shards[hash((table, key)) & self._mask]
+        with shard.lock:
+            row = shard.get_row(table, key, fields)
+        return {field: self._decode(table, value) for field, value in row.items() if value is not NEGATIVE}
+
+    def set_many(self, table, items, ttl=None):
+        """
+        批量写入，items 为 {(key, field): value} 或 [(key, field, value), ...]，每个分段只加锁一次。
+        """
+        if isinstance(items, dict):
+            items = [(key, field, value) for (key, field), value in items.items()]
+        expire_at = time.time() + ttl if ttl else None
+        codec = self.codecs.get(table)
+        if codec is not None:
+            items = [(key, field, codec.encode(value) if field in codec.fields else value)
+                     for key, field, value in items]
+        for idx, group in self._group_by_shard(table, items).items():
+            shard = self.shards[idx]
+            with shard.lock:
+                for key, field, value in group:
+                    shard.set(table, key, field, value, expire_at)
+
+    def invalidate_many(self, table, keys, fields=None, deleted=False):
+        """
+        批量失效多个主键；fields 为 None 时整行失效，否则只失效指定字段。
+        deleted=True 表示这些行已在数据库中删除，不影响表的常驻状态。
+        """
+        for idx, group in self._group_by_shard(table, [(key,) for key in keys]).items():
+            shard = self.shards[idx]
+            with shard.lock:
+                for (key,) in group:
+                    if fields is None:
+                        shard.invalidate(table, key, deleted=deleted)
+                    else:
+                        for field in fields:
+                            shard.invalidate(table, key, field, deleted)
 
     def invalidate(self, table, key=None, field=None):
-        with self.lock:
-            if key is None:
-                self.cache.pop(table, None)
-            elif field is None:
-                self.cache.get(table, {}).pop(key, None)
-            else:
-                self.cache.get(table, {}).get(key, {}).pop(field, None)
+        if key is None:
+            # 表级失效逐个分段摘下表数据，释放在后台进行
+            for shard in self.shards:
+                with shard.lock:
+                    shard.invalidate_table(table)
+            return
+        shard = self._shard(table, key)
+        with shard.lock:
+            shard.invalidate(table, key, field)
+
+    def invalidate_prefix(self, table, prefix):
+        """
+        失效主键以 prefix 开头的所有行：字符串前缀匹配字符串主键，元组（或单个值，视为一元组）
+        匹配复合主键的前若干列。匹配的行立即未命中，之后写入的行不受影响；
+        各分段持锁只登记前缀，删除由后台任务每次持锁最多 sweep_keys 个主键分批完成。
+        """
+        if not isinstance(prefix, (str, tuple)):
+            prefix = (prefix,)
+        for shard in self.shards:
+            with shard.lock:
+                epoch = shard.invalidate_prefix(table, prefix)
+            if epoch is not None:
+                self.reclaimer.submit(self._sweep(shard, table, epoch))
+
+    def _sweep(self, shard, table, epoch):
+        with shard.lock:
+            keys = list(shard.tables.get(table, ()))
+        for offset in range(0, len(keys), self.sweep_keys):
+            yield 0
+            with shard.lock:
+                removed = shard.sweep(table, keys[offset:offset + self.sweep_keys])
+            yield removed
+        with shard.lock:
+            shard.finish_sweep(table, epoch)
+
+    def residency_token(self, table):
+        """
+        返回表当前的数据丢失计数快照；全量同步开始前获取，完成后传给 mark_resident。
+        未配置 indexes 的表返回 None。
+        """
+        if table not in self.index_fields:
+            return None
+        token = []
+        for shard in self.shards:
+            with shard.lock:
+                token.append(shard.index_losses[table])
+        return tuple(token)
+
+    def mark_resident(self, table, token):
+        """
+        标记表已完整缓存；若同步期间已有数据丢失（快照不一致）则不标记，返回是否成功。
+        """
+        if token is None or token != self.residency_token(table):
+            return False
+        self.resident[table] = token
+        return True
+
+    def is_resident(self, table):
+        token = self.resident.get(table)
+        return token is not None and token == self.residency_token(table)
+
+    def select(self, table, key_field, filters, fields, limit=None, offset=None, require_resident=True):
+        """
+        在缓存上执行等值/IN 过滤、字段投影与分页，返回行元组列表（按主键排序）。
+        require_resident=True 时表须已标记常驻，否则（或扫描中发现数据已丢失）返回 None，调用方应回源；
+        过滤列或投影列不在主键与配置的 fields 中时同样返回 None。
+        """
+        if not covers_query(self.columns.get(table), filters, fields):
+            return None
+        codec = self.codecs.get(table)
+        if codec is not None and not codec.fields.isdisjoint(filters or ()):
+            return None
+        token = self.resident.get(table)
+        if require_resident and token is None:
+            return None
+        now = time.time()
+        matched = []
+        for idx, shard in enumerate(self.shards):
+            with shard.lock:
+                if require_resident and shard.index_losses[table] != token[idx]:
+                    return None
+                rows = shard.select(table, key_field, filters, fields, now, require_resident)
+            if rows is None:
+                return None
+            matched.extend(rows)
+        try:
+            matched.sort(key=lambda item: item[0])
+        except TypeError:
+            pass
+        start = offset or 0
+        end = start + limit if limit else None
+        if codec is not None:
+            return [tuple(self._decode(table, value) for value in values) for _, values in matched[start:end]]
+        return [tuple(values) for _, values in matched[start:end]]
+
+    def start_expiry(self, interval=0.1, slice_items=256, slice_time=0.001):
+        """
+        启动后台主动过期回收线程（重复调用无副作用）。
+        """
+        if self.reaper is None or not self.reaper.is_running():
+            self.reaper = ExpiryReaper(self, interval, slice_items, slice_time)
+            self.reaper.start()
+        return self.reaper
+
+    def stop_expiry(self):
+        if self.reaper is not None:
+            self.reaper.stop()
+
+    def expire_step(self, max_items=256, slice_time=0.001):
+        """
+        对每个分段执行一次限时限量的过期回收，返回回收条目数。
+        """
+        now = time.time()
+        removed = 0
+        for shard in self.shards:
+            while True:
+                with shard.lock:
+                    count, processed = shard.expire_due(now, max_items, time.perf_counter() + slice_time)
+                removed += count
+                if processed < max_items:
+                    break
+        return removed
+
+    def apply_config(self, old, new, batch_keys=256):
+        """
+        配置热加载（ConfigLoader.reload 的监听者）后调整运行中的缓存，old/new 为 CompiledConfig：
+        宽限期与可查询列立即生效，从配置中删除的表立即整表失效；
+        删除的字段与 TTL 变化的表由后台线程逐分段处理，每次持锁最多 batch_keys 个主键，
+        已缓存条目的过期时间按新旧 TTL 之差平移，无需重启或清空缓存。
+        encoding 修改的表整表失效（连同查询结果），避免本地查询以旧编码匹配过滤条件。
+        表上限、紧凑存储与二级索引在创建时确定，修改后需重启生效。返回后台线程（无需处理时为 None）。
+        """
+        self.grace.clear()
+        self.grace.update(new.grace)
+        self.columns = new.columns
+        self.codecs = self._load_codecs(new)
+        removed_tables, removed_fields, ttl_changes = old.diff(new)
+        for table in removed_tables:
+            self.invalidate(table)
+        for table, conf in new.tables.items():
+            if table in old.tables and old.tables[table].get('encoding') != conf.get('encoding'):
+                self.invalidate(table)
+                self.invalidate(query_namespace(table))
+        if not removed_fields and not ttl_changes:
+            return None
+        self.reconciler = threading.Thread(target=self._reconcile, args=(removed_fields, ttl_changes, batch_keys),
+                                           name='pg-cache-reconcile', daemon=True)
+        self.reconciler.start()
+        return self.reconciler
+
+    def _reconcile(self, removed_fields, ttl_changes, batch_keys):
+        now = time.time()
+        for table in set(removed_fields) | set(ttl_changes):
+            fields = removed_fields.get(table, ())
+            old_ttl, new_ttl = ttl_changes.get(table, (None, None))
+            for shard in self.shards:
+                with shard.lock:
+                    keys = list(shard.tables.get(table, ()))
+                for offset in range(0, len(keys), batch_keys):
+                    with shard.lock:
+                        shard.reconcile(table, keys[offset:offset + batch_keys], fields, old_ttl, new_ttl, now)
+
+    def table_size(self, table):
+        """
+        返回表当前缓存的主键数。
+        """
+        return sum(len(shard.tables.get(table, {})) for shard in self.shards)
+
+    def table_stats(self, sample=64):
+        """
+        返回 {table: {'keys': 主键数, 'bytes': 估算内存}}。有容量上限的表使用精确累计的字节数，
+        其余表每个分段抽样 sample 行估算平均行大小，避免采集时遍历全部数据。
+        """
+        stats = {}
+        for shard in self.shards:
+            with shard.lock:
+                for table, keys in shard.tables.items():
+                    count = len(keys)
+                    if table in shard.policies:
+                        size = shard.table_bytes[table]
+                    else:
+                        sampled = 0
+                        size = 0
+                        for row in keys.values():
+                            size += sys.getsizeof(row) + sum(estimate_size(v) for _, v, _ in row.entries())
+                            sampled += 1
+                            if sampled >= sample:
+                                break
+                        size = size * count // sampled if sampled else 0
+                    entry = stats.setdefault(table, {'keys': 0, 'bytes': 0})
+                    entry['keys'] += count
+                    entry['bytes'] += size + sys.getsizeof(keys)
+        return stats
 
     def get_stats(self):
-        with self.lock:
-            total = self.hits + self.misses
-            hit_rate = self.hits / total if total else 0
-            return {
-                'hits': self.hits,
-                'misses': self.misses,
-                'hit_rate': hit_rate
-            }
+        hits = misses = expired = scheduled = backlog = 0
+        evictions = defaultdict(int)
+        now = time.time()
+        for shard in self.shards:
+            with shard.lock:
+                hits += shard.hits
+                misses += shard.misses
+                expired += shard.expired
+                scheduled += shard.expiry_scheduled
+                backlog += shard.expiry_backlog(now)
+                for table, count in shard.evictions.items():
+                    evictions[table] += count
+        total = hits + misses
+        hit_rate = hits / total if total else 0
+        return {
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': hit_rate,
+            'evictions': sum(evictions.values()),
+            'evictions_by_table': dict(evictions),
+            'expired': expired,
+            'expiry_scheduled': scheduled,
+            'expiry_backlog': backlog,
+            'expired_per_second': self.reaper.expired_per_second if self.reaper else 0,
+            'encoding': {table: codec.stats() for table, codec in self.codecs.items()},
+            'reclaim_pending': self.reclaimer.pending(),
+            'reclaimed': self.reclaimer.reclaimed
+        }
 
     def clear(self):
-        with self.lock:
-            self.cache.clear()
-            self.hits = 0
-            self.misses = 0
+        for shard in self.shards:
+            with shard.lock:
+                shard.reset()
 
     def dump_cache(self):
-        with self.lock:
-            result = {}
-            for table, keys in self.cache.items():
-                result[table] = {}
-                for key, fields in keys.items():
-                    result[table][key] = {}
-                    for field, entry in fields.items():
-                        if not entry.is_expired():
-                            result[table][key][field] = entry.value
-            return result
+        result = {}
+        for shard in self.shards:
+            with shard.lock:
+                for table, keys in shard.tables.items():
+                    table_result = result.setdefault(table, {})
+                    now = time.time()
+                    for key, row in keys.items():
+                        if shard.is_stale(table, key):
+                            continue
+                        fields = {field: self._decode(table, value) for field, value, expire_at in row.entries()
+                                  if expire_at is None or now <= expire_at}
+                        if fields:
+                            table_result[key] = fields
+        return result
 
     def dump_cache_to_file(self, filepath='cache_dump.json'):
         data = self.dump_cache()
         with open(filepath, 'w', encoding='utf-8') as f:
             json.dump(data, f, ensure_ascii=False, indent=2)
 
+    def save_snapshot(self, path, tables=None, chunk_keys=1000):
+        """
+        写入二进制快照（保留主键类型与过期时间），逐分段分块持锁，见 src/snapshot.py。
+        """
+        return write_snapshot(self, path, tables, chunk_keys)
+
+    def load_snapshot(self, path, tables=None):
+        """
+        从二进制快照预热缓存，跳过已过期条目；恢复的表不会被标记为常驻。
+        """
+        return read_snapshot(self, path, tables)
+
+    def restore_rows(self, table, rows):
+        """
+        写入快照中的行 [(key, [(field, value, expire_at), ...])]，expire_at 为绝对时间，
+        已过期的条目跳过；值按当前 encoding 配置重新编码或解码。返回 (写入条目数, 跳过条目数)。
+        """
+        now = time.time()
+        skipped = 0
+        codec = self.codecs.get(table)
+        # 与 set_many 一样在锁外编解码，加载大快照时不阻塞同分段的读取
+        prepared = []
+        for key, entries in rows:
+            kept = []
+            for field, value, expire_at in entries:
+                if expire_at is not None and expire_at <= now:
+                    skipped += 1
+                    continue
+                if codec is not None and field in codec.fields:
+                    value = codec.encode(value)
+                elif value.__class__ is EncodedValue:
+                    value = decode_value(value)
+                kept.append((field, value, expire_at))
+            if kept:
+                prepared.append((key, kept))
+        written = 0
+        for idx, group in self._group_by_shard(table, prepared).items():
+            shard = self.shards[idx]
+            with shard.lock:
+                for key, entries in group:
+                    for field, value, expire_at in entries:
+                        shard.set(table, key, field, value, expire_at)
+                    written += len(entries)
+        return written, skipped
+
+def create_cache_manager(config_loader=None):
+    """
+    按 cache.yaml 的 backend 创建缓存：memory 为进程内 CacheManager，shared_memory 为跨进程共享内存后端。
+    """
+    config = config_loader or ConfigLoader()
+    backend = config.get_backend()
+    if backend == 'memory':
+        return CacheManager(config_loader=config)
+    if backend == 'shared_memory':
+        from src.shm_cache import SharedMemoryCache
+        return SharedMemoryCache(config_loader=config)
+    raise ValueError(f'未知的缓存后端: {backend}')
+
 # 用法示例
 if __name__ == '__main__':
     cm = CacheManager()
@@ -89,4 +956,4 @@ if __name__ == '__main__':
     print('get:', cm.get('user', 1, 'name'))
     time.sleep(2.1)
     print('get after expire:', cm.get('user', 1, 'name'))
-    print('stats:', cm.get_stats()) 
\ No newline at end of file
+    print('stats:', cm.get_stats())
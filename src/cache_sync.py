@@ -1,11 +1,68 @@
-from src.cache_manager import CacheManager
+from src.cache_manager import CacheManager, ABSENT, NEGATIVE
 from src.db_client import PostgresClient
 from src.config_loader import ConfigLoader
+from src.single_flight import SingleFlight
+from src.batch_loader import BatchLoader
+from src.refresh import RefreshAhead
 import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# 以下函数不涉及 IO，CacheSync 与 AsyncPgCacheAPI 共用，数据库访问由调用方（同步或异步）完成
+
+def lookup_refresh(cache, table, key, field, ahead):
+    """
+    读取条目并按逻辑过期时间判断是否需要后台刷新，返回 (value, 是否需要刷新, 是否为宽限期内的旧值)。
+    """
+    value, expire_at = cache.lookup_expiry(table, key, field)
+    if value is ABSENT or expire_at is None:
+        return value, False, False
+    now = time.time()
+    if now < expire_at - ahead:
+        return value, False, False
+    return value, True, now > expire_at
+
+def field_query(table, field, cache_conf):
+    return f"SELECT {field} FROM {table} WHERE {cache_conf['key_field']} = %s"
+
+def fill_field(cache, table, key, field, cache_conf, row):
+    """
+    用 field_query 查到的行回填缓存（row 为 None 时按 negative_ttl 负缓存），返回字段值。
+    """
+    if row:
+        value = row[0]
+        cache.set(table, key, field, value, cache_conf.get('ttl'))
+        return value
+    negative_ttl = cache_conf.get('negative_ttl')
+    if negative_ttl:
+        cache.set(table, key, field, NEGATIVE, negative_ttl)
+    return None
+
+def sync_query(table, cache_conf, key_range=None):
+    """
+    生成批量同步查询 (sql, params)：SELECT key, fields... ，key_range 为 (start, end) 或 None 表示全量。
+    """
+    key_field = cache_conf['key_field']
+    sql = f"SELECT {key_field},{','.join(cache_conf['fields'])} FROM {table}"
+    if not key_range:
+        return sql, ()
+    return sql + f" WHERE {key_field} >= %s AND {key_field} <= %s", (key_range[0], key_range[1])
+
+def fill_rows(cache, table, fields, rows, ttl):
+    """
+    把 (key, f1, f2, ...) 形式的行按 fields 顺序写入缓存。
+    """
+    cache.set_many(table, [(row[0], field, row[idx + 1]) for row in rows for idx, field in enumerate(fields)], ttl)
 
 class CacheSync:
     """
     回源与同步层：未命中自动回源，支持批量同步和进度记录。
+    并发未命中按 (table, key, field) 合并为一次回源；不存在的记录按 negative_ttl 负缓存。
+    load_many 按整行批量回源（WHERE key = ANY(%s)，按 load_chunk_size 分块）；
+    配置了 batch_window 的表，不同线程的单 key 未命中会在窗口内合并为一次批量回源。
+    全量同步（不指定 key_range）完成且期间缓存未丢失数据时，表被标记为常驻，结构化查询可在本地执行。
+    配置了 refresh_ahead 的表，距逻辑过期不足 refresh_ahead 秒时被读取的条目会提交后台刷新；
+    配置了 stale_grace 的表，逻辑过期后 stale_grace 秒内仍返回旧值并触发刷新，热点 key 到期时读取不阻塞。
     """
     def __init__(self, cache_manager=None, db_client=None, config_loader=None):
         self.config = config_loader or ConfigLoader()
@@ -13,26 +70,135 @@ class CacheSync:
         self.cache = cache_manager or CacheManager()
         self.db = None if self.no_db_mode else (db_client or PostgresClient())
         self.sync_progress = {}  # {table: last_synced_key}
+        self.sync_state = {}     # {table: 流式同步状态}
+        self.partition_state = {}  # {table: [并行同步各分区状态]}
         self.lock = threading.RLock()
+        self.flight = SingleFlight()
+        self.batcher = BatchLoader(self.load_many)
+        self.negative_hits = 0
+        self.batch_queries = 0
+        self.metrics = None  # MetricsRegistry，由 PgCacheAPI 注入
+        refresh = self.config.get_refresh_config()
+        self.refresher = RefreshAhead(refresh.get('workers', 4), refresh.get('max_pending', 1000))
 
     def get_with_fallback(self, table, key, field):
-        value = self.cache.get(table, key, field)
-        if value is not None:
+        ahead = self.config.get_compiled().refresh_ahead.get(table)
+        if ahead is None:
+            value, stale = self.cache.lookup(table, key, field), False
+        else:
+            value, stale = self._lookup_refresh(table, key, field, ahead)
+        metrics = self.metrics
+        if value is NEGATIVE:
+            with self.lock:
+                self.negative_hits += 1
+            if metrics is not None:
+                metrics.inc('pg_cache_requests_total', (table, 'negative'))
+            return None
+        if value is not ABSENT:
+            if metrics is not None:
+                metrics.inc('pg_cache_requests_total', (table, 'stale' if stale else 'hit'))
             return value
+        if metrics is not None:
+            metrics.inc('pg_cache_requests_total', (table, 'miss'))
         if self.no_db_mode:
             return None
         # 回源
         cache_conf = self._get_cache_conf(table)
         if not cache_conf or field not in cache_conf['fields']:
             return None
-        sql = f"SELECT {field} FROM {table} WHERE {cache_conf['key_field']} = %s"
-        row = self.db.query_one(sql, (key,))
-        if row:
-            value = row[0]
-            ttl = cache_conf.get('ttl')
-            self.cache.set(table, key, field, value, ttl)
+        window = cache_conf.get('batch_window')
+        if window:
+            row = self.batcher.load(table, key, window)
+            return row.get(field) if row else None
+        # 同一 (table, key, field) 的并发未命中合并为一次数据库查询
+        return self.flight.do((table, key, field), lambda: self._load_field(table, key, field, cache_conf))
+
+    def _lookup_refresh(self, table, key, field, ahead):
+        """
+        读取条目，需要时提交后台刷新，返回 (value, 是否为宽限期内的旧值)。
+        """
+        value, due, stale = lookup_refresh(self.cache, table, key, field, ahead)
+        if not due or self.no_db_mode:
+            return value, False
+        self.refresher.submit(table, (table, key, field), lambda: self._refresh_field(table, key, field))
+        if stale:
+            self.refresher.record_stale(table)
+        return value, stale
+
+    def _refresh_field(self, table, key, field):
+        cache_conf = self._get_cache_conf(table)
+        if cache_conf and field in cache_conf['fields']:
+            self._fetch_field(table, key, field, cache_conf, 'refresh')
+
+    def _load_field(self, table, key, field, cache_conf):
+        # 等待锁期间可能已被其他请求回填
+        value = self.cache.lookup(table, key, field)
+        if value is NEGATIVE:
+            return None
+        if value is not ABSENT:
             return value
-        return None
+        return self._fetch_field(table, key, field, cache_conf, 'fallback')
+
+    def _fetch_field(self, table, key, field, cache_conf, op):
+        """
+        查询数据库并回填缓存（不存在时按 negative_ttl 负缓存），返回字段值。
+        """
+        row = self._db_query(table, op, field_query(table, field, cache_conf), (key,), one=True)
+        return fill_field(self.cache, table, key, field, cache_conf, row)
+
+    def load_many(self, table, keys):
+        """
+        读穿加载多行：已完整缓存的 key 直接返回，其余 key 一次性回源全部配置字段并回填缓存。
+        返回 {key: {field: value}}，不存在的 key 不出现在结果中（并按 negative_ttl 负缓存）。
+        """
+        cache_conf = self._get_cache_conf(table)
+        if not cache_conf:
+            return {}
+        fields = cache_conf['fields']
+        cached = self.cache.lookup_many(table, [(key, field) for key in keys for field in fields])
+        result = {}
+        missing = []
+        for key in dict.fromkeys(keys):
+            values = [cached.get((key, field), ABSENT) for field in fields]
+            if any(value is ABSENT for value in values):
+                missing.append(key)
+            elif values[0] is not NEGATIVE:
+                result[key] = dict(zip(fields, values))
+        if not missing or self.no_db_mode:
+            return result
+        key_field = cache_conf['key_field']
+        sql = f"SELECT {key_field},{','.join(fields)} FROM {table} WHERE {key_field} = ANY(%s)"
+        chunk_size = cache_conf.get('load_chunk_size', 1000)
+        ttl = cache_conf.get('ttl')
+        for start in range(0, len(missing), chunk_size):
+            chunk = missing[start:start + chunk_size]
+            rows = self._db_query(table, 'load_many', sql, (chunk,))
+            with self.lock:
+                self.batch_queries += 1
+            fill_rows(self.cache, table, fields, rows, ttl)
+            for row in rows:
+                result[row[0]] = dict(zip(fields, row[1:]))
+            negative_ttl = cache_conf.get('negative_ttl')
+            if negative_ttl:
+                absent = [key for key in chunk if key not in result]
+                self.cache.set_many(table, [(key, field, NEGATIVE) for key in absent for field in fields],
+                                    negative_ttl)
+        return result
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                'coalesced_waits': self.flight.coalesced,
+                'negative_hits': self.negative_hits,
+                'batch_queries': self.batch_queries,
+                'micro_batches': self.batcher.batches,
+                'micro_batch_merged': self.batcher.merged,
+                'refresh_in_flight': self.refresher.in_flight(),
+                'refresh': self.refresher.get_stats()
+            }
+
+    def close(self):
+        self.refresher.close()
 
     def batch_sync(self, table, key_range=None):
         """
@@ -46,35 +212,198 @@ class CacheSync:
             with self.lock:
                 self.sync_progress[table] = key_range[1] if key_range else 'ALL'
             return 0
+        sql, params = sync_query(table, cache_conf, key_range)
+        token = None if key_range else self.cache.residency_token(table)
+        start = time.perf_counter()
+        rows = self._db_query(table, 'batch_sync', sql, params, bulk=True)
+        fill_rows(self.cache, table, cache_conf['fields'], rows, cache_conf.get('ttl'))
+        count = len(rows)
+        self._record_sync(table, 'batch_sync', count, time.perf_counter() - start)
+        if token is not None:
+            self.cache.mark_resident(table, token)
+        with self.lock:
+            self.sync_progress[table] = key_range[1] if key_range else 'ALL'
+        return count
+
+    def stream_sync(self, table, key_range=None, chunk_size=None, resume=True):
+        """
+        流式批量同步：按主键键集分页（WHERE key > last ORDER BY key LIMIT n）逐块读取并回填缓存，
+        每块完成后记录进度；中断后再次调用（resume=True）从上次完成的主键继续。
+        返回本次同步的行数，吞吐见 get_sync_state。
+        """
+        cache_conf = self._get_cache_conf(table)
+        if not cache_conf:
+            return 0
+        if self.no_db_mode:
+            with self.lock:
+                self.sync_progress[table] = key_range[1] if key_range else 'ALL'
+            return 0
+        chunk_size = chunk_size or cache_conf.get('sync_chunk_size', 5000)
+        with self.lock:
+            state = self.sync_state.get(table)
+            if not (resume and state and not state['done'] and state['key_range'] == key_range):
+                state = self.sync_state[table] = self._new_sync_state(
+                    key_range, key_range[0] if key_range else None, key_range[1] if key_range else None)
+                state['residency'] = None if key_range else self.cache.residency_token(table)
+
+        def on_page(last_key):
+            self.sync_progress[table] = last_key
+
+        start = time.perf_counter()
+        count = self._sync_pages(table, cache_conf, chunk_size, state, on_page)
+        self._record_sync(table, 'stream_sync', count, time.perf_counter() - start)
+        if state.get('residency') is not None:
+            self.cache.mark_resident(table, state['residency'])
+        with self.lock:
+            self.sync_progress[table] = key_range[1] if key_range else 'ALL'
+        return count
+
+    def parallel_sync(self, table, partitions=None, workers=None, chunk_size=None):
+        """
+        并行分区同步：按主键范围把表切分为若干分区（数值主键按 min/max 等分，其他类型按分位数采样），
+        在线程池上并发流式同步，线程数默认为连接池 maxconn 的一半（至少 1），且不超过 maxconn，
+        为同时进行的回源查询保留连接，避免连接池耗尽。
+        各分区进度见 get_sync_progress(table, partitions=True)。返回同步的总行数。
+        """
+        cache_conf = self._get_cache_conf(table)
+        if not cache_conf:
+            return 0
+        if self.no_db_mode:
+            with self.lock:
+                self.sync_progress[table] = 'ALL'
+            return 0
+        maxconn = getattr(self.db, 'maxconn', 8)
+        workers = max(1, min(workers or maxconn // 2, maxconn))
+        partitions = partitions or workers
+        chunk_size = chunk_size or cache_conf.get('sync_chunk_size', 5000)
+        token = self.cache.residency_token(table)
+        bounds = self._partition_bounds(table, cache_conf['key_field'], partitions)
+        states = [self._new_sync_state((after, upper), None, upper, after) for after, upper in bounds]
+        with self.lock:
+            self.partition_state[table] = states
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f'sync-{table}') as pool:
+            futures = [pool.submit(self._sync_pages, table, cache_conf, chunk_size, state) for state in states]
+            count = sum(future.result() for future in futures)
+        self._record_sync(table, 'parallel_sync', count, time.perf_counter() - start)
+        if token is not None:
+            self.cache.mark_resident(table, token)
+        with self.lock:
+            self.sync_progress[table] = 'ALL'
+        return count
+
+    def _partition_bounds(self, table, key_field, partitions):
+        """
+        返回 [(after, upper), ...]：分区覆盖 after < key <= upper（after 为 None 表示无下界）。
+        """
+        row = self._db_query(table, 'partition', f"SELECT min({key_field}), max({key_field}) FROM {table}", one=True)
+        if not row or row[0] is None:
+            return []
+        low, high = row
+        if partitions <= 1:
+            uppers = [high]
+        elif isinstance(low, int) and isinstance(high, int):
+            step = max(1, -(-(high - low + 1) // partitions))
+            uppers = list(range(low + step - 1, high, step)) + [high]
+        else:
+            fractions = ','.join(str(i / partitions) for i in range(1, partitions))
+            sample = self._db_query(table, 'partition', f"SELECT percentile_disc(ARRAY[{fractions}]) "
+                                    f"WITHIN GROUP (ORDER BY {key_field}) FROM {table}", one=True)
+            uppers = sorted(set(sample[0] if sample and sample[0] else []) | {high})
+        return list(zip([None] + uppers[:-1], uppers))
+
+    def _new_sync_state(self, key_range, lower, upper, after=None):
+        return {
+            'key_range': key_range, 'lower': lower, 'upper': upper, 'last_key': after, 'done': False,
+            'rows': 0, 'elapsed': 0.0, 'rows_per_sec': 0.0
+        }
+
+    def _sync_pages(self, table, cache_conf, chunk_size, state, on_page=None):
+        """
+        从 state 记录的位置起按键集分页同步，直到 upper；每页完成后更新 state（调用 on_page(last_key)）。
+        """
         key_field = cache_conf['key_field']
-        fields = ','.join(cache_conf['fields'])
-        sql = f"SELECT {key_field},{fields} FROM {table}"
-        params = ()
-        if key_range:
-            sql += f" WHERE {key_field} >= %s AND {key_field} <= %s"
-            params = (key_range[0], key_range[1])
-        rows = self.db.query(sql, params)
-        count = 0
+        field_list = cache_conf['fields']
         ttl = cache_conf.get('ttl')
-        for row in rows:
-            key = row[0]
-            for idx, field in enumerate(cache_conf['fields']):
-                value = row[idx+1]
-                self.cache.set(table, key, field, value, ttl)
-            count += 1
         with self.lock:
-            self.sync_progress[table] = key_range[1] if key_range else 'ALL'
+            last_key = state['last_key']
+            base_elapsed = state['elapsed']
+        lower, upper = state['lower'], state['upper']
+        count = 0
+        start = time.perf_counter()
+        while True:
+            conds, params = [], []
+            if last_key is not None:
+                conds.append(f"{key_field} > %s")
+                params.append(last_key)
+            elif lower is not None:
+                conds.append(f"{key_field} >= %s")
+                params.append(lower)
+            if upper is not None:
+                conds.append(f"{key_field} <= %s")
+                params.append(upper)
+            where = f" WHERE {' AND '.join(conds)}" if conds else ''
+            sql = f"SELECT {key_field},{','.join(field_list)} FROM {table}{where} ORDER BY {key_field} LIMIT %s"
+            rows = self._db_query(table, 'sync_page', sql, tuple(params) + (chunk_size,))
+            if rows:
+                fill_rows(self.cache, table, field_list, rows, ttl)
+                last_key = rows[-1][0]
+                count += len(rows)
+            with self.lock:
+                state['last_key'] = last_key
+                state['rows'] += len(rows)
+                state['elapsed'] = base_elapsed + time.perf_counter() - start
+                state['rows_per_sec'] = state['rows'] / state['elapsed'] if state['elapsed'] else 0.0
+                if on_page and last_key is not None:
+                    on_page(last_key)
+            if len(rows) < chunk_size:
+                break
+        with self.lock:
+            state['done'] = True
         return count
 
-    def get_sync_progress(self, table):
+    def _db_query(self, table, op, sql, params=None, one=False, bulk=False):
+        """
+        执行数据库查询，启用指标时按 (table, op) 记录耗时。
+        bulk=True 时优先使用客户端的 copy_query（COPY TO STDOUT）批量读取。
+        """
+        if one:
+            execute = self.db.query_one
+        else:
+            execute = (getattr(self.db, 'copy_query', None) if bulk else None) or self.db.query
+        metrics = self.metrics
+        if metrics is None:
+            return execute(sql, params)
+        start = time.perf_counter()
+        try:
+            return execute(sql, params)
+        finally:
+            metrics.observe('pg_cache_db_query_seconds', (table, op), time.perf_counter() - start)
+
+    def _record_sync(self, table, mode, rows, seconds):
+        if self.metrics is not None:
+            self.metrics.inc('pg_cache_sync_rows_total', (table, mode), rows)
+            self.metrics.observe('pg_cache_sync_seconds', (table, mode), seconds)
+
+    def get_sync_progress(self, table, partitions=False):
+        """
+        返回表的同步进度；partitions=True 时返回最近一次并行同步各分区的状态列表。
+        """
         with self.lock:
+            if partitions:
+                return [dict(state) for state in self.partition_state.get(table, [])]
             return self.sync_progress.get(table)
 
+    def get_sync_state(self, table):
+        """
+        返回流式同步状态：last_key、done、累计 rows、elapsed 与 rows_per_sec。
+        """
+        with self.lock:
+            state = self.sync_state.get(table)
+            return dict(state) if state else None
+
     def _get_cache_conf(self, table):
-        for conf in self.config.get_cache_config():
-            if conf['table'] == table:
-                return conf
-        return None
+        return self.config.get_table_config(table)
 
 # 用法示例
 if __name__ == '__main__':
@@ -0,0 +1,304 @@
+import json
+import logging
+import queue
+import select
+import threading
+import time
+from datetime import datetime
+
+class ChangeEvent:
+    """
+    单条行变更事件。op: insert / update / delete / truncate；
+    values 为变更后的列值（可能只包含部分列），old_key 为更新前的主键（主键被修改时）。
+    """
+    __slots__ = ('table', 'op', 'key', 'values', 'old_key', 'commit_time', 'position')
+
+    def __init__(self, table, op, key=None, values=None, old_key=None, commit_time=None, position=None):
+        self.table = table
+        self.op = op
+        self.key = key
+        self.values = values
+        self.old_key = old_key
+        self.commit_time = commit_time  # 源端提交时间戳（秒）
+        self.position = position        # 源端位置（如 LSN），用于确认消费进度
+
+class EventSource:
+    """
+    变更事件源接口：poll 拉取一批事件，ack 确认已应用到缓存的位置。
+    """
+    def poll(self, max_events, timeout):
+        raise NotImplementedError
+
+    def ack(self, position):
+        pass
+
+    def close(self):
+        pass
+
+class InMemoryEventSource(EventSource):
+    """
+    内存事件源，用于测试和进程内集成。
+    """
+    def __init__(self):
+        self.queue = queue.Queue()
+        self.acked = None
+
+    def publish(self, event):
+        self.queue.put(event)
+
+    def poll(self, max_events, timeout):
+        events = []
+        try:
+            events.append(self.queue.get(timeout=timeout))
+            while len(events) < max_events:
+                events.append(self.queue.get_nowait())
+        except queue.Empty:
+            pass
+        return events
+
+    def ack(self, position):
+        self.acked = position
+
+class ListenNotifySource(EventSource):
+    """
+    基于 LISTEN/NOTIFY 的事件源，payload 由 trigger_sql 生成的触发器发送：
+    {"table": ..., "op": ..., "key": ..., "old_key": ..., "values": {...}, "ts": 提交时间戳}；
+    TRUNCATE 由语句级触发器发送 {"table": ..., "op": "truncate", "ts": ...}。
+    连接需为独立的 autocommit 连接（见 PostgresClient.connect）。
+    """
+    def __init__(self, connection, channel='pg_cache_changes'):
+        self.conn = connection
+        self.conn.autocommit = True
+        self.channel = channel
+        with self.conn.cursor() as cur:
+            cur.execute(f'LISTEN {channel}')
+
+    @staticmethod
+    def trigger_sql(table, key_field, channel='pg_cache_changes'):
+        """
+        生成发送变更通知的触发器 DDL：行级触发器通知 insert/update/delete，语句级触发器通知 truncate。
+        NOTIFY payload 上限 8000 字节，超长时只发送主键。
+        """
+        return f"""
+CREATE OR REPLACE FUNCTION pg_cache_notify_{table}() RETURNS trigger AS $$
+DECLARE
+    payload text;
+    new_row json := CASE WHEN TG_OP = 'DELETE' THEN NULL ELSE row_to_json(NEW) END;
+BEGIN
+    payload := json_build_object(
+        'table', TG_TABLE_NAME,
+        'op', lower(TG_OP),
+        'key', CASE WHEN TG_OP = 'DELETE' THEN OLD.{key_field} ELSE NEW.{key_field} END,
+        'old_key', CASE WHEN TG_OP = 'UPDATE' THEN OLD.{key_field} END,
+        'values', new_row,
+        'ts', extract(epoch from clock_timestamp()))::text;
+    IF octet_length(payload) > 7900 THEN
+        payload := json_build_object(
+            'table', TG_TABLE_NAME, 'op', lower(TG_OP),
+            'key', CASE WHEN TG_OP = 'DELETE' THEN OLD.{key_field} ELSE NEW.{key_field} END,
+            'old_key', CASE WHEN TG_OP = 'UPDATE' THEN OLD.{key_field} END,
+            'ts', extract(epoch from clock_timestamp()))::text;
+    END IF;
+    PERFORM pg_notify('{channel}', payload);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+CREATE OR REPLACE FUNCTION pg_cache_notify_truncate_{table}() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('{channel}', json_build_object(
+        'table', TG_TABLE_NAME,
+        'op', 'truncate',
+        'ts', extract(epoch from clock_timestamp()))::text);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+DROP TRIGGER IF EXISTS pg_cache_notify ON {table};
+CREATE TRIGGER pg_cache_notify AFTER INSERT OR UPDATE OR DELETE ON {table}
+    FOR EACH ROW EXECUTE FUNCTION pg_cache_notify_{table}();
+DROP TRIGGER IF EXISTS pg_cache_notify_truncate ON {table};
+CREATE TRIGGER pg_cache_notify_truncate AFTER TRUNCATE ON {table}
+    FOR EACH STATEMENT EXECUTE FUNCTION pg_cache_notify_truncate_{table}();
+"""
+
+    def poll(self, max_events, timeout):
+        if not self.conn.notifies and select.select([self.conn], [], [], timeout) == ([], [], []):
+            return []
+        self.conn.poll()
+        events = []
+        while self.conn.notifies and len(events) < max_events:
+            payload = json.loads(self.conn.notifies.pop(0).payload)
+            events.append(ChangeEvent(payload['table'], payload['op'], payload.get('key'), payload.get('values'),
+                                      payload.get('old_key'), payload.get('ts')))
+        return events
+
+    def close(self):
+        self.conn.close()
+
+class LogicalDecodingSource(EventSource):
+    """
+    基于逻辑解码（wal2json format-version 2）的事件源，需要 LogicalReplicationConnection 连接
+    和已创建的复制槽。ack 通过 send_feedback 推进槽位的 flush LSN。
+    """
+    def __init__(self, connection, slot_name, tables=None):
+        self.conn = connection
+        self.cur = connection.cursor()
+        options = {'format-version': '2', 'include-timestamp': '1', 'include-pk': '1'}
+        if tables:
+            options['add-tables'] = ','.join(tables)
+        self.cur.start_replication(slot_name=slot_name, decode=True, options=options)
+
+    def poll(self, max_events, timeout):
+        events = []
+        deadline = time.time() + timeout
+        while len(events) < max_events:
+            msg = self.cur.read_message()
+            if msg is None:
+                remaining = deadline - time.time()
+                if events or remaining <= 0:
+                    break
+                select.select([self.cur], [], [], remaining)
+                continue
+            event = self._parse(json.loads(msg.payload), msg.data_start)
+            if event is not None:
+                events.append(event)
+        return events
+
+    def _parse(self, change, lsn):
+        action = change.get('action')
+        ops = {'I': 'insert', 'U': 'update', 'D': 'delete', 'T': 'truncate'}
+        if action not in ops:
+            return None
+        values = {c['name']: c['value'] for c in change.get('columns', [])} or None
+        identity = {c['name']: c['value'] for c in change.get('identity', [])}
+        pk = [c['name'] for c in change.get('pk', [])]
+        key = values.get(pk[0]) if values and pk else (identity.get(pk[0]) if pk else None)
+        old_key = identity.get(pk[0]) if pk and identity else None
+        return ChangeEvent(change['table'], ops[action], key, values,
+                           old_key if old_key != key else None, self._timestamp(change.get('timestamp')), lsn)
+
+    def _timestamp(self, value):
+        if not value:
+            return None
+        try:
+            return datetime.fromisoformat(value).timestamp()
+        except ValueError:
+            return None
+
+    def ack(self, position):
+        if position is not None:
+            self.cur.send_feedback(flush_lsn=position)
+
+    def close(self):
+        self.conn.close()
+
+class CDCConsumer:
+    """
+    CDC 消费者：后台线程从事件源批量拉取变更，交给 CacheConsistency.apply_changes 批量失效或原地更新缓存，
+    并统计应用数量与消费延迟（当前时间 - 源端提交时间）。
+    应用失败的批次按 retry_backoff 指数退避重试 max_retries 次，仍失败则对批次涉及的表整表失效后再确认，
+    不会确认未反映到缓存的变更。
+    """
+    def __init__(self, source, consistency, mode='invalidate', batch_size=500, poll_timeout=1.0,
+                 max_retries=2, retry_backoff=0.05):
+        self.source = source
+        self.consistency = consistency
+        self.mode = mode
+        self.batch_size = batch_size
+        self.poll_timeout = poll_timeout
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.lock = threading.Lock()
+        self.logger = logging.getLogger('pg-cache')
+        self.events_applied = 0
+        self.batches = 0
+        self.errors = 0
+        self.apply_failures = 0
+        self.fallback_invalidations = 0
+        self.lag_seconds = 0.0
+        self.max_lag_seconds = 0.0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='pg-cache-cdc', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def run_once(self, timeout=None):
+        events = self.source.poll(self.batch_size, self.poll_timeout if timeout is None else timeout)
+        if not events:
+            return 0
+        self._apply(events)
+        self.source.ack(events[-1].position)
+        commit_times = [e.commit_time for e in events if e.commit_time is not None]
+        with self.lock:
+            self.events_applied += len(events)
+            self.batches += 1
+            if commit_times:
+                self.lag_seconds = max(0.0, time.time() - max(commit_times))
+                self.max_lag_seconds = max(self.max_lag_seconds, time.time() - min(commit_times))
+        return len(events)
+
+    def _apply(self, events):
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                self._stop.wait(self.retry_backoff * (2 ** (attempt - 1)))
+            try:
+                self.consistency.apply_changes(events, self.mode)
+                return
+            except Exception:
+                self.logger.exception('CDC 应用变更失败（第 %d 次，%d 条事件）', attempt + 1, len(events))
+                with self.lock:
+                    self.apply_failures += 1
+        tables = sorted({event.table for event in events})
+        self.logger.warning('CDC 重试失败，整表失效: %s', tables)
+        for table in tables:
+            self.consistency.manual_invalidate(table)
+        with self.lock:
+            self.fallback_invalidations += len(tables)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception:
+                self.logger.exception('CDC 消费异常')
+                with self.lock:
+                    self.errors += 1
+                self._stop.wait(self.poll_timeout)
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                'running': self.is_running(),
+                'events_applied': self.events_applied,
+                'batches': self.batches,
+                'errors': self.errors,
+                'apply_failures': self.apply_failures,
+                'fallback_invalidations': self.fallback_invalidations,
+                'lag_seconds': self.lag_seconds,
+                'max_lag_seconds': self.max_lag_seconds
+            }
+
+
+def create_event_source(cdc_config, db_client):
+    """
+    按 cache.yaml 的 cdc 配置创建事件源：listen_notify（默认）或 wal2json。
+    """
+    source = cdc_config.get('source', 'listen_notify')
+    if source == 'listen_notify':
+        return ListenNotifySource(db_client.connect(), cdc_config.get('channel', 'pg_cache_changes'))
+    if source == 'wal2json':
+        from psycopg2.extras import LogicalReplicationConnection
+        conn = db_client.connect(connection_factory=LogicalReplicationConnection)
+        return LogicalDecodingSource(conn, cdc_config['slot'], cdc_config.get('tables'))
+    raise ValueError(f'未知的 CDC 事件源: {source}')
@@ -0,0 +1,160 @@
+import json
+import pickle
+import sys
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from src.storage import NEGATIVE, estimate_size
+
+FLAG_JSON = 1        # 否则为 pickle
+FLAG_COMPRESSED = 2  # zlib 压缩
+
+class EncodedValue(bytes):
+    """
+    编码后的缓存值：首字节为格式标记，其后为序列化（可能经 zlib 压缩）的数据。
+    作为 bytes 子类不增加对象开销，读取时按类型识别，与配置无关（热加载取消编码或从快照恢复后仍可解码）。
+    """
+    __slots__ = ()
+
+def decode_value(value):
+    """
+    解码 EncodedValue，其他值原样返回。
+    """
+    if value.__class__ is not EncodedValue:
+        return value
+    flags = value[0]
+    data = value[1:]
+    if flags & FLAG_COMPRESSED:
+        data = zlib.decompress(data)
+    return json.loads(data) if flags & FLAG_JSON else pickle.loads(data)
+
+def _json_exact(value):
+    # JSON 能原样读回的值：str/int/float/bool/None 及由其组成的 list、键为 str 的 dict（元组会读回为列表，非 str 键会变成 str）
+    cls = value.__class__
+    if cls in (str, int, float, bool) or value is None:
+        return True
+    if cls is list:
+        return all(_json_exact(item) for item in value)
+    if cls is dict:
+        return all(k.__class__ is str and _json_exact(v) for k, v in value.items())
+    return False
+
+class ValueCodec:
+    """
+    单表的值编码层（cache.yaml 表配置 encoding）：写入时把 fields 中的值序列化为紧凑的 EncodedValue，
+    序列化结果不小于 compress_above 字节时再经 zlib 压缩；长度小于 min_bytes 的字符串与数值、None 不编码。
+    读取时解码，最近解码的 decode_cache 个值按 LRU 保留解码结果，热点值不重复解码（与未编码时一样返回同一对象）。
+    统计编码前后的估算字节数与编解码耗时，用于权衡节省的内存与 CPU 开销。
+    """
+    def __init__(self, fields, format='pickle', compress_above=1024, level=1, min_bytes=64, decode_cache=256):
+        if format not in ('pickle', 'json'):
+            raise ValueError(f'未知的编码格式: {format}')
+        self.fields = frozenset(fields)
+        self.json = format == 'json'
+        self.compress_above = compress_above
+        self.level = level
+        self.min_bytes = min_bytes
+        self.decode_cache_size = decode_cache
+        self.decoded = OrderedDict()  # {EncodedValue: 解码结果}
+        self.lock = threading.Lock()
+        self.encoded = 0
+        self.compressed = 0
+        self.raw_bytes = 0      # 编码前估算的对象字节数
+        self.stored_bytes = 0   # 编码后占用的字节数
+        self.encode_seconds = 0.0
+        self.decodes = 0
+        self.decode_hits = 0
+        self.decode_seconds = 0.0
+
+    @classmethod
+    def from_config(cls, conf, fields=None):
+        """
+        按表配置创建编解码器，未配置 encoding 时返回 None；
+        fields 缺省为 encoding.fields，再缺省为表 fields 中未建索引的字段（索引字段始终不编码）。
+        """
+        encoding = conf.get('encoding')
+        if not encoding:
+            return None
+        if encoding is True:
+            encoding = {}
+        indexes = set(conf.get('indexes') or [])
+        fields = fields or encoding.get('fields') or [field for field in conf.get('fields', []) if field not in indexes]
+        return cls([field for field in fields if field not in indexes], encoding.get('format', 'pickle'),
+                   encoding.get('compress_above', 1024), encoding.get('level', 1),
+                   encoding.get('min_bytes', 64), encoding.get('decode_cache', 256))
+
+    def encode(self, value):
+        """
+        编码单个值；不值得编码的值（数值、None、短字符串、负缓存标记、已编码的值）
+        以及 json 格式下无法原样读回的值（含元组、非 str 键的 dict）原样返回。
+        """
+        if value is None or value is NEGATIVE or value.__class__ in (int, float, bool, EncodedValue):
+            return value
+        if isinstance(value, (str, bytes)) and len(value) < self.min_bytes:
+            return value
+        if self.json and not _json_exact(value):
+            # 读回类型会变化的值不编码，命中与未命中返回相同类型
+            return value
+        start = time.perf_counter()
+        try:
+            if self.json:
+                data = json.dumps(value, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+                flags = FLAG_JSON
+            else:
+                data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+                flags = 0
+        except (TypeError, ValueError, AttributeError, pickle.PicklingError):
+            # 无法序列化的值原样缓存
+            return value
+        if self.compress_above is not None and len(data) >= self.compress_above:
+            packed = zlib.compress(data, self.level)
+            if len(packed) < len(data):
+                data = packed
+                flags |= FLAG_COMPRESSED
+        encoded = EncodedValue(bytes((flags,)) + data)
+        elapsed = time.perf_counter() - start
+        raw = estimate_size(value)
+        with self.lock:
+            self.encoded += 1
+            self.compressed += bool(flags & FLAG_COMPRESSED)
+            self.raw_bytes += raw
+            self.stored_bytes += sys.getsizeof(encoded)
+            self.encode_seconds += elapsed
+        return encoded
+
+    def decode(self, value):
+        if value.__class__ is not EncodedValue:
+            return value
+        decoded = self.decoded
+        with self.lock:
+            result = decoded.get(value)
+            if result is not None:
+                decoded.move_to_end(value)
+                self.decode_hits += 1
+                return result
+        start = time.perf_counter()
+        result = decode_value(value)
+        elapsed = time.perf_counter() - start
+        with self.lock:
+            self.decodes += 1
+            self.decode_seconds += elapsed
+            if self.decode_cache_size and result is not None:
+                decoded[value] = result
+                if len(decoded) > self.decode_cache_size:
+                    decoded.popitem(last=False)
+        return result
+
+    def stats(self):
+        with self.lock:
+            return {
+                'encoded': self.encoded,
+                'compressed': self.compressed,
+                'raw_bytes': self.raw_bytes,
+                'stored_bytes': self.stored_bytes,
+                'bytes_saved': self.raw_bytes - self.stored_bytes,
+                'encode_seconds': self.encode_seconds,
+                'decodes': self.decodes,
+                'decode_cache_hits': self.decode_hits,
+                'decode_seconds': self.decode_seconds
+            }
@@ -1,22 +1,109 @@
+import logging
 import os
+import threading
 import yaml
 
+class CompiledConfig:
+    """
+    cache.yaml 表配置编译后的只读快照，按表名 O(1) 查找；热加载时整体替换，不在原地修改。
+    tables: {table: 表配置}；columns: {table: frozenset(主键 + fields)}；positions: {table: {field: 位置}}；
+    ttls: {table: ttl}；grace: {table: stale_grace}；refresh_ahead: {table: 提前刷新秒数}（配置了 refresh_ahead 或 stale_grace 的表）。
+    """
+    __slots__ = ('version', 'tables', 'columns', 'positions', 'ttls', 'grace', 'refresh_ahead')
+
+    def __init__(self, cache_config, version=0):
+        self.version = version
+        self.tables = {conf['table']: conf for conf in cache_config}
+        self.columns = {
+            table: frozenset([conf['key_field'], *conf.get('fields', [])]) for table, conf in self.tables.items()
+        }
+        self.positions = {
+            table: {field: idx for idx, field in enumerate(conf.get('fields', []))}
+            for table, conf in self.tables.items()
+        }
+        self.ttls = {table: conf.get('ttl') for table, conf in self.tables.items()}
+        self.grace = {table: conf['stale_grace'] for table, conf in self.tables.items() if conf.get('stale_grace')}
+        self.refresh_ahead = {
+            table: conf.get('refresh_ahead') or 0
+            for table, conf in self.tables.items()
+            if conf.get('refresh_ahead') or conf.get('stale_grace')
+        }
+
+    def table(self, table):
+        return self.tables.get(table)
+
+    def diff(self, new):
+        """
+        与新快照比较，返回 (删除的表, {表: 删除的字段}, {表: (旧 ttl, 新 ttl)})。
+        新快照取消 TTL 的表不计入 TTL 变化：已缓存条目按原过期时间过期（无法区分按配置 TTL 与显式 ttl 写入的条目，
+        统一取消过期会让显式 ttl 的条目永不过期），之后写入的条目不再过期。
+        """
+        removed_tables = [table for table in self.tables if table not in new.tables]
+        removed_fields = {}
+        ttl_changes = {}
+        for table, conf in new.tables.items():
+            old = self.tables.get(table)
+            if old is None:
+                continue
+            columns = new.columns[table]
+            removed = [field for field in old.get('fields', []) if field not in columns]
+            if removed:
+                removed_fields[table] = removed
+            if conf.get('ttl') is not None and old.get('ttl') != conf.get('ttl'):
+                ttl_changes[table] = (old.get('ttl'), conf['ttl'])
+        return removed_tables, removed_fields, ttl_changes
+
 class ConfigLoader:
     """
     统一加载和管理数据库与缓存策略配置。
+    表配置编译为 CompiledConfig 快照，get_table_config 按表名 O(1) 查找；
+    reload 重新读取文件后原子替换快照，并通知 add_reload_listener 注册的监听者 listener(old, new)。
     """
     def __init__(self, config_dir=None):
         self.config_dir = config_dir or os.path.join(os.path.dirname(__file__), '..', 'config')
         self.db_config = None
         self.cache_config = None
         self.no_db_mode = False
+        self.shard_count = 16
+        self.expiry_config = {}
+        self.cdc_config = {}
+        self.snapshot_config = {}
+        self.backend = 'memory'
+        self.shared_memory_config = {}
+        self.metrics_config = {}
+        self.refresh_config = {}
+        self.write_config = {}
+        self.reload_config = {}
+        self.query_paging_config = {}
+        self.reclaim_config = {}
+        self.compiled = CompiledConfig([])
+        self.reload_listeners = []
+        self.reload_lock = threading.Lock()
+        self.logger = logging.getLogger('pg-cache')
         self.load_configs()
 
     def load_configs(self):
-        self.db_config = self._load_yaml('db.yaml').get('postgres', {})
+        # 先完成解析与编译，文件有误时保留当前配置
+        db_config = self._load_yaml('db.yaml').get('postgres', {})
         cache_yaml = self._load_yaml('cache.yaml')
-        self.cache_config = cache_yaml.get('cache', [])
+        cache_config = cache_yaml.get('cache') or []
+        compiled = CompiledConfig(cache_config, self.compiled.version + 1)
+        self.db_config = db_config
+        self.cache_config = cache_config
         self.no_db_mode = cache_yaml.get('no_db_mode', False)
+        self.shard_count = cache_yaml.get('shards', 16)
+        self.expiry_config = cache_yaml.get('expiry') or {}
+        self.cdc_config = cache_yaml.get('cdc') or {}
+        self.snapshot_config = cache_yaml.get('snapshot') or {}
+        self.backend = cache_yaml.get('backend', 'memory')
+        self.shared_memory_config = cache_yaml.get('shared_memory') or {}
+        self.metrics_config = cache_yaml.get('metrics') or {}
+        self.refresh_config = cache_yaml.get('refresh') or {}
+        self.write_config = cache_yaml.get('write') or {}
+        self.reload_config = cache_yaml.get('reload') or {}
+        self.query_paging_config = cache_yaml.get('query_paging') or {}
+        self.reclaim_config = cache_yaml.get('reclaim') or {}
+        self.compiled = compiled
 
     def _load_yaml(self, filename):
         path = os.path.join(self.config_dir, filename)
@@ -29,11 +116,134 @@ class ConfigLoader:
     def get_cache_config(self):
         return self.cache_config
 
+    def get_compiled(self):
+        return self.compiled
+
+    def get_table_config(self, table):
+        return self.compiled.tables.get(table)
+
     def get_no_db_mode(self):
         return self.no_db_mode
 
+    def get_shard_count(self):
+        return self.shard_count
+
+    def get_expiry_config(self):
+        return self.expiry_config
+
+    def get_cdc_config(self):
+        return self.cdc_config
+
+    def get_snapshot_config(self):
+        return self.snapshot_config
+
+    def get_backend(self):
+        return self.backend
+
+    def get_shared_memory_config(self):
+        return self.shared_memory_config
+
+    def get_metrics_config(self):
+        return self.metrics_config
+
+    def get_refresh_config(self):
+        return self.refresh_config
+
+    def get_write_config(self):
+        return self.write_config
+
+    def get_reload_config(self):
+        return self.reload_config
+
+    def get_query_paging_config(self):
+        return self.query_paging_config
+
+    def get_reclaim_config(self):
+        return self.reclaim_config
+
+    def add_reload_listener(self, listener):
+        self.reload_listeners.append(listener)
+
+    def remove_reload_listener(self, listener):
+        if listener in self.reload_listeners:
+            self.reload_listeners.remove(listener)
+
     def reload(self):
-        self.load_configs()
+        """
+        重新读取配置文件并原子替换编译快照，随后依次调用监听者 listener(old, new)，返回新快照。
+        文件解析失败时保留当前配置并抛出异常。
+        """
+        with self.reload_lock:
+            old = self.compiled
+            self.load_configs()
+            new = self.compiled
+        for listener in list(self.reload_listeners):
+            try:
+                listener(old, new)
+            except Exception:
+                self.logger.exception('配置热加载回调失败')
+        return new
+
+class ConfigWatcher:
+    """
+    配置文件监视：后台线程每 interval 秒检查配置目录中 yaml 文件的修改时间，变化时调用 loader.reload。
+    重新加载失败时记录日志并保留当前配置，文件再次修改后重试。
+    """
+    def __init__(self, loader, interval=1.0, filenames=('db.yaml', 'cache.yaml')):
+        self.loader = loader
+        self.interval = interval
+        self.filenames = filenames
+        self.reloads = 0
+        self.failures = 0
+        self.logger = logging.getLogger('pg-cache')
+        self.mtimes = self._mtimes()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _mtimes(self):
+        mtimes = {}
+        for filename in self.filenames:
+            try:
+                mtimes[filename] = os.stat(os.path.join(self.loader.config_dir, filename)).st_mtime_ns
+            except OSError:
+                mtimes[filename] = None
+        return mtimes
+
+    def check(self):
+        """
+        检查一次文件修改时间，有变化则重新加载；返回是否成功重新加载。
+        """
+        mtimes = self._mtimes()
+        if mtimes == self.mtimes:
+            return False
+        self.mtimes = mtimes
+        try:
+            self.loader.reload()
+        except Exception:
+            self.failures += 1
+            self.logger.exception('配置文件重新加载失败，保留当前配置')
+            return False
+        self.reloads += 1
+        return True
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='pg-cache-config-watch', daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.check()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
 
 # 用法示例
 if __name__ == '__main__':
@@ -1,11 +1,84 @@
+import io
+import re
 import psycopg2
+import psycopg2.extensions
+import psycopg2.extras
 import psycopg2.pool
 import threading
+import time
+from collections import OrderedDict
+from itertools import count
+from src.async_db_client import to_native_sql
 from src.config_loader import ConfigLoader
 
+_COPY_ESCAPE = re.compile(r'\\(x[0-9a-fA-F]{1,2}|[0-7]{1,3}|.)')
+_COPY_CHARS = {'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t', 'v': '\v'}
+
+def _unescape_copy(match):
+    code = match.group(1)
+    if code[0] == 'x' and len(code) > 1:
+        return chr(int(code[1:], 16))
+    if code[0] in '01234567':
+        return chr(int(code, 8))
+    return _COPY_CHARS.get(code, code)
+
+def parse_copy_line(line, casters=None, cursor=None):
+    """
+    解析 COPY 文本格式的一行：制表符分隔，\\N 为 NULL，反斜杠转义；casters 为各列的 psycopg2 类型转换器。
+    """
+    row = []
+    for idx, value in enumerate(line.split('\t')):
+        if value == '\\N':
+            row.append(None)
+            continue
+        if '\\' in value:
+            value = _COPY_ESCAPE.sub(_unescape_copy, value)
+        caster = casters[idx] if casters else None
+        row.append(caster(value, cursor) if caster is not None else value)
+    return tuple(row)
+
+class CopyReader(io.TextIOBase):
+    """
+    copy_expert 的写入目标：按行增量解析 COPY TO STDOUT 的输出，不缓存完整文本。
+    """
+    def __init__(self, casters=None, cursor=None):
+        self.casters = casters
+        self.cursor = cursor
+        self.rows = []
+        self._tail = ''
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        lines = (self._tail + data).split('\n')
+        self._tail = lines.pop()
+        casters, cursor = self.casters, self.cursor
+        self.rows.extend(parse_copy_line(line, casters, cursor) for line in lines)
+        return len(data)
+
+    def finish(self):
+        if self._tail:
+            self.rows.append(parse_copy_line(self._tail, self.casters, self.cursor))
+            self._tail = ''
+        return self.rows
+
+class PreparedConnection(psycopg2.extensions.connection):
+    """
+    记录本连接上已 PREPARE 的语句：{sql: 语句名}，按最近使用顺序排列。
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = OrderedDict()
+
 class PostgresClient:
     """
     简单的 PostgreSQL 连接池客户端，支持单条和批量查询。
+    同一 SQL 文本执行达到 prepare_threshold 次后，在各连接上 PREPARE 并改用 EXECUTE，
+    省去重复的解析与计划；每个连接最多保留 max_prepared 条，超出时释放最久未用的语句。
+    copy_query 通过 COPY (...) TO STDOUT 批量读取，供全量同步使用。
+    借出连接前先获取 maxconn 个许可之一：连接全部被占用时阻塞等待（最长 pool_timeout 秒），
+    而不是像 ThreadedConnectionPool 那样立即抛出 PoolError；等待耗时与超时次数计入统计。
     """
     _instance = None
     _lock = threading.Lock()
@@ -21,34 +94,249 @@ class PostgresClient:
         if hasattr(self, '_initialized') and self._initialized:
             return
         config = ConfigLoader().get_db_config()
-        self.pool = psycopg2.pool.ThreadedConnectionPool(
-            minconn=config.get('minconn', 1),
-            maxconn=config.get('maxconn', 10),
+        self.maxconn = config.get('maxconn', 10)
+        self.prepare_threshold = config.get('prepare_threshold', 5)
+        self.max_prepared = config.get('max_prepared', 256)
+        self.copy_sync = config.get('copy_sync', True)
+        self.pool_timeout = config.get('pool_timeout', 30)
+        self.dsn = dict(
             host=config['host'],
             port=config['port'],
             user=config['user'],
             password=config['password'],
             database=config['database']
         )
+        self.pool = psycopg2.pool.ThreadedConnectionPool(
+            minconn=config.get('minconn', 1),
+            maxconn=self.maxconn,
+            connection_factory=PreparedConnection,
+            **self.dsn
+        )
+        self.metrics = None  # MetricsRegistry，启用时记录连接池等待耗时
+        self._reset_state()
         self._initialized = True
 
+    def _reset_state(self):
+        self.stats_lock = threading.Lock()
+        self.slots = threading.BoundedSemaphore(self.maxconn)
+        self.exhausted = 0  # 等待超时或连接池报错的借出次数
+        self.checkouts = 0
+        self.wait_seconds = 0.0
+        self.max_wait = 0.0
+        self.in_use = 0
+        self.peak_in_use = 0
+        self.prepares = 0
+        self.prepared_executions = 0
+        self.copy_rows = 0
+        self._seen = {}            # {sql: 执行次数}，达到阈值后准备
+        self._unpreparable = set()  # PREPARE 失败的语句，不再尝试
+        self._names = count(1)
+
+    def connect(self, **kwargs):
+        """
+        创建不受连接池管理的独立连接（如 LISTEN、逻辑复制），由调用方负责关闭。
+        """
+        return psycopg2.connect(**self.dsn, **kwargs)
+
+    def _getconn(self):
+        start = time.perf_counter()
+        if not self.slots.acquire(timeout=self.pool_timeout):
+            self._record_exhausted()
+            raise psycopg2.pool.PoolError(f'等待数据库连接超时（{self.pool_timeout} 秒）')
+        try:
+            conn = self.pool.getconn()
+        except psycopg2.pool.PoolError:
+            self.slots.release()
+            self._record_exhausted()
+            raise
+        waited = time.perf_counter() - start
+        with self.stats_lock:
+            self.checkouts += 1
+            self.wait_seconds += waited
+            if waited > self.max_wait:
+                self.max_wait = waited
+            self.in_use += 1
+            if self.in_use > self.peak_in_use:
+                self.peak_in_use = self.in_use
+        if self.metrics is not None:
+            self.metrics.observe('pg_cache_pool_wait_seconds', (), waited)
+        return conn
+
+    def _putconn(self, conn):
+        with self.stats_lock:
+            self.in_use -= 1
+        try:
+            self.pool.putconn(conn)
+        finally:
+            self.slots.release()
+
+    def _record_exhausted(self):
+        with self.stats_lock:
+            self.exhausted += 1
+        if self.metrics is not None:
+            self.metrics.inc('pg_cache_pool_exhausted_total', ())
+
+    def _execute(self, conn, cur, sql, params):
+        """
+        执行查询：已准备的语句改用 EXECUTE；未准备的语句计数，达到阈值时在本连接上 PREPARE。
+        """
+        prepared = getattr(conn, 'prepared', None)
+        if prepared is None or not self.prepare_threshold:
+            cur.execute(sql, params)
+            return
+        name = prepared.get(sql)
+        if name is None:
+            # 计数表由连接池各线程共享，读-改-写与清空都在锁内完成
+            with self.stats_lock:
+                seen = self._seen.get(sql, 0) + 1
+                skip = seen < self.prepare_threshold or sql in self._unpreparable
+                if skip:
+                    if len(self._seen) >= 4096:
+                        self._seen.clear()
+                    self._seen[sql] = seen
+            if skip:
+                cur.execute(sql, params)
+                return
+            name = self._prepare(conn, cur, sql)
+            if name is None:
+                cur.execute(sql, params)
+                return
+        else:
+            prepared.move_to_end(sql)
+        if params:
+            cur.execute(f"EXECUTE {name} ({','.join(['%s'] * len(params))})", params)
+        else:
+            cur.execute(f'EXECUTE {name}')
+        with self.stats_lock:
+            self.prepared_executions += 1
+
+    def _prepare(self, conn, cur, sql):
+        name = f'pgc_{next(self._names)}'
+        try:
+            cur.execute(f"PREPARE {name} AS {to_native_sql(sql).replace('%%', '%')}")
+        except psycopg2.Error:
+            # 无法准备的语句（如参数类型无法推断）回退为普通执行
+            conn.rollback()
+            with self.stats_lock:
+                self._unpreparable.add(sql)
+            return None
+        prepared = conn.prepared
+        prepared[sql] = name
+        if len(prepared) > self.max_prepared:
+            _, oldest = prepared.popitem(last=False)
+            cur.execute(f'DEALLOCATE {oldest}')
+        with self.stats_lock:
+            self.prepares += 1
+        return name
+
     def query(self, sql, params=None):
-        conn = self.pool.getconn()
+        conn = self._getconn()
         try:
             with conn.cursor() as cur:
-                cur.execute(sql, params)
+                self._execute(conn, cur, sql, params)
                 return cur.fetchall()
         finally:
-            self.pool.putconn(conn)
+            self._putconn(conn)
 
     def query_one(self, sql, params=None):
-        conn = self.pool.getconn()
+        conn = self._getconn()
         try:
             with conn.cursor() as cur:
-                cur.execute(sql, params)
+                self._execute(conn, cur, sql, params)
                 return cur.fetchone()
         finally:
-            self.pool.putconn(conn)
+            self._putconn(conn)
+
+    def execute(self, sql, params=None):
+        """
+        执行单条写语句并提交，返回影响的行数；失败时回滚并抛出异常。
+        """
+        conn = self._getconn()
+        try:
+            with conn.cursor() as cur:
+                cur.execute(sql, params)
+                rowcount = cur.rowcount
+            conn.commit()
+            return rowcount
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            self._putconn(conn)
+
+    def execute_many(self, sql, params_list, page_size=100):
+        """
+        批量执行写语句（execute_batch 按 page_size 条合并为一次往返）并提交；失败时回滚并抛出异常。
+        合并执行时只能拿到最后一条语句的影响行数，因此不返回行数；需要知道更新到哪些行时使用 execute_values。
+        """
+        conn = self._getconn()
+        try:
+            with conn.cursor() as cur:
+                psycopg2.extras.execute_batch(cur, sql, params_list, page_size=page_size)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            self._putconn(conn)
+
+    def execute_values(self, sql, params_list, page_size=100):
+        """
+        批量执行含单个 VALUES %s 占位的写语句（execute_values 每 page_size 行一次往返）并提交，
+        返回各页 RETURNING 的行；失败时回滚并抛出异常。
+        """
+        conn = self._getconn()
+        try:
+            with conn.cursor() as cur:
+                rows = psycopg2.extras.execute_values(cur, sql, params_list, page_size=page_size, fetch=True)
+            conn.commit()
+            return rows
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            self._putconn(conn)
+
+    def copy_query(self, sql, params=None):
+        """
+        以 COPY (sql) TO STDOUT 批量读取，返回与 query 相同的元组列表。
+        列类型取自 LIMIT 0 查询的结果描述，文本按 psycopg2 的类型转换器解析；copy_sync 关闭时等同 query。
+        """
+        if not self.copy_sync:
+            return self.query(sql, params)
+        conn = self._getconn()
+        try:
+            with conn.cursor() as cur:
+                inner = cur.mogrify(sql, params).decode(psycopg2.extensions.encodings[conn.encoding])
+                cur.execute(f'SELECT * FROM ({inner}) AS q LIMIT 0')
+                casters = [psycopg2.extensions.string_types.get(col.type_code) for col in cur.description]
+                reader = CopyReader(casters, cur)
+                cur.copy_expert(f'COPY ({inner}) TO STDOUT', reader)
+                rows = reader.finish()
+            with self.stats_lock:
+                self.copy_rows += len(rows)
+            return rows
+        finally:
+            self._putconn(conn)
+
+    def get_stats(self):
+        """
+        连接池与语句统计：借出次数、累计/最大等待时间、等待超时次数、当前与峰值占用连接数、准备语句与 COPY 行数。
+        """
+        with self.stats_lock:
+            return {
+                'checkouts': self.checkouts,
+                'wait_seconds': self.wait_seconds,
+                'avg_wait': self.wait_seconds / self.checkouts if self.checkouts else 0.0,
+                'max_wait': self.max_wait,
+                'exhausted': self.exhausted,
+                'in_use': self.in_use,
+                'peak_in_use': self.peak_in_use,
+                'maxconn': self.maxconn,
+                'prepares': self.prepares,
+                'prepared_executions': self.prepared_executions,
+                'copy_rows': self.copy_rows
+            }
 
     def close(self):
         self.pool.closeall()
@@ -56,4 +344,5 @@ class PostgresClient:
 # 用法示例
 if __name__ == '__main__':
     client = PostgresClient()
-    print(client.query('SELECT 1')) 
\ No newline at end of file
+    print(client.query('SELECT 1'))
+    print(client.get_stats())
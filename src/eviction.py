@@ -0,0 +1,158 @@
+from collections import OrderedDict
+
+_SKETCH_SEEDS = (0x9E3779B9, 0x85EBCA6B, 0xC2B2AE35, 0x27D4EB2F)
+
+
+class CountMinSketch:
+    """
+    4 位计数的 Count-Min Sketch，用于估算 key 的访问频率，定期衰减以适应热点变化。
+    """
+    def __init__(self, capacity=1024):
+        width = 16
+        while width < capacity:
+            width <<= 1
+        self.mask = width - 1
+        self.rows = [bytearray(width) for _ in _SKETCH_SEEDS]
+        self.sample_size = width * 10
+        self.additions = 0
+
+    def _indexes(self, key):
+        h = hash(key)
+        return [(((h ^ seed) * 0x9E3779B97F4A7C15) >> 24) & self.mask for seed in _SKETCH_SEEDS]
+
+    def increment(self, key):
+        for row, idx in zip(self.rows, self._indexes(key)):
+            if row[idx] < 15:
+                row[idx] += 1
+        self.additions += 1
+        if self.additions >= self.sample_size:
+            self._reset()
+
+    def estimate(self, key):
+        return min(row[idx] for row, idx in zip(self.rows, self._indexes(key)))
+
+    def _reset(self):
+        # 所有计数减半，旧热点逐渐冷却
+        self.rows = [bytearray(c >> 1 for c in row) for row in self.rows]
+        self.additions //= 2
+
+
+class LRUPolicy:
+    """
+    最近最少使用淘汰策略，访问、插入、淘汰均为 O(1)。
+    """
+    def __init__(self, capacity=None):
+        self.capacity = capacity
+        self.order = OrderedDict()
+
+    def __len__(self):
+        return len(self.order)
+
+    def record_access(self, key):
+        if key in self.order:
+            self.order.move_to_end(key)
+
+    def record_insert(self, key):
+        self.order[key] = None
+        self.order.move_to_end(key)
+
+    def remove(self, key):
+        self.order.pop(key, None)
+
+    def evict(self):
+        if not self.order:
+            return None
+        key, _ = self.order.popitem(last=False)
+        return key
+
+
+class TinyLFUPolicy:
+    """
+    W-TinyLFU 淘汰策略：新 key 先进入小窗口 LRU，窗口溢出的候选者与主区 (SLRU) 的淘汰者
+    比较 Count-Min Sketch 估算频率，频率更高者留下，抵御一次性扫描对热点的冲刷。
+    """
+    def __init__(self, capacity=None, window_ratio=0.01, protected_ratio=0.8):
+        self.capacity = capacity
+        self.window_ratio = window_ratio
+        self.protected_ratio = protected_ratio
+        self.sketch = CountMinSketch(capacity or 1024)
+        self.window = OrderedDict()
+        self.probation = OrderedDict()
+        self.protected = OrderedDict()
+
+    def __len__(self):
+        return len(self.window) + len(self.probation) + len(self.protected)
+
+    def _window_cap(self):
+        total = self.capacity or len(self)
+        return max(1, int(total * self.window_ratio))
+
+    def _main_has_room(self):
+        if self.capacity is None:
+            return True
+        return len(self.probation) + len(self.protected) < self.capacity - self._window_cap()
+
+    def record_access(self, key):
+        self.sketch.increment(key)
+        if key in self.window:
+            self.window.move_to_end(key)
+        elif key in self.probation:
+            # probation 中再次命中则晋升到 protected
+            del self.probation[key]
+            self.protected[key] = None
+            protected_cap = max(1, int((len(self.probation) + len(self.protected)) * self.protected_ratio))
+            while len(self.protected) > protected_cap:
+                demoted, _ = self.protected.popitem(last=False)
+                self.probation[demoted] = None
+        elif key in self.protected:
+            self.protected.move_to_end(key)
+
+    def record_insert(self, key):
+        if key in self.window or key in self.probation or key in self.protected:
+            self.record_access(key)
+            return
+        self.sketch.increment(key)
+        self.window[key] = None
+        # 主区未满时窗口溢出者直接进入 probation，无需竞争
+        while len(self.window) > self._window_cap() and self._main_has_room():
+            moved, _ = self.window.popitem(last=False)
+            self.probation[moved] = None
+
+    def remove(self, key):
+        for segment in (self.window, self.probation, self.protected):
+            if key in segment:
+                del segment[key]
+                return
+
+    def evict(self):
+        main = self.probation or self.protected
+        if self.window and (len(self.window) > self._window_cap() or not main):
+            candidate = next(iter(self.window))
+            if not main:
+                del self.window[candidate]
+                return candidate
+            victim = next(iter(main))
+            del self.window[candidate]
+            if self.sketch.estimate(candidate) > self.sketch.estimate(victim):
+                del main[victim]
+                self.probation[candidate] = None
+                return victim
+            return candidate
+        segment = main or self.window
+        if not segment:
+            return None
+        key, _ = segment.popitem(last=False)
+        return key
+
+
+EVICTION_POLICIES = {
+    'lru': LRUPolicy,
+    'tinylfu': TinyLFUPolicy,
+}
+
+
+def create_policy(name, capacity=None):
+    name = (name or 'lru').lower()
+    if name not in EVICTION_POLICIES:
+        raise ValueError(f'未知的淘汰策略: {name}')
+    return EVICTION_POLICIES[name](capacity)
@@ -0,0 +1,49 @@
+import time
+import threading
+
+class ExpiryReaper:
+    """
+    主动过期回收线程：定时按分段分片回收已到期条目，每片持锁时间受条目数与时长双重限制，
+    避免长时间占用分段锁造成读写延迟尖刺。
+    """
+    def __init__(self, cache_manager, interval=0.1, slice_items=256, slice_time=0.001):
+        self.cache = cache_manager
+        self.interval = interval
+        self.slice_items = slice_items
+        self.slice_time = slice_time
+        self.expired_total = 0
+        self.expired_per_second = 0.0
+        self._window_start = time.time()
+        self._window_count = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='pg-cache-expiry', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def run_once(self):
+        removed = self.cache.expire_step(self.slice_items, self.slice_time)
+        self.expired_total += removed
+        self._window_count += removed
+        now = time.time()
+        elapsed = now - self._window_start
+        if elapsed >= 1:
+            self.expired_per_second = self._window_count / elapsed
+            self._window_start = now
+            self._window_count = 0
+        return removed
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.run_once()
@@ -0,0 +1,191 @@
+import threading
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 延迟直方图默认桶上界（秒），覆盖内存命中（微秒级）到慢查询（秒级）
+LATENCY_BUCKETS = (1e-6, 2.5e-6, 5e-6, 1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4,
+                   1e-3, 2.5e-3, 5e-3, 1e-2, 2.5e-2, 5e-2, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class MetricsRegistry:
+    """
+    低开销指标注册表：计数器与直方图按线程分别累加（threading.local），记录时不加锁，
+    采集（collect）时再汇总所有线程的数据；已退出线程的数据在采集时并入 retired 后释放。
+    gauge 由回调在采集时计算（如条目数、内存占用）。
+    指标键为 (name, labels)，labels 为与 describe 中 labelnames 对应的取值元组。
+    """
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.meta = {}       # {name: (type, help, labelnames)}
+        self.callbacks = {}  # {name: fn() -> {labels: value}}
+        self.lock = threading.Lock()
+        self._local = threading.local()
+        self._threads = []   # [(thread, data)]
+        self._retired = {}
+
+    def describe(self, name, metric_type, help_text, labelnames=()):
+        self.meta[name] = (metric_type, help_text, tuple(labelnames))
+
+    def register_callback(self, name, metric_type, help_text, labelnames, fn):
+        self.describe(name, metric_type, help_text, labelnames)
+        self.callbacks[name] = fn
+
+    def _data(self):
+        try:
+            return self._local.data
+        except AttributeError:
+            data = self._local.data = {}
+            with self.lock:
+                self._threads.append((threading.current_thread(), data))
+            return data
+
+    def inc(self, name, labels=(), amount=1):
+        data = self._data()
+        key = (name, labels)
+        data[key] = data.get(key, 0) + amount
+
+    def observe(self, name, labels, value):
+        """
+        记录一次直方图观测：data[key] = [各桶计数..., 超出最大桶计数, 总和]。
+        """
+        try:
+            data = self._local.data
+        except AttributeError:
+            data = self._data()
+        hist = data.get((name, labels))
+        if hist is None:
+            hist = data[(name, labels)] = [0] * (len(self.buckets) + 1) + [0.0]
+        hist[bisect_left(self.buckets, value)] += 1
+        hist[-1] += value
+
+    def _merge(self, target, data):
+        for key, value in data.items():
+            current = target.get(key)
+            if current is None:
+                target[key] = list(value) if isinstance(value, list) else value
+            elif isinstance(value, list):
+                for idx, item in enumerate(value):
+                    current[idx] += item
+            else:
+                target[key] = current + value
+
+    def collect(self):
+        """
+        汇总所有线程的计数器与直方图，返回 {(name, labels): 值或直方图列表}。
+        """
+        with self.lock:
+            alive = []
+            for thread, data in self._threads:
+                if thread.is_alive():
+                    alive.append((thread, data))
+                else:
+                    self._merge(self._retired, data.copy())
+            self._threads = alive
+            result = {}
+            self._merge(result, self._retired)
+            for _, data in alive:
+                self._merge(result, data.copy())
+        return result
+
+    def value(self, name, labels=()):
+        """
+        返回单个计数器的当前值（直方图返回观测次数）。
+        """
+        value = self.collect().get((name, labels), 0)
+        return sum(value[:-1]) if isinstance(value, list) else value
+
+    def quantile(self, name, q, labels=None):
+        """
+        按桶估算直方图分位数（返回所在桶上界）；labels 为 None 时合并全部标签。
+        """
+        counts = [0] * (len(self.buckets) + 1)
+        for (metric, metric_labels), value in self.collect().items():
+            if metric == name and (labels is None or metric_labels == labels):
+                for idx in range(len(counts)):
+                    counts[idx] += value[idx]
+        total = sum(counts)
+        if not total:
+            return None
+        rank = q * total
+        seen = 0
+        for idx, count in enumerate(counts):
+            seen += count
+            if seen >= rank:
+                return self.buckets[idx] if idx < len(self.buckets) else float('inf')
+        return float('inf')
+
+    def export_prometheus(self):
+        """
+        按 Prometheus 文本格式（0.0.4）导出全部指标。
+        """
+        samples = {}
+        for (name, labels), value in self.collect().items():
+            samples.setdefault(name, []).append((labels, value))
+        for name, fn in self.callbacks.items():
+            samples[name] = list(fn().items())
+        lines = []
+        for name in sorted(samples):
+            metric_type, help_text, labelnames = self.meta.get(name, ('untyped', '', ()))
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {metric_type}')
+            for labels, value in sorted(samples[name], key=lambda item: tuple(map(str, item[0]))):
+                pairs = [f'{label}="{_escape(v)}"' for label, v in zip(labelnames, labels)]
+                if metric_type != 'histogram':
+                    lines.append(f'{name}{_labels(pairs)} {_number(value)}')
+                    continue
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float('inf'),), value[:-1]):
+                    cumulative += count
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    bucket_pairs = pairs + ['le="%s"' % le]
+                    lines.append(f'{name}_bucket{_labels(bucket_pairs)} {cumulative}')
+                lines.append(f'{name}_sum{_labels(pairs)} {_number(value[-1])}')
+                lines.append(f'{name}_count{_labels(pairs)} {cumulative}')
+        return '\n'.join(lines) + '\n'
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _labels(pairs):
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class MetricsServer:
+    """
+    内置 HTTP 导出端点：GET /metrics 返回 Prometheus 文本格式，在后台守护线程中运行。
+    """
+    def __init__(self, registry, host='0.0.0.0', port=9108):
+        self.registry = registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(handler):
+                if handler.path.split('?')[0] != '/metrics':
+                    handler.send_error(404)
+                    return
+                body = registry.export_prometheus().encode('utf-8')
+                handler.send_response(200)
+                handler.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                handler.send_header('Content-Length', str(len(body)))
+                handler.end_headers()
+                handler.wfile.write(body)
+
+            def log_message(handler, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        self.port = self.httpd.server_address[1]
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name='pg-cache-metrics', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
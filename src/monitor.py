@@ -1,12 +1,18 @@
 from src.cache_manager import CacheManager
+from src.metrics import MetricsRegistry, MetricsServer
 import logging
 
 class CacheMonitor:
     """
     监控与可观测性：采集命中率、回源次数、缓存空间等指标，支持异常日志输出。
+    请求级指标（按表、按操作的计数器与延迟直方图）由 MetricsRegistry 按线程无锁累加，
+    条目数、内存占用与全局命中统计在采集时从缓存读取；可通过内置 HTTP 端点以 Prometheus 格式导出。
     """
-    def __init__(self, cache_manager=None):
+    BACK_SOURCE_OPS = ('fallback', 'load_many', 'refresh')
+
+    def __init__(self, cache_manager=None, registry=None):
         self.cache = cache_manager or CacheManager()
+        self.metrics = registry or MetricsRegistry()
         self.logger = logging.getLogger('pg-cache')
         handler = logging.StreamHandler()
         formatter = logging.Formatter('[%(asctime)s] %(levelname)s: %(message)s')
@@ -14,21 +20,90 @@ class CacheMonitor:
         if not self.logger.handlers:
             self.logger.addHandler(handler)
         self.logger.setLevel(logging.INFO)
-        self.back_source_count = 0
+        self.server = None
+        self._describe()
+
+    def _describe(self):
+        m = self.metrics
+        m.describe('pg_cache_get_seconds', 'histogram', '缓存读取耗时（秒）', ('table', 'op', 'result'))
+        m.describe('pg_cache_requests_total', 'counter', '回源读取按缓存结果（hit/stale/miss/negative）计数', ('table', 'result'))
+        m.describe('pg_cache_db_query_seconds', 'histogram', '回源与同步的数据库查询耗时（秒）', ('table', 'op'))
+        m.describe('pg_cache_sync_rows_total', 'counter', '同步写入缓存的行数', ('table', 'mode'))
+        m.describe('pg_cache_sync_seconds', 'histogram', '同步任务耗时（秒）', ('table', 'mode'))
+        m.describe('pg_cache_pool_wait_seconds', 'histogram', '等待连接池连接的耗时（秒）')
+        m.describe('pg_cache_pool_exhausted_total', 'counter', '等待连接超时或连接池报错的次数')
+        m.register_callback('pg_cache_entries', 'gauge', '缓存的主键数', ('table',),
+                            lambda: {(t, ): s['keys'] for t, s in self.cache.table_stats().items()})
+        m.register_callback('pg_cache_memory_bytes', 'gauge', '缓存估算内存占用（字节）', ('table',),
+                            lambda: {(t, ): s['bytes'] for t, s in self.cache.table_stats().items()})
+        m.register_callback('pg_cache_hits_total', 'counter', '缓存命中总数', (),
+                            lambda: {(): self.cache.get_stats()['hits']})
+        m.register_callback('pg_cache_misses_total', 'counter', '缓存未命中总数', (),
+                            lambda: {(): self.cache.get_stats()['misses']})
+        m.register_callback('pg_cache_evictions_total', 'counter', '容量淘汰次数', ('table',),
+                            lambda: {(t, ): c for t, c in self.cache.get_stats()['evictions_by_table'].items()})
+        m.register_callback('pg_cache_expired_total', 'counter', '主动过期回收的条目数', (),
+                            lambda: {(): self.cache.get_stats()['expired']})
+        m.register_callback('pg_cache_encoding_saved_bytes', 'gauge', '值编码累计节省的估算字节数', ('table',),
+                            lambda: {(t, ): s['bytes_saved'] for t, s in self.cache.get_stats()['encoding'].items()})
+        m.register_callback('pg_cache_encoding_seconds_total', 'counter', '值编码与解码累计耗时（秒）', ('table', 'op'),
+                            lambda: {(t, op): s[f'{op}_seconds'] for t, s in self.cache.get_stats()['encoding'].items()
+                                     for op in ('encode', 'decode')})
+
+    @property
+    def back_source_count(self):
+        return sum(sum(value[:-1]) for (name, labels), value in self.metrics.collect().items()
+                   if name == 'pg_cache_db_query_seconds' and labels[1] in self.BACK_SOURCE_OPS)
 
-    def log_back_source(self):
-        self.back_source_count += 1
-        self.logger.info('回源数据库次数累计: %d', self.back_source_count)
+    def log_back_source(self, table='', seconds=0.0):
+        # 按次记录到指标，不再逐次写日志
+        self.metrics.observe('pg_cache_db_query_seconds', (table, 'fallback'), seconds)
+        self.logger.debug('回源数据库: %s', table)
 
     def get_metrics(self):
         stats = self.cache.get_stats()
+        collected = self.metrics.collect()
+        tables = {}
+        for table, table_stats in self.cache.table_stats().items():
+            tables[table] = dict(table_stats, hits=0, misses=0)
+        for (name, labels), value in collected.items():
+            # get 的结果来自读取直方图，get_with_fallback 的结果来自回源层计数（区分负缓存）
+            if name == 'pg_cache_requests_total':
+                result, count = labels[1], value
+            elif name == 'pg_cache_get_seconds' and labels[1] == 'get':
+                result, count = labels[2], sum(value[:-1])
+            else:
+                continue
+            entry = tables.setdefault(labels[0], {'keys': 0, 'bytes': 0, 'hits': 0, 'misses': 0})
+            entry['hits' if result in ('hit', 'stale') else 'misses'] += count
         return {
             'cache_hits': stats['hits'],
             'cache_misses': stats['misses'],
             'cache_hit_rate': stats['hit_rate'],
-            'back_source_count': self.back_source_count
+            'back_source_count': self.back_source_count,
+            'get_latency_p50': self.metrics.quantile('pg_cache_get_seconds', 0.5),
+            'get_latency_p99': self.metrics.quantile('pg_cache_get_seconds', 0.99),
+            'db_latency_p99': self.metrics.quantile('pg_cache_db_query_seconds', 0.99),
+            'encoding': stats['encoding'],
+            'tables': tables
         }
 
+    def export_prometheus(self):
+        return self.metrics.export_prometheus()
+
+    def start_http_server(self, host='0.0.0.0', port=9108):
+        """
+        启动 /metrics 导出端点（port=0 时随机分配端口，见 server.port）。
+        """
+        if self.server is None:
+            self.server = MetricsServer(self.metrics, host, port).start()
+        return self.server
+
+    def stop_http_server(self):
+        if self.server is not None:
+            self.server.stop()
+            self.server = None
+
     def log_exception(self, msg, exc=None):
         if exc:
             self.logger.error('%s: %s', msg, exc)
@@ -38,9 +113,10 @@ class CacheMonitor:
 # 用法示例
 if __name__ == '__main__':
     monitor = CacheMonitor()
-    monitor.log_back_source()
+    monitor.log_back_source('your_table', 0.002)
     print(monitor.get_metrics())
+    print(monitor.export_prometheus())
     try:
         raise ValueError('test')
     except Exception as e:
-        monitor.log_exception('异常示例', e) 
\ No newline at end of file
+        monitor.log_exception('异常示例', e)
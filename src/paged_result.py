@@ -0,0 +1,71 @@
+import sys
+from array import array
+
+OVERSIZED = '__oversized__'  # 完整结果超过 query_paging 上限的标记，之后按页查询
+
+def _column(values):
+    """
+    整列均为 int（不含 bool，且在 int64 范围内）时存为 array('q')，均为 float 时存为 array('d')，否则存为 tuple。
+    """
+    kinds = set(map(type, values))
+    if kinds == {int}:
+        try:
+            return array('q', values)
+        except OverflowError:
+            pass
+    elif kinds == {float}:
+        return array('d', values)
+    return tuple(values)
+
+def _column_bytes(column):
+    if isinstance(column, array):
+        return sys.getsizeof(column)
+    return sys.getsizeof(column) + sum(sys.getsizeof(value) for value in column)
+
+class ColumnarResult:
+    """
+    结构化查询的完整结果（不带 limit/offset）按列紧凑存储，供各页切片复用：
+    整数列、浮点列为 array（每值 8 字节，无对象头），其余列为 tuple。
+    rows 只为请求的区间构造行元组；columns 对 array 列返回 memoryview 零拷贝切片。
+    """
+    __slots__ = ('length', 'data', 'nbytes')
+
+    def __init__(self, rows, width):
+        self.length = len(rows)
+        self.data = [_column(column) for column in zip(*rows)] if rows else [() for _ in range(width)]
+        self.nbytes = sum(_column_bytes(column) for column in self.data)
+
+    def __len__(self):
+        return self.length
+
+    def __sizeof__(self):
+        # 供 estimate_size（sys.getsizeof）计入表的 max_bytes 上限
+        return object.__sizeof__(self) + self.nbytes
+
+    def _bounds(self, offset, limit):
+        start = min(offset or 0, self.length)
+        return start, self.length if not limit else min(start + limit, self.length)
+
+    def rows(self, offset=None, limit=None):
+        """
+        返回 [offset, offset + limit) 区间的行元组列表，与直接执行带 limit/offset 的查询结果格式相同。
+        """
+        start, stop = self._bounds(offset, limit)
+        return list(zip(*(column[start:stop] for column in self.data)))
+
+    def columns(self, offset=None, limit=None):
+        """
+        按列返回区间数据：array 列为 memoryview 切片（不复制），tuple 列为 tuple 切片。
+        """
+        start, stop = self._bounds(offset, limit)
+        return [memoryview(column)[start:stop] if isinstance(column, array) else column[start:stop]
+                for column in self.data]
+
+def page_of(result, limit=None, offset=None):
+    """
+    从已缓存的完整结果（ColumnarResult 或行列表）中取出一页。
+    """
+    if isinstance(result, ColumnarResult):
+        return result.rows(offset, limit)
+    start = offset or 0
+    return result[start:start + limit if limit else None]
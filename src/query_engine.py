@@ -0,0 +1,162 @@
+import json
+from src.storage import ABSENT, EXPIRED, NEGATIVE
+
+def _hashable(value):
+    try:
+        hash(value)
+        return value
+    except TypeError:
+        return json.dumps(value, sort_keys=True, default=str)
+
+class ShardIndex:
+    """
+    分段内单表的哈希二级索引：{field: {value: {key}}}，由 CacheShard 在持锁时维护。
+    values 记录每个主键当前被索引的取值，覆盖写入和删除时据此摘除旧索引项。
+    """
+    __slots__ = ('fields', 'by_field', 'values')
+
+    def __init__(self, fields):
+        self.fields = frozenset(fields)
+        self.by_field = {field: {} for field in self.fields}
+        self.values = {}  # {key: {field: 索引值}}
+
+    def add(self, key, field, value):
+        if field not in self.fields:
+            return
+        value = _hashable(value)
+        current = self.values.get(key)
+        if current is None:
+            current = self.values[key] = {}
+        elif field in current:
+            old = current[field]
+            if old == value:
+                return
+            self._unlink(field, old, key)
+        current[field] = value
+        keys = self.by_field[field].get(value)
+        if keys is None:
+            self.by_field[field][value] = {key}
+        else:
+            keys.add(key)
+
+    def discard(self, key, field=None):
+        """
+        摘除主键的索引项，field 为 None 时摘除该主键全部索引项。
+        """
+        current = self.values.get(key)
+        if not current:
+            return
+        for name in (list(current) if field is None else [field]):
+            if name in current:
+                self._unlink(name, current.pop(name), key)
+        if not current:
+            del self.values[key]
+
+    def _unlink(self, field, value, key):
+        index = self.by_field[field]
+        keys = index.get(value)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del index[value]
+
+    def lookup(self, field, values):
+        """
+        返回 field 取值在 values 中的主键集合。
+        """
+        index = self.by_field[field]
+        result = set()
+        for value in values:
+            keys = index.get(_hashable(value))
+            if keys:
+                result |= keys
+        return result
+
+def covers_query(columns, filters, fields):
+    """
+    过滤列与投影列是否都在 columns 中；否则本地结果不完整（未缓存的列恒为缺失），须回源执行。
+    """
+    return columns is not None and all(column in columns for column in (filters or {})) \
+        and all(column in columns for column in fields)
+
+def _row_state(row, now):
+    """
+    返回行中是否有未过期的数据：True 有，EXPIRED 只剩过期数据，False 为空或仅有负缓存。
+    """
+    state = False
+    for _, value, expire_at in row.entries():
+        if value is NEGATIVE:
+            continue
+        if expire_at is None or now <= expire_at:
+            return True
+        state = EXPIRED
+    return state
+
+def select_rows(rows, index, key_field, filters, fields, now, strict):
+    """
+    在单个分段的 {key: row} 上执行等值/IN 过滤与字段投影，返回 [(key, [字段值])]。
+    主键与已索引字段的条件先用于缩小候选集，所有条件再逐行校验。
+    strict=True 时遇到已过期字段返回 None（数据已不完整），否则视为不存在。
+    """
+    conditions = [(field, value if isinstance(value, list) else [value]) for field, value in (filters or {}).items()]
+    candidates = None
+    for field, values in conditions:
+        if field == key_field:
+            found = set()
+            for key in values:
+                try:
+                    if key in rows:
+                        found.add(key)
+                except TypeError:  # 不可哈希的取值不可能是主键
+                    pass
+        elif index is not None and field in index.fields:
+            found = index.lookup(field, values)
+        else:
+            continue
+        candidates = found if candidates is None else candidates & found
+        if not candidates:
+            return []
+    result = []
+    for key in (rows if candidates is None else candidates):
+        row = rows.get(key)
+        if row is None:
+            continue
+        matched = True
+        checked = False
+        for field, values in conditions:
+            if field == key_field:
+                continue
+            checked = True
+            value = row.read(field, now)
+            if value is EXPIRED:
+                if strict:
+                    return None
+                value = ABSENT
+            if value is ABSENT or value is NEGATIVE or value not in values:
+                matched = False
+                break
+        if not matched:
+            continue
+        if not checked:
+            # 只按主键过滤时须确认该行仍有未过期的数据，否则过期或负缓存的行会被当作存在
+            state = _row_state(row, now)
+            if state is EXPIRED and strict:
+                return None
+            if state is not True:
+                continue
+        projected = []
+        for field in fields:
+            if field == key_field:
+                projected.append(key)
+                continue
+            value = row.read(field, now)
+            if value is EXPIRED:
+                if strict:
+                    return None
+                value = ABSENT
+            if value is NEGATIVE:
+                break
+            projected.append(None if value is ABSENT else value)
+        else:
+            result.append((key, projected))
+    return result
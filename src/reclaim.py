@@ -0,0 +1,121 @@
+import logging
+import threading
+import time
+from collections import deque
+
+_NESTED = 64  # 超过该大小的嵌套容器单独分片释放
+
+def _parts(obj):
+    # 非容器对象（淘汰策略、二级索引等）展开为其持有的容器
+    if hasattr(obj, '__dict__'):
+        return list(vars(obj).values())
+    return [getattr(obj, name, None) for name in getattr(type(obj), '__slots__', ())]
+
+def release(objects, slice_items=1000):
+    """
+    逐项释放已从缓存中摘下的容器（dict/list/set 及持有它们的对象），每释放 slice_items 项产出一次，
+    每次只释放一小批对象，不会因一次性析构大量对象长时间占用 GIL。产出本片释放的项数。
+    """
+    stack = [obj for obj in objects if obj is not None]
+    while stack:
+        released = 0
+        while stack and released < slice_items:
+            obj = stack[-1]
+            if isinstance(obj, dict):
+                if not obj:
+                    stack.pop()
+                    continue
+                value = obj.popitem()[1]
+            elif isinstance(obj, (list, set, deque)):
+                if not obj:
+                    stack.pop()
+                    continue
+                value = obj.pop()
+            else:
+                stack.pop()
+                stack.extend(part for part in _parts(obj) if isinstance(part, (dict, list, set, deque)))
+                continue
+            released += 1
+            if isinstance(value, (dict, list, set, deque)) and len(value) > _NESTED:
+                stack.append(value)
+        yield released
+
+class Reclaimer:
+    """
+    后台分片回收：整表失效与 clear 时从分段中摘下的数据（行、索引、淘汰策略、过期桶）
+    及前缀失效的清扫任务交给回收线程，每片最多处理 slice_items 项，片间暂停 pause 秒让出 GIL。
+    任务为生成器，每次 next 执行一片，多个任务轮转执行；有任务时按需启动线程，任务清空后线程退出。
+    """
+    def __init__(self, slice_items=1000, pause=0.0005):
+        self.slice_items = slice_items
+        self.pause = pause
+        self.lock = threading.Lock()
+        self.idle = threading.Condition(self.lock)
+        self.tasks = deque()
+        self.active = 0
+        self.reclaimed = 0  # 已释放的项数
+        self.logger = logging.getLogger('pg-cache')
+        self._thread = None
+
+    def release(self, *objects):
+        """
+        提交待释放的对象。
+        """
+        self.submit(release(objects, self.slice_items))
+
+    def submit(self, task):
+        """
+        提交生成器任务，每次 next 执行一片；产出的整数计入 reclaimed。
+        """
+        with self.lock:
+            self.tasks.append(task)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='pg-cache-reclaim', daemon=True)
+                self._thread.start()
+
+    def step(self):
+        """
+        执行一个任务的一片，返回是否还有待执行的任务。
+        """
+        with self.lock:
+            if not self.tasks:
+                return False
+            task = self.tasks.popleft()
+            self.active += 1
+        done = False
+        try:
+            released = next(task)
+        except StopIteration:
+            done = True
+            released = 0
+        except Exception:
+            self.logger.exception('后台回收任务失败')
+            done = True
+            released = 0
+        with self.lock:
+            self.active -= 1
+            self.reclaimed += released or 0
+            if not done:
+                self.tasks.append(task)
+            self.idle.notify_all()
+            return bool(self.tasks)
+
+    def _run(self):
+        while True:
+            with self.lock:
+                if not self.tasks:
+                    self._thread = None
+                    return
+            self.step()
+            time.sleep(self.pause)
+
+    def wait(self, timeout=None):
+        """
+        等待所有任务完成，返回是否在超时前完成。
+        """
+        with self.idle:
+            return self.idle.wait_for(lambda: not self.tasks and not self.active, timeout)
+
+    def pending(self):
+        with self.lock:
+            return len(self.tasks) + self.active
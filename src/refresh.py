@@ -0,0 +1,75 @@
+import logging
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+class RefreshAhead:
+    """
+    提前刷新：临近过期被读取的热点条目提交到有界线程池后台回源，读取方不等待数据库。
+    同一条目同时只有一个刷新任务；排队中的任务超过 max_pending 时丢弃新任务，
+    条目到期后由读取方同步回源兜底。按表统计刷新、失败、丢弃与返回旧值的次数。
+    close 之后不再接受任务，也不会重新创建线程池。
+    """
+    def __init__(self, workers=4, max_pending=1000):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.lock = threading.Lock()
+        self.pending = set()
+        self.executor = None  # 首次提交时创建
+        self.closed = False
+        self.stats = defaultdict(lambda: {'refreshes': 0, 'refresh_failures': 0,
+                                          'refresh_dropped': 0, 'stale_serves': 0})
+        self.logger = logging.getLogger('pg-cache')
+
+    def submit(self, table, key, fn):
+        """
+        提交刷新任务 fn()，key 用于去重；已关闭、已在刷新或队列已满时返回 False。
+        """
+        with self.lock:
+            if self.closed or key in self.pending:
+                return False
+            if len(self.pending) >= self.max_pending:
+                self.stats[table]['refresh_dropped'] += 1
+                return False
+            self.pending.add(key)
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(self.workers, thread_name_prefix='pg-cache-refresh')
+            executor = self.executor
+        try:
+            executor.submit(self._run, table, key, fn)
+        except RuntimeError:
+            # 释放锁后 close 已关闭线程池
+            with self.lock:
+                self.pending.discard(key)
+            return False
+        return True
+
+    def _run(self, table, key, fn):
+        try:
+            fn()
+            failed = False
+        except Exception as e:
+            failed = True
+            self.logger.warning('后台刷新失败 %s: %s', key, e)
+        with self.lock:
+            self.pending.discard(key)
+            self.stats[table]['refresh_failures' if failed else 'refreshes'] += 1
+
+    def record_stale(self, table):
+        with self.lock:
+            self.stats[table]['stale_serves'] += 1
+
+    def in_flight(self):
+        with self.lock:
+            return len(self.pending)
+
+    def get_stats(self):
+        with self.lock:
+            return {table: dict(stats) for table, stats in self.stats.items()}
+
+    def close(self, wait=True):
+        with self.lock:
+            self.closed = True
+            executor, self.executor = self.executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait)
@@ -0,0 +1,432 @@
+import fcntl
+import hashlib
+import mmap
+import os
+import pickle
+import struct
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from src.codec import decode_value
+from src.config_loader import ConfigLoader
+from src.query_engine import covers_query, select_rows
+from src.snapshot import entry_blocks, read_snapshot, write_blocks
+from src.storage import ABSENT, NEGATIVE, FieldRow, has_key_prefix
+
+MAGIC = b'PGCSHM01'
+HEADER = struct.Struct('<8sIII')             # 魔数, groups, ways, slot_size
+TABLE_SLOTS = 1024                          # 表代数槽位数，表名按 crc32 取模映射
+GENS_OFFSET = 64
+SLOTS_OFFSET = GENS_OFFSET + TABLE_SLOTS * 4
+# seq, state, flags, key_len, value_len, row_hash, expire_at, written_at, 表代数槽位, 写入时表代数
+SLOT = struct.Struct('<IBBHIQddHI')
+SEQ = struct.Struct('<I')
+GEN = struct.Struct('<I')
+EMPTY, LIVE = 0, 1
+FLAG_NEGATIVE = 1
+STRIPES = 64          # 跨进程写锁分段数，第 STRIPES 号锁用于表代数
+READ_RETRIES = 100
+PROTOCOL = pickle.HIGHEST_PROTOCOL
+
+def _row_hash(row_bytes):
+    # 进程间稳定的哈希（内置 hash 对字符串按进程随机化）
+    return int.from_bytes(hashlib.blake2b(row_bytes, digest_size=8).digest(), 'little')
+
+class SharedMemoryCache:
+    """
+    跨进程共享内存缓存后端：同一主机上的多个工作进程映射同一个文件（默认位于 /dev/shm），
+    读取直接访问映射内存，无需 IPC 往返。接口与 CacheManager 相同。
+
+    布局为固定大小的组相联哈希表：groups 个组，每组 ways 个定长槽位；(table, key) 决定所在组，
+    同一主键的各字段位于同一组，整行失效只需扫描一组。键与值以 pickle 序列化，超过槽位容量的值不缓存。
+    组满时覆盖最早写入的槽位。
+
+    并发：写入持有按组分段的跨进程锁（fcntl 字节范围锁 + 进程内线程锁），槽位以 seqlock 保护，
+    读取无锁，遇到并发写入时重试。表级失效通过递增共享的表代数完成，旧代数的槽位视为不存在。
+    命中、未命中、淘汰计数为进程内统计。
+    """
+    shared = True
+
+    def __init__(self, config_loader=None, path=None, groups=None, ways=None, slot_size=None):
+        self.config = config_loader or ConfigLoader()
+        conf = self.config.get_shared_memory_config()
+        self.path = path or conf.get('path', '/dev/shm/pg_cache')
+        groups = groups or conf.get('groups', 16384)
+        ways = ways or conf.get('ways', 8)
+        slot_size = slot_size or conf.get('slot_size', 256)
+        self._thread_locks = [threading.Lock() for _ in range(STRIPES + 1)]
+        self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        with self._lock_stripe(STRIPES):
+            if os.fstat(self.fd).st_size == 0:
+                os.ftruncate(self.fd, SLOTS_OFFSET + groups * ways * slot_size)
+                os.pwrite(self.fd, HEADER.pack(MAGIC, groups, ways, slot_size), 0)
+            magic, self.groups, self.ways, self.slot_size = HEADER.unpack(os.pread(self.fd, HEADER.size, 0))
+        if magic != MAGIC:
+            os.close(self.fd)
+            raise ValueError(f'无效的共享内存缓存文件: {self.path}')
+        self.capacity = self.slot_size - SLOT.size
+        self.mm = mmap.mmap(self.fd, SLOTS_OFFSET + self.groups * self.ways * self.slot_size)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.oversize = 0
+        self._load_compiled(self.config.get_compiled())
+
+    def _load_compiled(self, compiled):
+        self.grace = compiled.grace
+        self.max_grace = max(self.grace.values(), default=0)
+        self.columns = compiled.columns
+
+    def apply_config(self, old, new):
+        """
+        配置热加载后调整缓存。槽位对所有进程可见，无法逐条改写：从配置中删除的表、有字段被删除的表
+        整表失效（递增表代数），TTL 变化只影响之后的写入。
+        """
+        self._load_compiled(new)
+        removed_tables, removed_fields, _ = old.diff(new)
+        for table in removed_tables + list(removed_fields):
+            self.invalidate(table)
+        return None
+
+    def close(self):
+        self.mm.close()
+        os.close(self.fd)
+
+    def unlink(self):
+        os.unlink(self.path)
+
+    @contextmanager
+    def _lock_stripe(self, stripe):
+        with self._thread_locks[stripe]:
+            fcntl.lockf(self.fd, fcntl.LOCK_EX, 1, stripe)
+            try:
+                yield
+            finally:
+                fcntl.lockf(self.fd, fcntl.LOCK_UN, 1, stripe)
+
+    def _gen_slot(self, table):
+        return zlib.crc32(str(table).encode('utf-8')) % TABLE_SLOTS
+
+    def _gen(self, gen_slot):
+        return GEN.unpack_from(self.mm, GENS_OFFSET + gen_slot * 4)[0]
+
+    def _locate(self, table, key):
+        row_hash = _row_hash(pickle.dumps((table, key), PROTOCOL))
+        group = row_hash % self.groups
+        return row_hash, group, SLOTS_OFFSET + group * self.ways * self.slot_size
+
+    def _read_slot(self, off):
+        """
+        seqlock 读取槽位，返回 (header, key_bytes, value_bytes)；槽位为空、写入中或多次重试失败返回 None。
+        """
+        mm = self.mm
+        for _ in range(READ_RETRIES):
+            seq = SEQ.unpack_from(mm, off)[0]
+            if seq & 1:
+                continue
+            header = SLOT.unpack_from(mm, off)
+            if header[1] != LIVE:
+                if SEQ.unpack_from(mm, off)[0] == seq:
+                    return None
+                continue
+            start = off + SLOT.size
+            key_bytes = mm[start:start + header[3]]
+            value_bytes = mm[start + header[3]:start + header[3] + header[4]]
+            if SEQ.unpack_from(mm, off)[0] == seq:
+                return header, key_bytes, value_bytes
+        return None
+
+    def _is_fresh(self, header, now, grace=0):
+        # 槽位保存逻辑过期时间，grace 为允许读取过期条目的宽限期
+        expire_at = header[6]
+        return (not expire_at or now <= expire_at + grace) and header[9] == self._gen(header[8])
+
+    def _decode(self, header, value_bytes):
+        # 从内存后端快照恢复的值可能是 EncodedValue，读取时一并解码
+        return NEGATIVE if header[2] & FLAG_NEGATIVE else decode_value(pickle.loads(value_bytes))
+
+    def _write_slot(self, off, flags, key_bytes, value_bytes, row_hash, expire_at, gen_slot, gen):
+        seq = SEQ.unpack_from(self.mm, off)[0] | 1
+        SEQ.pack_into(self.mm, off, seq)
+        SLOT.pack_into(self.mm, off, seq, LIVE, flags, len(key_bytes), len(value_bytes), row_hash,
+                       expire_at or 0.0, time.time(), gen_slot, gen)
+        start = off + SLOT.size
+        self.mm[start:start + len(key_bytes) + len(value_bytes)] = key_bytes + value_bytes
+        SEQ.pack_into(self.mm, off, seq + 1)
+
+    def _clear_slot(self, off):
+        seq = SEQ.unpack_from(self.mm, off)[0] | 1
+        SEQ.pack_into(self.mm, off, seq)
+        self.mm[off + 4] = EMPTY
+        SEQ.pack_into(self.mm, off, seq + 1)
+
+    def _find(self, base, row_hash, key_bytes, now, grace=0):
+        for way in range(self.ways):
+            off = base + way * self.slot_size
+            slot = self._read_slot(off)
+            # 同一键可能残留过期或旧代数的副本，需继续查找有效副本
+            if (slot is not None and slot[0][5] == row_hash and slot[1] == key_bytes
+                    and self._is_fresh(slot[0], now, grace)):
+                return slot
+        return None
+
+    def _store(self, table, key, field, value, expire_at):
+        key_bytes = pickle.dumps((table, key, field), PROTOCOL)
+        negative = value is NEGATIVE
+        value_bytes = b'' if negative else pickle.dumps(value, PROTOCOL)
+        row_hash, group, base = self._locate(table, key)
+        gen_slot = self._gen_slot(table)
+        with self._lock_stripe(group % STRIPES):
+            if len(key_bytes) + len(value_bytes) > self.capacity:
+                # 值过大无法缓存，同时移除旧值以免读到过时数据
+                self.oversize += 1
+                self._remove(base, row_hash, key_bytes)
+                return
+            now = time.time()
+            target = free = victim = None
+            oldest = None
+            for way in range(self.ways):
+                off = base + way * self.slot_size
+                header = SLOT.unpack_from(self.mm, off)
+                # 宽限期内的条目仍可能被 lookup_expiry 读取，同一键须覆盖原槽位而非另存副本
+                if header[1] != LIVE or not self._is_fresh(header, now, self.max_grace):
+                    if free is None:
+                        free = off
+                    continue
+                if header[5] == row_hash and self.mm[off + SLOT.size:off + SLOT.size + header[3]] == key_bytes:
+                    target = off
+                    break
+                if oldest is None or header[7] < oldest:
+                    victim, oldest = off, header[7]
+            if target is None:
+                target = free
+            if target is None:
+                target = victim
+                self.evictions += 1
+            self._write_slot(target, FLAG_NEGATIVE if negative else 0, key_bytes, value_bytes, row_hash,
+                             expire_at, gen_slot, self._gen(gen_slot))
+
+    def _remove(self, base, row_hash, key_bytes):
+        for way in range(self.ways):
+            off = base + way * self.slot_size
+            header = SLOT.unpack_from(self.mm, off)
+            if (header[1] == LIVE and header[5] == row_hash
+                    and self.mm[off + SLOT.size:off + SLOT.size + header[3]] == key_bytes):
+                self._clear_slot(off)
+
+    def set(self, table, key, field, value, ttl=None):
+        self._store(table, key, field, value, time.time() + ttl if ttl else None)
+
+    def lookup(self, table, key, field):
+        return self._lookup(table, key, field, 0)[0]
+
+    def lookup_expiry(self, table, key, field):
+        """
+        返回 (value, 逻辑过期时间)；配置了 stale_grace 的表在宽限期内仍返回旧值。
+        """
+        return self._lookup(table, key, field, self.grace.get(table, 0))
+
+    def _lookup(self, table, key, field, grace):
+        row_hash, _, base = self._locate(table, key)
+        slot = self._find(base, row_hash, pickle.dumps((table, key, field), PROTOCOL), time.time(), grace)
+        if slot is None:
+            self.misses += 1
+            return ABSENT, None
+        self.hits += 1
+        return self._decode(slot[0], slot[2]), slot[0][6] or None
+
+    def get(self, table, key, field):
+        value = self.lookup(table, key, field)
+        if value is ABSENT or value is NEGATIVE:
+            return None
+        return value
+
+    def lookup_many(self, table, pairs):
+        result = {}
+        for key, field in pairs:
+            value = self.lookup(table, key, field)
+            if value is not ABSENT:
+                result[(key, field)] = value
+        return result
+
+    def get_many(self, table, pairs):
+        return {pair: value for pair, value in self.lookup_many(table, pairs).items() if value is not NEGATIVE}
+
+    def get_row(self, table, key, fields=None):
+        row_hash, _, base = self._locate(table, key)
+        now = time.time()
+        result = {}
+        for way in range(self.ways):
+            slot = self._read_slot(base + way * self.slot_size)
+            if slot is None or slot[0][5] != row_hash or not self._is_fresh(slot[0], now):
+                continue
+            slot_table, slot_key, field = pickle.loads(slot[1])
+            if slot_table == table and slot_key == key and (fields is None or field in fields):
+                value = self._decode(slot[0], slot[2])
+                if value is not NEGATIVE:
+                    result[field] = value
+        requested = len(fields) if fields is not None else len(result)
+        self.hits += len(result)
+        self.misses += requested - len(result)
+        return result
+
+    def set_many(self, table, items, ttl=None):
+        if isinstance(items, dict):
+            items = [(key, field, value) for (key, field), value in items.items()]
+        expire_at = time.time() + ttl if ttl else None
+        for key, field, value in items:
+            self._store(table, key, field, value, expire_at)
+
+    def restore_rows(self, table, rows):
+        now = time.time()
+        written = skipped = 0
+        for key, entries in rows:
+            for field, value, expire_at in entries:
+                if expire_at is not None and expire_at <= now:
+                    skipped += 1
+                    continue
+                self._store(table, key, field, value, expire_at)
+                written += 1
+        return written, skipped
+
+    def invalidate(self, table, key=None, field=None, deleted=False):
+        if key is None:
+            # 表级失效：递增表代数，所有进程中该表的旧槽位立即失效
+            gen_slot = self._gen_slot(table)
+            with self._lock_stripe(STRIPES):
+                GEN.pack_into(self.mm, GENS_OFFSET + gen_slot * 4, (self._gen(gen_slot) + 1) & 0xFFFFFFFF)
+            return
+        row_hash, group, base = self._locate(table, key)
+        with self._lock_stripe(group % STRIPES):
+            if field is not None:
+                self._remove(base, row_hash, pickle.dumps((table, key, field), PROTOCOL))
+                return
+            for way in range(self.ways):
+                off = base + way * self.slot_size
+                header = SLOT.unpack_from(self.mm, off)
+                if header[1] != LIVE or header[5] != row_hash:
+                    continue
+                slot_table, slot_key, _ = pickle.loads(self.mm[off + SLOT.size:off + SLOT.size + header[3]])
+                if slot_table == table and slot_key == key:
+                    self._clear_slot(off)
+
+    def invalidate_prefix(self, table, prefix):
+        """
+        按主键前缀失效（语义同 CacheManager.invalidate_prefix）：扫描槽位找出匹配的主键后逐行失效，
+        每行只持有所在分组的锁。
+        """
+        if not isinstance(prefix, (str, tuple)):
+            prefix = (prefix,)
+        keys = {key for _, key, _, _, _ in self._scan(table) if has_key_prefix(key, prefix)}
+        self.invalidate_many(table, keys)
+
+    def invalidate_many(self, table, keys, fields=None, deleted=False):
+        for key in keys:
+            if fields is None:
+                self.invalidate(table, key)
+            else:
+                for field in fields:
+                    self.invalidate(table, key, field)
+
+    def _scan(self, table=None):
+        """
+        遍历所有有效槽位，产出 (table, key, field, value, expire_at)。
+        """
+        now = time.time()
+        for group in range(self.groups):
+            base = SLOTS_OFFSET + group * self.ways * self.slot_size
+            for way in range(self.ways):
+                slot = self._read_slot(base + way * self.slot_size)
+                if slot is None or not self._is_fresh(slot[0], now):
+                    continue
+                slot_table, key, field = pickle.loads(slot[1])
+                if table is None or slot_table == table:
+                    yield slot_table, key, field, self._decode(slot[0], slot[2]), slot[0][6] or None
+
+    def table_size(self, table):
+        return len({key for _, key, _, _, _ in self._scan(table)})
+
+    def table_stats(self, sample=64):
+        stats = {}
+        for table, key, _, _, _ in self._scan():
+            entry = stats.setdefault(table, {'keys': set(), 'bytes': 0})
+            entry['keys'].add(key)
+            entry['bytes'] += self.slot_size
+        return {table: {'keys': len(entry['keys']), 'bytes': entry['bytes']} for table, entry in stats.items()}
+
+    def dump_cache(self):
+        result = {}
+        for table, key, field, value, _ in self._scan():
+            if value is not NEGATIVE:
+                result.setdefault(table, {}).setdefault(key, {})[field] = value
+        return result
+
+    def clear(self):
+        with self._lock_stripe(STRIPES):
+            for gen_slot in range(TABLE_SLOTS):
+                GEN.pack_into(self.mm, GENS_OFFSET + gen_slot * 4, (self._gen(gen_slot) + 1) & 0xFFFFFFFF)
+
+    # 本地查询：共享内存中的数据可能被其他进程淘汰，不支持常驻标记，仅无源模式下全表扫描执行
+    def residency_token(self, table):
+        return None
+
+    def mark_resident(self, table, token):
+        return False
+
+    def is_resident(self, table):
+        return False
+
+    def select(self, table, key_field, filters, fields, limit=None, offset=None, require_resident=True):
+        if require_resident or not covers_query(self.columns.get(table), filters, fields):
+            return None
+        rows = {}
+        for _, key, field, value, expire_at in self._scan(table):
+            row = rows.get(key)
+            if row is None:
+                row = rows[key] = FieldRow()
+            row.write(field, value, expire_at)
+        matched = select_rows(rows, None, key_field, filters, fields, time.time(), False)
+        try:
+            matched.sort(key=lambda item: item[0])
+        except TypeError:
+            pass
+        start = offset or 0
+        end = start + limit if limit else None
+        return [tuple(values) for _, values in matched[start:end]]
+
+    # 过期条目在读取时按时间判断、写入时复用槽位，无需后台回收
+    def start_expiry(self, interval=0.1, slice_items=256, slice_time=0.001):
+        return None
+
+    def stop_expiry(self):
+        pass
+
+    def expire_step(self, max_items=256, slice_time=0.001):
+        return 0
+
+    def save_snapshot(self, path, tables=None, chunk_keys=1000):
+        """
+        遍历有效槽位写入与 CacheManager 相同格式的快照，可在主机重启或迁移后由任一后端加载。
+        遍历不加锁，并发写入的条目可能被写入或遗漏。
+        """
+        return write_blocks(path, entry_blocks(self._scan(), tables, chunk_keys))
+
+    def load_snapshot(self, path, tables=None):
+        return read_snapshot(self, path, tables)
+
+    def get_stats(self):
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0,
+            'evictions': self.evictions,
+            'evictions_by_table': {},
+            'expired': 0,
+            'expiry_scheduled': 0,
+            'expiry_backlog': 0,
+            'expired_per_second': 0,
+            'encoding': {},
+            'oversize': self.oversize
+        }
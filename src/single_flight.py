@@ -0,0 +1,76 @@
+import asyncio
+import threading
+
+class _Call:
+    __slots__ = ('event', 'result', 'error')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight:
+    """
+    请求合并：同一 key 的并发调用只执行一次，其余调用等待并共享结果（或异常）。
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.coalesced = 0
+
+    def do(self, key, fn):
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = _Call()
+            else:
+                self.coalesced += 1
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.event.set()
+        return call.result
+
+    def in_flight(self):
+        with self.lock:
+            return len(self.calls)
+
+class AsyncSingleFlight:
+    """
+    asyncio 版请求合并：同一 key 的并发协程共享同一个任务，fn 只执行一次。
+    fn 在独立任务中运行，所有调用方（包括首个）都通过 shield 等待，
+    任一调用方被取消都不会中断查询或影响其他等待方。
+    仅在单个事件循环内使用，无需加锁。
+    """
+    def __init__(self):
+        self.calls = {}
+        self.coalesced = 0
+
+    async def do(self, key, fn):
+        task = self.calls.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            task = self.calls[key] = asyncio.get_running_loop().create_task(fn())
+            task.add_done_callback(lambda done: self._finish(key, done))
+        return await asyncio.shield(task)
+
+    def _finish(self, key, task):
+        if self.calls.get(key) is task:
+            del self.calls[key]
+        if not task.cancelled():
+            task.exception()  # 没有等待方时避免 “exception was never retrieved” 警告
+
+    def in_flight(self):
+        return len(self.calls)
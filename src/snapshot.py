@@ -0,0 +1,137 @@
+import mmap
+import os
+import pickle
+import struct
+import time
+from src.storage import NEGATIVE
+
+MAGIC = b'PGCSNAP1'
+HEADER = struct.Struct('<8sd')   # 魔数, 生成时间
+FOOTER = struct.Struct('<QQ8s')  # 索引偏移, 索引长度, 魔数
+
+def write_snapshot(cache_manager, path, tables=None, chunk_keys=1000):
+    """
+    将缓存写为二进制快照：按分段、按 chunk_keys 个主键分块，每块单独 pickle，
+    只在复制该块条目时持有对应分段的锁，编码与写盘在锁外进行。
+    保留主键类型与绝对过期时间，跳过已过期条目和负缓存；
+    tables 为 None 时写入除内部命名空间（以 __ 开头，如结构化查询结果）外的所有表。
+    先写临时文件再原子替换，返回写入统计。
+    """
+    return write_blocks(path, _shard_blocks(cache_manager, tables, chunk_keys))
+
+def _wanted(table, tables):
+    return table in tables if tables is not None else not str(table).startswith('__')
+
+def _shard_blocks(cache_manager, tables, chunk_keys):
+    for shard in cache_manager.shards:
+        with shard.lock:
+            shard_keys = {table: list(rows) for table, rows in shard.tables.items() if _wanted(table, tables)}
+        for table, keys in shard_keys.items():
+            for offset in range(0, len(keys), chunk_keys):
+                rows, max_expire = _copy_rows(shard, table, keys[offset:offset + chunk_keys])
+                if rows:
+                    yield table, rows, max_expire
+
+def entry_blocks(entries, tables=None, chunk_keys=1000):
+    """
+    把 (table, key, field, value, expire_at) 条目流按表、按 chunk_keys 个主键分块，
+    产出与 write_snapshot 相同的块 (table, [(key, [(field, value, expire_at)])], 块内最晚过期时间)。
+    供没有分段结构的后端（如共享内存）写快照；跳过负缓存与已过期条目。
+    """
+    now = time.time()
+    by_table = {}
+    for table, key, field, value, expire_at in entries:
+        if value is NEGATIVE or (expire_at is not None and expire_at <= now) or not _wanted(table, tables):
+            continue
+        by_table.setdefault(table, {}).setdefault(key, []).append((field, value, expire_at))
+    for table, keys in by_table.items():
+        items = list(keys.items())
+        for offset in range(0, len(items), chunk_keys):
+            rows = items[offset:offset + chunk_keys]
+            expires = [expire_at for _, row in rows for _, _, expire_at in row]
+            yield table, rows, None if None in expires else max(expires)
+
+def write_blocks(path, blocks):
+    """
+    把 (table, rows, max_expire) 块写为快照文件：每块单独 pickle，尾部写入块索引，
+    先写临时文件再原子替换，返回写入统计。
+    """
+    start = time.perf_counter()
+    index = []  # [(table, 偏移, 长度, 主键数, 块内最晚过期时间，None 表示含永不过期条目)]
+    keys_written = entries_written = 0
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, time.time()))
+        for table, rows, max_expire in blocks:
+            data = pickle.dumps(rows, protocol=pickle.HIGHEST_PROTOCOL)
+            index.append((table, f.tell(), len(data), len(rows), max_expire))
+            f.write(data)
+            keys_written += len(rows)
+            entries_written += sum(len(entries) for _, entries in rows)
+        index_data = pickle.dumps(index, protocol=pickle.HIGHEST_PROTOCOL)
+        index_offset = f.tell()
+        f.write(index_data)
+        f.write(FOOTER.pack(index_offset, len(index_data), MAGIC))
+        size = f.tell()
+    os.replace(tmp_path, path)
+    return {
+        'blocks': len(index),
+        'keys': keys_written,
+        'entries': entries_written,
+        'bytes': size,
+        'elapsed': time.perf_counter() - start
+    }
+
+def _copy_rows(shard, table, keys):
+    now = time.time()
+    rows = []
+    max_expire = 0.0
+    with shard.lock:
+        table_rows = shard.tables.get(table, {})
+        for key in keys:
+            row = table_rows.get(key)
+            if row is None or shard.is_stale(table, key):
+                continue
+            entries = []
+            for field, value, expire_at in row.entries():
+                if value is NEGATIVE or (expire_at is not None and expire_at <= now):
+                    continue
+                entries.append((field, value, expire_at))
+                if max_expire is not None:
+                    max_expire = None if expire_at is None else max(max_expire, expire_at)
+            if entries:
+                rows.append((key, entries))
+    return rows, max_expire
+
+def read_snapshot(cache_manager, path, tables=None):
+    """
+    从快照恢复缓存：mmap 映射文件后先读取尾部索引，按块惰性解码——
+    未请求的表和整块已过期的块直接跳过，不做反序列化；块内已过期条目在写入时跳过。
+    快照文件需为本进程或可信来源生成（pickle 编码）。返回恢复统计。
+    """
+    start = time.perf_counter()
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size < HEADER.size + FOOTER.size:
+            raise ValueError(f'无效的缓存快照文件: {path}')
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            magic, created_at = HEADER.unpack_from(mm, 0)
+            index_offset, index_length, tail = FOOTER.unpack_from(mm, len(mm) - FOOTER.size)
+            if magic != MAGIC or tail != MAGIC:
+                raise ValueError(f'无效的缓存快照文件: {path}')
+            index = pickle.loads(mm[index_offset:index_offset + index_length])
+            now = time.time()
+            loaded = skipped = blocks_skipped = 0
+            for table, offset, length, _, max_expire in index:
+                if (tables is not None and table not in tables) or (max_expire is not None and max_expire <= now):
+                    blocks_skipped += 1
+                    continue
+                written, expired = cache_manager.restore_rows(table, pickle.loads(mm[offset:offset + length]))
+                loaded += written
+                skipped += expired
+    return {
+        'created_at': created_at,
+        'entries': loaded,
+        'skipped_expired': skipped,
+        'blocks_skipped': blocks_skipped,
+        'elapsed': time.perf_counter() - start
+    }
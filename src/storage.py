@@ -0,0 +1,275 @@
+import sys
+import time
+
+ABSENT = object()   # 字段不存在
+EXPIRED = object()  # 字段存在但已过期
+ROW = object()      # 紧凑行的整行过期调度标记
+NEGATIVE = object() # 负缓存：数据库中不存在该记录
+
+QUERY_FIELD = '__struct_query__'
+
+def query_namespace(table):
+    # 结构化查询结果与行级缓存分开存放，失效查询不会波及行数据
+    return f'{QUERY_FIELD}:{table}'
+
+def has_key_prefix(key, prefix):
+    """
+    主键是否以 prefix 开头：字符串前缀匹配字符串主键，元组前缀匹配复合主键（元组）的前若干列。
+    """
+    if isinstance(prefix, tuple):
+        return isinstance(key, tuple) and key[:len(prefix)] == prefix
+    return isinstance(key, str) and key.startswith(prefix)
+
+def estimate_size(value):
+    """
+    估算缓存值占用的字节数（容器类只展开一层）。
+    """
+    size = sys.getsizeof(value)
+    if isinstance(value, (list, tuple, set, frozenset)):
+        size += sum(sys.getsizeof(item) for item in value)
+    elif isinstance(value, dict):
+        size += sum(sys.getsizeof(k) + sys.getsizeof(v) for k, v in value.items())
+    return size
+
+def _retimed(value, expire_at, delta, start):
+    if value is NEGATIVE:
+        return expire_at
+    if expire_at is None:
+        return start
+    return expire_at if delta is None else expire_at + delta
+
+class CacheEntry:
+    __slots__ = ('value', 'expire_at')
+
+    def __init__(self, value, expire_at=None):
+        self.value = value
+        self.expire_at = expire_at  # 绝对过期时间戳
+
+    def is_expired(self):
+        return self.expire_at is not None and time.time() > self.expire_at
+
+class FieldRow(dict):
+    """
+    普通行：{field: CacheEntry}，每个字段独立过期。
+    """
+    __slots__ = ()
+
+    def read(self, field, now=None):
+        entry = self.get(field)
+        if entry is None:
+            return ABSENT
+        expire_at = entry.expire_at
+        if expire_at is not None and (now or time.time()) > expire_at:
+            return EXPIRED
+        return entry.value
+
+    def peek(self, field):
+        entry = self.get(field)
+        return ABSENT if entry is None else entry.value
+
+    def expire_at_of(self, field):
+        entry = self.get(field)
+        return None if entry is None else entry.expire_at
+
+    def write(self, field, value, expire_at):
+        """
+        写入字段，返回需要登记到过期桶的标记（None 表示无需登记）。
+        """
+        self[field] = CacheEntry(value, expire_at)
+        return field
+
+    def retime(self, delta, start):
+        """
+        配置 TTL 变化后调整过期时间：delta 不为 None 时有过期时间的字段平移 delta 秒，
+        start 不为 None 时无过期时间的字段改为在 start 过期；负缓存不变。返回需登记的 [(标记, 过期时间)]。
+        """
+        tokens = []
+        for field, entry in self.items():
+            entry.expire_at = _retimed(entry.value, entry.expire_at, delta, start)
+            if entry.expire_at is not None and entry.value is not NEGATIVE:
+                tokens.append((field, entry.expire_at))
+        return tokens
+
+    def expire(self, field, now):
+        """
+        若字段已过期则删除，返回被删除的值列表。
+        """
+        entry = self.get(field)
+        if entry is None or entry.expire_at is None or now <= entry.expire_at:
+            return []
+        del self[field]
+        return [entry.value]
+
+    def remove(self, field):
+        """
+        删除字段，返回被删除的值列表。
+        """
+        entry = self.pop(field, None)
+        return [] if entry is None else [entry.value]
+
+    def entries(self):
+        for field, entry in self.items():
+            yield field, entry.value, entry.expire_at
+
+class CompactRow:
+    """
+    紧凑行：按 cache.yaml 中配置的字段顺序定位存储值，整行共享一个过期时间。
+    字段过期时间不一致时退化为逐字段过期数组；未配置的字段存放在 extra 中。
+    """
+    __slots__ = ('layout', 'values', 'expire_at', 'expires', 'extra')
+
+    # 同一行字段写入时间差在此范围内视为同一过期时间
+    EXPIRY_TOLERANCE = 0.001
+
+    def __init__(self, layout):
+        self.layout = layout  # {field: 位置}，同表所有行共享
+        self.values = [ABSENT] * len(layout)
+        self.expire_at = None
+        self.expires = None
+        self.extra = None
+
+    def __len__(self):
+        return len(self.values) - self.values.count(ABSENT) + (len(self.extra) if self.extra else 0)
+
+    def read(self, field, now=None):
+        idx = self.layout.get(field)
+        if idx is None:
+            entry = self.extra.get(field) if self.extra else None
+            if entry is None:
+                return ABSENT
+            value, expire_at = entry.value, entry.expire_at
+        else:
+            value = self.values[idx]
+            if value is ABSENT:
+                return ABSENT
+            expire_at = self.expire_at if self.expires is None else self.expires[idx]
+        if expire_at is not None and (now or time.time()) > expire_at:
+            return EXPIRED
+        return value
+
+    def peek(self, field):
+        idx = self.layout.get(field)
+        if idx is None:
+            entry = self.extra.get(field) if self.extra else None
+            return ABSENT if entry is None else entry.value
+        return self.values[idx]
+
+    def write(self, field, value, expire_at):
+        """
+        写入字段，返回需要登记到过期桶的标记：字段名、ROW（整行）或 None（无需登记）。
+        """
+        idx = self.layout.get(field)
+        if idx is None:
+            if self.extra is None:
+                self.extra = {}
+            self.extra[field] = CacheEntry(value, expire_at)
+            return field
+        values = self.values
+        if self.expires is not None:
+            values[idx] = value
+            self.expires[idx] = expire_at
+            return field
+        others = len(values) - values.count(ABSENT) - (values[idx] is not ABSENT)
+        shared = self.expire_at
+        if others and not self._same_expiry(shared, expire_at):
+            # 过期时间不一致，退化为逐字段过期
+            self.expires = [shared if v is not ABSENT else None for v in values]
+            self.expires[idx] = expire_at
+            self.expire_at = None
+            values[idx] = value
+            return field
+        values[idx] = value
+        self.expire_at = expire_at
+        if expire_at is None or (others and shared is not None and int(shared) == int(expire_at)):
+            return None
+        return ROW
+
+    def retime(self, delta, start):
+        """
+        与 FieldRow.retime 相同；共享过期时间的行整体调整并只登记一个 ROW 标记，不退化为逐字段过期。
+        """
+        tokens = []
+        values = self.values
+        if self.expires is None:
+            present = [v for v in values if v is not ABSENT]
+            if present and not all(v is NEGATIVE for v in present):
+                self.expire_at = _retimed(None, self.expire_at, delta, start)
+                if self.expire_at is not None:
+                    tokens.append((ROW, self.expire_at))
+        else:
+            for field, idx in self.layout.items():
+                if values[idx] is not ABSENT:
+                    self.expires[idx] = _retimed(values[idx], self.expires[idx], delta, start)
+                    if self.expires[idx] is not None and values[idx] is not NEGATIVE:
+                        tokens.append((field, self.expires[idx]))
+        if self.extra:
+            for field, entry in self.extra.items():
+                entry.expire_at = _retimed(entry.value, entry.expire_at, delta, start)
+                if entry.expire_at is not None and entry.value is not NEGATIVE:
+                    tokens.append((field, entry.expire_at))
+        return tokens
+
+    def _same_expiry(self, a, b):
+        if a is None or b is None:
+            return a is b
+        return abs(a - b) <= self.EXPIRY_TOLERANCE
+
+    def expire(self, field, now):
+        """
+        删除已过期的字段（ROW 表示整行），返回被删除的值列表。
+        """
+        if field is not ROW:
+            expire_at = self.expire_at_of(field)
+            if expire_at is None or now <= expire_at:
+                return []
+            return self.remove(field)
+        if self.expires is None:
+            if self.expire_at is None or now <= self.expire_at:
+                return []
+            return self.remove(ROW)
+        removed = []
+        for idx, expire_at in enumerate(self.expires):
+            if expire_at is not None and now > expire_at and self.values[idx] is not ABSENT:
+                removed.append(self.values[idx])
+                self.values[idx] = ABSENT
+                self.expires[idx] = None
+        return removed
+
+    def expire_at_of(self, field):
+        idx = self.layout.get(field)
+        if idx is None:
+            entry = self.extra.get(field) if self.extra else None
+            return entry.expire_at if entry is not None else None
+        if self.values[idx] is ABSENT:
+            return None
+        return self.expire_at if self.expires is None else self.expires[idx]
+
+    def remove(self, field):
+        """
+        删除字段（ROW 表示全部配置字段），返回被删除的值列表。
+        """
+        if field is ROW:
+            removed = [v for v in self.values if v is not ABSENT]
+            self.values = [ABSENT] * len(self.values)
+            self.expires = None
+            return removed
+        idx = self.layout.get(field)
+        if idx is None:
+            entry = self.extra.pop(field, None) if self.extra else None
+            return [] if entry is None else [entry.value]
+        value = self.values[idx]
+        if value is ABSENT:
+            return []
+        self.values[idx] = ABSENT
+        if self.expires is not None:
+            self.expires[idx] = None
+        return [value]
+
+    def entries(self):
+        for field, idx in self.layout.items():
+            value = self.values[idx]
+            if value is not ABSENT:
+                yield field, value, self.expire_at if self.expires is None else self.expires[idx]
+        if self.extra:
+            for field, entry in self.extra.items():
+                yield field, entry.value, entry.expire_at
@@ -1,44 +1,323 @@
 from src.cache_manager import CacheManager
 from src.db_client import PostgresClient
 from src.config_loader import ConfigLoader
+from src.paged_result import OVERSIZED, ColumnarResult, page_of
+from src.query_engine import _hashable
+from src.storage import QUERY_FIELD, query_namespace
 import hashlib
 import json
+import threading
+import time
+
+class QueryDependencyIndex:
+    """
+    查询依赖索引：记录每个已缓存查询的等值/IN 过滤条件，
+    行写入时只找出可能包含该行的查询（过滤列未约束，或约束值与该行取值相符）。
+    登记时记录结果的过期时间，单表登记数达到 max_queries 时先注销已过期的查询，仍满则拒绝登记（计入 rejected）。
+    """
+    def __init__(self, max_queries=100000):
+        self.lock = threading.Lock()
+        self.max_queries = max_queries
+        self.rejected = 0
+        self.queries = {}    # {table: {cache_key: ([过滤列], [by_value 索引键], 过期时间)}}
+        self.by_column = {}  # {table: {column: {cache_key}}}
+        self.by_value = {}   # {table: {(column, value): {cache_key}}}，按表分开存放，整表清除为 O(1)
+        self.versions = {}   # {table: 失效次数}，用于丢弃与失效并发的查询结果
+
+    def version(self, table):
+        with self.lock:
+            return self.versions.get(table, 0)
+
+    def register(self, table, cache_key, filters, version, expire_at=None):
+        """
+        登记查询依赖，expire_at 为结果的过期时间（None 表示不过期）；
+        若查询期间表已发生失效（版本变化）或登记数已满返回 False，结果不应缓存。
+        """
+        with self.lock:
+            if self.versions.get(table, 0) != version:
+                return False
+            table_queries = self.queries.setdefault(table, {})
+            if cache_key in table_queries:
+                columns, value_keys, _ = table_queries[cache_key]
+                table_queries[cache_key] = (columns, value_keys, expire_at)
+                return True
+            if len(table_queries) >= self.max_queries:
+                now = time.time()
+                for key in [k for k, entry in table_queries.items() if entry[2] is not None and entry[2] <= now]:
+                    self._unregister(table, key)
+                if len(table_queries) >= self.max_queries:
+                    self.rejected += 1
+                    return False
+            value_keys = []
+            by_column = self.by_column.setdefault(table, {})
+            by_value = self.by_value.setdefault(table, {})
+            for column, value in (filters or {}).items():
+                by_column.setdefault(column, set()).add(cache_key)
+                for v in (value if isinstance(value, list) else [value]):
+                    index_key = (column, _hashable(v))
+                    by_value.setdefault(index_key, set()).add(cache_key)
+                    value_keys.append(index_key)
+            table_queries[cache_key] = (list(filters or {}), value_keys, expire_at)
+            return True
+
+    def pop_affected(self, table, row_values=None):
+        """
+        取出并注销可能包含指定行的查询。row_values: {column: 取值或候选取值列表}，为空表示全部查询。
+        """
+        with self.lock:
+            self.versions[table] = self.versions.get(table, 0) + 1
+            table_queries = self.queries.get(table)
+            if not table_queries:
+                return []
+            affected = set(table_queries)
+            by_column = self.by_column.get(table, {})
+            by_value = self.by_value.get(table, {})
+            for column, value in (row_values or {}).items():
+                candidates = value if isinstance(value, (list, tuple, set)) else [value]
+                matching = set()
+                for v in candidates:
+                    matching |= by_value.get((column, _hashable(v)), set())
+                constrained = by_column.get(column, set())
+                affected &= (set(table_queries) - constrained) | matching
+                if not affected:
+                    break
+            for cache_key in affected:
+                self._unregister(table, cache_key)
+            return list(affected)
+
+    def _unregister(self, table, cache_key):
+        columns, value_keys, _ = self.queries[table].pop(cache_key)
+        for index, index_keys in ((self.by_column[table], columns), (self.by_value[table], value_keys)):
+            for index_key in index_keys:
+                keys = index.get(index_key)
+                if keys is not None:
+                    keys.discard(cache_key)
+                    if not keys:
+                        del index[index_key]
+
+    def discard(self, table, cache_key):
+        with self.lock:
+            if cache_key in self.queries.get(table, {}):
+                self._unregister(table, cache_key)
+
+    def clear(self, table):
+        with self.lock:
+            self.versions[table] = self.versions.get(table, 0) + 1
+            self.queries.pop(table, None)
+            self.by_column.pop(table, None)
+            self.by_value.pop(table, None)
+
+class QueryPlan:
+    """
+    一次结构化查询的执行状态，由 StructuredQuery.plan 创建：done 为 True 时 result 即查询结果；
+    否则按 statement 返回的 SQL 查询数据库，把取回的行交给 store 缓存，再由 finish 得出结果。
+    paged 为 True 时先取完整结果（缓存 key 不含 limit/offset），请求的页不在已取回的行中时 finish 转为按页查询，
+    需再执行一轮。同步与异步接口共用，数据库访问由调用方完成。
+    """
+    __slots__ = ('table', 'filters', 'fields', 'limit', 'offset', 'cache_result', 'ttl',
+                 'cache_key', 'paged', 'version', 'max_rows', 'done', 'result')
+
+    def __init__(self, table, filters, fields, limit, offset, cache_result, ttl):
+        self.table = table
+        self.filters = filters
+        self.fields = fields
+        self.limit = limit
+        self.offset = offset
+        self.cache_result = cache_result
+        self.ttl = ttl
+        self.cache_key = None
+        self.paged = False
+        self.version = None   # 执行查询前的依赖索引版本
+        self.max_rows = None  # 分页模式下完整结果的行数上限
+        self.done = False
+        self.result = None
 
 class StructuredQuery:
     """
     结构化查询接口，支持多条件、字段选择、分页，并支持结果缓存与失效。
+    查询结果缓存在独立命名空间（query_namespace(table)）中，并登记到依赖索引，
+    行写入时通过 invalidate_for_write 只失效可能包含该行的查询。
+    已全量同步的常驻表（及无源模式下的缓存表）直接在本地按二级索引执行查询，不访问数据库。
+    启用 query_paging 后，带 limit/offset 的查询取回完整结果按列缓存一次（键不含 limit/offset），各页从中切片返回；
+    完整结果超过 max_rows / max_bytes 时标记为 OVERSIZED，之后按页查询并分别缓存。
     """
     def __init__(self, cache_manager=None, db_client=None, config_loader=None):
         self.config = config_loader or ConfigLoader()
         self.no_db_mode = self.config.get_no_db_mode()
         self.cache = cache_manager or CacheManager()
         self.db = None if self.no_db_mode else (db_client or PostgresClient())
+        self.dependencies = QueryDependencyIndex()
+        self.local_queries = 0
+        self.paged_queries = 0  # 从已缓存完整结果切片返回的页数
 
     def query(self, table, filters: dict, fields: list, limit=None, offset=None, cache_result=True, ttl=None):
-        # 生成结构化查询缓存 key
-        cache_key = self._make_cache_key(table, filters, fields, limit, offset)
-        if cache_result:
-            result = self.cache.get(table, cache_key, '__struct_query__')
+        plan = self.plan(table, filters, fields, limit, offset, cache_result, ttl)
+        while not plan.done:
+            sql, params = self.statement(plan)
+            rows = self.db.query(sql, params)
+            self.finish(plan, self.store(plan, rows), rows)
+        return plan.result
+
+    def plan(self, table, filters, fields, limit=None, offset=None, cache_result=True, ttl=None):
+        """
+        查找已缓存的结果并尝试在本地执行，返回 QueryPlan；无源模式下未命中时结果为空列表。
+        """
+        plan = QueryPlan(table, filters, fields, limit, offset, cache_result, ttl)
+        result, plan.cache_key, plan.paged = self._lookup(table, filters, fields, limit, offset, cache_result)
+        if result is None:
+            result = self._local_query(table, filters, fields, limit, offset)
             if result is not None:
-                return result
-        if self.no_db_mode:
-            # 无源模式下仅查缓存，不查数据库
-            return []
-        # 构造 SQL
-        where, params = self._build_where(filters)
-        sql = f"SELECT {', '.join(fields)} FROM {table} {where}"
-        if limit:
-            sql += f" LIMIT {limit}"
-        if offset:
-            sql += f" OFFSET {offset}"
-        rows = self.db.query(sql, params)
-        if cache_result:
-            self.cache.set(table, cache_key, '__struct_query__', rows, ttl)
+                self.local_queries += 1
+            elif self.no_db_mode:
+                # 无源模式下仅查缓存，不查数据库
+                result = []
+        if result is not None:
+            plan.done, plan.result = True, result
+        return plan
+
+    def statement(self, plan):
+        """
+        返回本轮需执行的 (sql, params)，并记下执行前的依赖索引版本，store 据此丢弃与写入并发的结果。
+        """
+        plan.version = self.dependencies.version(plan.table)
+        if plan.paged:
+            plan.max_rows = self._paging_max_rows()
+            return self._build_sql(plan.table, plan.filters, plan.fields, plan.max_rows + 1, None)
+        return self._build_sql(plan.table, plan.filters, plan.fields, plan.limit, plan.offset)
+
+    def store(self, plan, rows):
+        """
+        缓存 statement 查询取回的行，返回交给 finish 的结果：分页模式下为 ColumnarResult（超出上限时为 None），
+        否则为 rows。
+        """
+        if plan.paged:
+            return self._store_full(plan.table, plan.cache_key, plan.filters, plan.fields, rows, plan.version,
+                                    plan.ttl)
+        if plan.cache_result:
+            self._store(plan.table, plan.cache_key, plan.filters, rows, plan.version, plan.ttl)
         return rows
 
+    def finish(self, plan, stored, rows):
+        """
+        由 store 的返回值与取回的行得出结果，返回 plan.done；完整结果中没有请求的页时转为按页查询。
+        """
+        if plan.paged:
+            full = stored if isinstance(stored, ColumnarResult) else None
+            rows = self._page_of_fetched(full, rows, plan.limit, plan.offset, plan.max_rows or self._paging_max_rows())
+            if rows is None:
+                plan.paged = False
+                plan.cache_key = self._make_cache_key(plan.table, plan.filters, plan.fields, plan.limit, plan.offset)
+                return False
+        plan.done, plan.result = True, rows
+        return True
+
+    def _lookup(self, table, filters, fields, limit, offset, cache_result):
+        """
+        查找已缓存的结果，返回 (结果或 None, 缓存 key, 是否按完整结果分页)。
+        """
+        paging = self.config.get_query_paging_config()
+        if cache_result and paging.get('enabled') and (limit or offset):
+            cache_key = self._make_cache_key(table, filters, fields, None, None)
+            full = self.cache.get(query_namespace(table), cache_key, QUERY_FIELD)
+            if full is None:
+                return None, cache_key, True
+            if full != OVERSIZED:
+                self.paged_queries += 1
+                return page_of(full, limit, offset), cache_key, True
+        cache_key = self._make_cache_key(table, filters, fields, limit, offset)
+        result = self.cache.get(query_namespace(table), cache_key, QUERY_FIELD) if cache_result else None
+        if isinstance(result, ColumnarResult):
+            result = result.rows()
+        elif result == OVERSIZED:
+            result = None
+        return result, cache_key, False
+
+    def _store(self, table, cache_key, filters, result, version, ttl):
+        # 依赖多保留 1 秒，覆盖结果写入缓存前的时间差
+        expire_at = time.time() + ttl + 1 if ttl else None
+        if self.dependencies.register(table, cache_key, filters, version, expire_at):
+            self.cache.set(query_namespace(table), cache_key, QUERY_FIELD, result, ttl)
+            if self.dependencies.version(table) != version:
+                # 登记与写入缓存之间有写入失效了该表的查询，登记可能已被取出，结果不能保留
+                self.dependencies.discard(table, cache_key)
+                self.cache.invalidate(query_namespace(table), cache_key)
+
+    def _paging_max_rows(self):
+        return self.config.get_query_paging_config().get('max_rows', 100000)
+
+    def _store_full(self, table, cache_key, filters, fields, rows, version, ttl):
+        """
+        缓存完整结果（rows 按 max_rows + 1 行取回）：未超过 max_rows / max_bytes 时按列存储并返回 ColumnarResult，
+        否则缓存 OVERSIZED 标记并返回 None。标记与结果一样登记依赖、按 ttl 过期。
+        """
+        paging = self.config.get_query_paging_config()
+        full = ColumnarResult(rows, len(fields)) if len(rows) <= paging.get('max_rows', 100000) else None
+        if full is None or full.nbytes > paging.get('max_bytes', 64 * 1024 * 1024):
+            self._store(table, cache_key, filters, OVERSIZED, version, ttl)
+            return None
+        self._store(table, cache_key, filters, full, version, ttl)
+        return full
+
+    def _page_of_fetched(self, full, rows, limit, offset, max_rows):
+        """
+        从刚取回的完整结果中切出请求的页；结果被 max_rows 截断且该页超出已取回的行时返回 None，需按页查询。
+        """
+        if full is not None:
+            return full.rows(offset, limit)
+        start = offset or 0
+        stop = start + limit if limit else None
+        if len(rows) <= max_rows or (stop is not None and stop <= len(rows)):
+            return rows[start:stop]
+        return None
+
+    def _local_query(self, table, filters, fields, limit, offset):
+        """
+        在缓存上执行查询；表未常驻（无源模式除外）时返回 None。
+        """
+        cache_conf = self._get_cache_conf(table)
+        if not cache_conf:
+            return None
+        return self.cache.select(table, cache_conf['key_field'], filters, fields, limit, offset,
+                                 require_resident=not self.no_db_mode)
+
     def invalidate_query_cache(self, table):
-        # 失效所有结构化查询缓存
-        self.cache.invalidate(table)
+        # 失效该表所有结构化查询缓存（不影响行级缓存）
+        self.dependencies.clear(table)
+        self.cache.invalidate(query_namespace(table))
+
+    def invalidate_for_write(self, table, key=None, values=None):
+        """
+        行写入后失效可能包含该行的查询结果，返回失效的查询数。
+        key 为被写入行的主键；values 为该行的列取值 {column: value 或候选值列表}，
+        更新时若过滤列的值发生变化，需同时给出新旧值，否则只传 key。
+        """
+        if getattr(self.cache, 'shared', False):
+            # 共享内存后端中的查询结果可能由其他进程缓存，本进程的依赖索引不完整，只能整表失效
+            self.invalidate_query_cache(table)
+            return 0
+        row_values = dict(values or {})
+        cache_conf = self._get_cache_conf(table)
+        if key is not None and cache_conf:
+            row_values[cache_conf['key_field']] = key
+        elif key is not None and not row_values:
+            row_values = None
+        affected = self.dependencies.pop_affected(table, row_values)
+        if affected:
+            self.cache.invalidate_many(query_namespace(table), affected)
+        return len(affected)
+
+    def on_write(self, table, key=None, values=None, op=None):
+        """
+        CacheConsistency 写入监听：insert 的列值即完整取值，可用于精确匹配；
+        其他写入只知道新值，仅按主键约束。
+        """
+        if key is None and values is None:
+            self.invalidate_query_cache(table)
+        else:
+            self.invalidate_for_write(table, key, values if op == 'insert' else None)
+
+    def _get_cache_conf(self, table):
+        return self.config.get_table_config(table)
 
     def _make_cache_key(self, table, filters, fields, limit, offset):
         key_obj = {
@@ -50,6 +329,15 @@ class StructuredQuery:
         key_str = json.dumps(key_obj, sort_keys=True)
         return hashlib.md5(key_str.encode('utf-8')).hexdigest()
 
+    def _build_sql(self, table, filters, fields, limit, offset):
+        where, params = self._build_where(filters)
+        sql = f"SELECT {', '.join(fields)} FROM {table} {where}"
+        if limit:
+            sql += f" LIMIT {limit}"
+        if offset:
+            sql += f" OFFSET {offset}"
+        return sql, params
+
     def _build_where(self, filters):
         if not filters:
             return '', ()
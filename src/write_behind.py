@@ -0,0 +1,251 @@
+import logging
+import threading
+import time
+
+def check_fields(cache_conf, table, values):
+    """
+    校验写入的表与字段均已在 cache.yaml 中配置（字段名会拼入 SQL），返回表配置。
+    """
+    if cache_conf is None:
+        raise ValueError(f'未配置的表: {table}')
+    unknown = [field for field in values if field not in cache_conf['fields']]
+    if unknown:
+        raise ValueError(f'表 {table} 未配置的字段: {unknown}')
+    return cache_conf
+
+def _group_by_fields(rows):
+    # {key: {field: value}} 按字段组合分组为 {fields: [(v1, ..., key), ...]}
+    groups = {}
+    for key, values in rows.items():
+        fields = tuple(sorted(values))
+        groups.setdefault(fields, []).append(tuple(values[field] for field in fields) + (key,))
+    return groups
+
+def update_statements(table, key_field, rows):
+    """
+    把 {key: {field: value}} 按字段组合分组，生成 [(sql, [params, ...])]，
+    每组一条 UPDATE table SET f1 = %s, ... WHERE key = %s，由 execute 逐行执行（write_through 使用）。
+    """
+    return [
+        (f"UPDATE {table} SET {', '.join(f'{field} = %s' for field in fields)} WHERE {key_field} = %s", params)
+        for fields, params in _group_by_fields(rows).items()
+    ]
+
+def update_values_statements(table, key_field, rows):
+    """
+    把 {key: {field: value}} 按字段组合分组，生成 [(sql, [params, ...])]，每组一条
+    UPDATE table SET f1 = v.f1, ... FROM (VALUES %s) AS v(f1, ..., key) WHERE table.key = v.key RETURNING table.key，
+    由 execute_values 批量执行，一次往返即可得到实际更新到的主键。
+    VALUES 首行为取自表行类型的 NULL，使各列按目标列类型解析（整列为 None 时不会被推断为 text）。
+    """
+    statements = []
+    for fields, params in _group_by_fields(rows).items():
+        columns = fields + (key_field,)
+        typed = ', '.join(f'(NULL::{table}).{column}' for column in columns)
+        statements.append((
+            f"UPDATE {table} SET {', '.join(f'{field} = v.{field}' for field in fields)} "
+            f"FROM (VALUES ({typed}), %s) AS v({', '.join(columns)}) "
+            f"WHERE {table}.{key_field} = v.{key_field} RETURNING {table}.{key_field}", params))
+    return statements
+
+class WriteBehindBuffer:
+    """
+    写回缓冲：按表缓冲写入，同一 (key, field) 的多次更新只保留最后一次，
+    单表缓冲达到 max_batch 条或距上次刷写超过 flush_interval 秒时由后台线程批量写入数据库。
+    未写入（含写入中与写入失败）的条目达到 max_pending 时写入方阻塞等待（背压），合并到已缓冲字段的写入不阻塞。
+    写库失败按 retry_backoff 指数退避重试 max_retries 次，仍失败的批次移入 failed 且继续占用容量，
+    可调用 retry_failed 重新入队；close 返回仍未写入的失败批次。
+    每次写入的 (table, key, field) 分配递增序号，重试时已被更新写入（缓冲中或已写入数据库）取代的失败值直接丢弃。
+    数据库中已不存在的行 UPDATE 不到任何记录，这些主键计入 missed 并交给 on_missing(table, keys) 处理（如失效缓存）。
+    刷写串行执行，保证同一字段的写入顺序。
+    """
+    def __init__(self, db_client, get_cache_conf, max_batch=500, flush_interval=0.05, max_pending=10000,
+                 max_retries=3, retry_backoff=0.1, on_missing=None):
+        self.db = db_client
+        self.get_cache_conf = get_cache_conf
+        self.on_missing = on_missing
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.lock = threading.Lock()
+        self.not_full = threading.Condition(self.lock)
+        self.flush_lock = threading.Lock()
+        self.buffers = {}    # {table: {key: {field: value}}}
+        self.buffered = 0    # 缓冲中的 (key, field) 数
+        self.pending = 0     # 缓冲中 + 写入中 + 写入失败的 (key, field) 数
+        self.failed = []     # [(table, rows, error, seqs)]，计入 pending
+        self.seq = 0
+        self.latest = {}     # {(table, key, field): 最后一次写入的序号}，仅保留未成功写入数据库的条目
+        self.writes = 0
+        self.merged = 0
+        self.flushed = 0
+        self.batches = 0
+        self.retries = 0
+        self.failures = 0
+        self.missed = 0
+        self.blocked = 0
+        self.last_error = None
+        self.logger = logging.getLogger('pg-cache')
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='pg-cache-write-behind', daemon=True)
+        self._thread.start()
+
+    def add(self, table, key, values, timeout=None):
+        """
+        缓冲一次写入 values={field: value}，字段须为 cache.yaml 中配置的 fields，否则抛出 ValueError。
+        写入新增条目且缓冲已满时最多等待 timeout 秒（None 为一直等待），超时抛出 TimeoutError。
+        """
+        check_fields(self.get_cache_conf(table), table, values)
+        with self.not_full:
+            row = self.buffers.get(table, {}).get(key, {})
+            if self.pending >= self.max_pending and any(field not in row for field in values):
+                self.blocked += 1
+                self._wakeup.set()
+                if not self.not_full.wait_for(lambda: self.pending < self.max_pending, timeout):
+                    raise TimeoutError(f'写回缓冲已满: {self.pending} 条待写入')
+            row = self.buffers.setdefault(table, {}).setdefault(key, {})
+            for field, value in values.items():
+                if field in row:
+                    self.merged += 1
+                else:
+                    self.buffered += 1
+                    self.pending += 1
+                row[field] = value
+                self.seq += 1
+                self.latest[(table, key, field)] = self.seq
+            self.writes += len(values)
+            if len(self.buffers[table]) >= self.max_batch:
+                self._wakeup.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                self.logger.error('写回刷写异常: %s', e)
+
+    def flush(self):
+        """
+        立即把全部缓冲写入数据库，返回写入的 (key, field) 数。
+        """
+        with self.flush_lock:
+            with self.lock:
+                buffers, self.buffers = self.buffers, {}
+                self.buffered = 0
+                # 缓冲中的值总是该字段最后一次写入，记下其序号
+                seqs = {table: {(key, field): self.latest[(table, key, field)]
+                                for key, values in rows.items() for field in values}
+                        for table, rows in buffers.items()}
+            written = 0
+            for table, rows in buffers.items():
+                written += self._write_table(table, rows, seqs[table])
+            return written
+
+    def _write_table(self, table, rows, seqs):
+        count = sum(len(values) for values in rows.values())
+        cache_conf = self.get_cache_conf(table)
+        error = None
+        missing = []
+        if cache_conf is None:
+            error = ValueError(f'未配置的表: {table}')
+        else:
+            key_field = cache_conf['key_field']
+            statements = update_values_statements(table, key_field, rows)
+            for attempt in range(self.max_retries + 1):
+                if attempt:
+                    with self.lock:
+                        self.retries += 1
+                    time.sleep(self.retry_backoff * (2 ** (attempt - 1)))
+                try:
+                    matched = set()
+                    for sql, params in statements:
+                        matched.update(row[0] for row in self.db.execute_values(sql, params))
+                    missing = [key for key in rows if key not in matched]
+                    error = None
+                    break
+                except Exception as e:
+                    error = e
+        with self.not_full:
+            if error is None:
+                self.pending -= count
+                self.not_full.notify_all()
+                self.flushed += count
+                self.batches += 1
+                self.missed += len(missing)
+                for (key, field), seq in seqs.items():
+                    if self.latest.get((table, key, field)) == seq:
+                        del self.latest[(table, key, field)]
+            else:
+                # 失败的条目继续占用容量，数据库不可用时写入方被背压阻塞
+                self.failures += 1
+                self.last_error = repr(error)
+                self.failed.append((table, rows, error, seqs))
+        if error is not None:
+            self.logger.error('写回 %s 失败（%d 条）: %s', table, count, error)
+            return 0
+        if missing:
+            self.logger.warning('写回 %s 时 %d 行已不存在: %s', table, len(missing), missing[:10])
+            if self.on_missing is not None:
+                self.on_missing(table, missing)
+        return count
+
+    def retry_failed(self):
+        """
+        把失败批次重新放回缓冲，返回重新入队的条目数。
+        失败后又有更新写入的字段（无论新值仍在缓冲中还是已写入数据库）保留新值，旧值不再写入。
+        """
+        requeued = 0
+        with self.not_full:
+            failed, self.failed = self.failed, []
+            for table, rows, _, seqs in failed:
+                for key, values in rows.items():
+                    for field, value in values.items():
+                        if self.latest.get((table, key, field)) != seqs[(key, field)]:
+                            # 已被更新的写入取代，旧值不再占用容量
+                            self.pending -= 1
+                            continue
+                        self.buffers.setdefault(table, {}).setdefault(key, {})[field] = value
+                        self.buffered += 1
+                        requeued += 1
+            self.not_full.notify_all()
+        self._wakeup.set()
+        return requeued
+
+    def close(self, timeout=None):
+        """
+        停止后台线程并刷写剩余缓冲，返回仍未写入的失败批次 [(table, {key: {field: value}}, error)]。
+        """
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        self.flush()
+        with self.lock:
+            return [(table, rows, error) for table, rows, error, _ in self.failed]
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                'buffered': self.buffered,
+                'pending': self.pending,
+                'writes': self.writes,
+                'merged': self.merged,
+                'flushed': self.flushed,
+                'batches': self.batches,
+                'retries': self.retries,
+                'failures': self.failures,
+                'missed': self.missed,
+                'failed_batches': len(self.failed),
+                'blocked': self.blocked,
+                'last_error': self.last_error
+            }
@@ -0,0 +1,145 @@
+import asyncio
+import os
+import re
+import tempfile
+import threading
+import time
+import yaml
+from src.config_loader import ConfigLoader
+
+def make_config(tables, no_db_mode=True, **extra):
+    # 生成临时配置目录，便于按用例定制 cache.yaml；目录随返回的 ConfigLoader 一起回收（进程退出时兜底删除）
+    tmp = tempfile.TemporaryDirectory(prefix='pg-cache-test-')
+    with open(os.path.join(tmp.name, 'db.yaml'), 'w', encoding='utf-8') as f:
+        yaml.safe_dump({'postgres': {}}, f)
+    with open(os.path.join(tmp.name, 'cache.yaml'), 'w', encoding='utf-8') as f:
+        yaml.safe_dump(dict(no_db_mode=no_db_mode, cache=tables, **extra), f)
+    config = ConfigLoader(tmp.name)
+    config.tmp_dir = tmp
+    return config
+
+def temp_path(test, filename):
+    # 用例内使用的临时文件路径，所在目录在用例结束时删除
+    tmp = tempfile.TemporaryDirectory(prefix='pg-cache-test-')
+    test.addCleanup(tmp.cleanup)
+    return os.path.join(tmp.name, filename)
+
+def update_table(config, index=0, **changes):
+    # 修改 cache.yaml 中第 index 张表的配置并热加载（编译后的配置快照不受原字典修改影响）
+    path = os.path.join(config.config_dir, 'cache.yaml')
+    with open(path, encoding='utf-8') as f:
+        data = yaml.safe_load(f)
+    data['cache'][index].update(changes)
+    with open(path, 'w', encoding='utf-8') as f:
+        yaml.safe_dump(data, f)
+    return config.reload()
+
+class FakeDB:
+    """
+    内存版 PostgresClient，解析 CacheSync 生成的简单 SQL，记录调用次数，可注入延迟。
+    tables: {table: {key: {column: value}}}，主键列名为 key_field
+    """
+    def __init__(self, tables, key_field='id', latency=0, maxconn=4):
+        self.tables = tables
+        self.maxconn = maxconn
+        self.key_field = key_field
+        self.latency = latency
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def _record(self, sql, params):
+        with self.lock:
+            self.calls.append((sql, params))
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _select(self, sql, params):
+        m = re.match(r'SELECT (.+?) FROM (\w+)\s*(?:WHERE (.+?))?(?: ORDER BY (\w+))?'
+                     r'(?: LIMIT (%s|\d+))?(?: OFFSET (\d+))?$', sql.strip())
+        columns = [c.strip() for c in m.group(1).split(',')]
+        rows = list(self.tables.get(m.group(2), {}).items())
+        params = list(params or ())
+        for cond in (m.group(3).split(' AND ') if m.group(3) else []):
+            column, op, placeholder = re.match(r'(\w+) (=|>=|<=|>|<|IN) (%s|ANY\(%s\)|\(.*\))', cond).groups()
+            if op == 'IN':
+                count = placeholder.count('%s')
+                value, params = params[:count], params[count:]
+            else:
+                value = params.pop(0)
+            test = {
+                '=': (lambda v, p: v in p) if 'ANY' in cond else (lambda v, p: v == p),
+                'IN': lambda v, p: v in p,
+                '>': lambda v, p: v > p, '>=': lambda v, p: v >= p,
+                '<': lambda v, p: v < p, '<=': lambda v, p: v <= p,
+            }[op]
+            rows = [(k, r) for k, r in rows if test(self._value(k, r, column), value)]
+        if m.group(4):
+            rows.sort(key=lambda item: self._value(item[0], item[1], m.group(4)))
+        offset = int(m.group(6) or 0)
+        limit = params.pop(0) if m.group(5) == '%s' else (int(m.group(5)) if m.group(5) else None)
+        rows = rows[offset:offset + limit if limit is not None else None]
+        return [tuple(self._value(k, r, c) for c in columns) for k, r in rows]
+
+    def _value(self, key, row, column):
+        return key if column == self.key_field else row.get(column)
+
+    def query(self, sql, params=None):
+        self._record(sql, params)
+        return self._select(sql, params)
+
+    def query_one(self, sql, params=None):
+        self._record(sql, params)
+        m = re.match(r'SELECT min\((\w+)\), max\((\w+)\) FROM (\w+)$', sql.strip())
+        if m:
+            keys = [self._value(k, r, m.group(1)) for k, r in self.tables.get(m.group(3), {}).items()]
+            return (min(keys), max(keys)) if keys else (None, None)
+        rows = self._select(sql, params)
+        return rows[0] if rows else None
+
+    def execute(self, sql, params=None):
+        # 与 PostgresClient.execute 相同，返回更新的行数
+        self._record(sql, params)
+        return len(self._update(sql, [params]))
+
+    def execute_many(self, sql, params_list):
+        # 与 PostgresClient.execute_many 相同，不返回行数
+        self._record(sql, params_list)
+        self._update(sql, params_list)
+
+    def execute_values(self, sql, params_list):
+        # 与 PostgresClient.execute_values 相同，返回 RETURNING 的主键行
+        self._record(sql, params_list)
+        return [(key,) for key in self._update(sql, params_list)]
+
+    def _update(self, sql, params_list):
+        # 仅支持 UPDATE table SET a = %s, ... WHERE key = %s 与 UPDATE table SET a = v.a, ... FROM (VALUES %s) ...，
+        # 参数为 (a, ..., key)，返回更新到的主键
+        m = re.match(r'UPDATE (\w+) SET (.+?) (?:FROM .+ )?WHERE ', sql.strip())
+        fields = [assignment.split(' = ')[0] for assignment in m.group(2).split(', ')]
+        updated = []
+        with self.lock:
+            rows = self.tables.setdefault(m.group(1), {})
+            for params in params_list:
+                if params[-1] in rows:
+                    rows[params[-1]].update(zip(fields, params[:-1]))
+                    updated.append(params[-1])
+        return updated
+
+class AsyncFakeDB(FakeDB):
+    """
+    FakeDB 的 asyncio 版本，延迟通过 asyncio.sleep 模拟，不阻塞事件循环。
+    """
+    async def query(self, sql, params=None):
+        await self._wait(sql, params)
+        return self._select(sql, params)
+
+    async def query_one(self, sql, params=None):
+        await self._wait(sql, params)
+        rows = self._select(sql, params)
+        return rows[0] if rows else None
+
+    async def _wait(self, sql, params):
+        with self.lock:
+            self.calls.append((sql, params))
+        if self.latency:
+            await asyncio.sleep(self.latency)
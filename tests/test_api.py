@@ -1,6 +1,8 @@
 import unittest
 from src.api import PgCacheAPI
 from src.config_loader import ConfigLoader
+from src.structured_query import QUERY_FIELD, query_namespace
+from helpers import make_config
 
 class TestPgCacheAPI(unittest.TestCase):
     def setUp(self):
@@ -9,12 +11,48 @@ class TestPgCacheAPI(unittest.TestCase):
         self.api.cache.clear()
         self.no_db_mode = self.api.is_no_db_mode()
 
+    def tearDown(self):
+        self.api.close()
+
     def test_set_get_invalidate(self):
         self.api.set('user', 1, 'name', 'Alice')
         self.assertEqual(self.api.get('user', 1, 'name'), 'Alice')
         self.api.invalidate('user', 1, 'name')
         self.assertIsNone(self.api.get('user', 1, 'name'))
 
+    def test_invalidate_drops_query_results(self):
+        api = PgCacheAPI(make_config([{'table': 'user', 'key_field': 'id', 'fields': ['name']}]))
+        self.addCleanup(api.close)
+        sq = api.structured_query
+
+        def cache_query(cache_key, filters):
+            sq._store('user', cache_key, filters, [(1,)], sq.dependencies.version('user'), None)
+            return lambda: api.cache.get(query_namespace('user'), cache_key, QUERY_FIELD)
+
+        by_key = cache_query('by_key', {'id': 1})
+        other_key = cache_query('other_key', {'id': 2})
+        api.invalidate('user', 1)
+        self.assertIsNone(by_key())
+        self.assertEqual(other_key(), [(1,)])
+        api.invalidate('user')
+        self.assertIsNone(other_key())
+        # 批量失效同样清除包含这些行的查询
+        by_key = cache_query('by_key', {'id': 1})
+        other_key = cache_query('other_key', {'id': 2})
+        third_key = cache_query('third_key', {'id': 3})
+        api.invalidate_many('user', [1, 2])
+        self.assertIsNone(by_key())
+        self.assertIsNone(other_key())
+        self.assertEqual(third_key(), [(1,)])
+
+    def test_batch_operations(self):
+        self.api.set_many('user', [(1, 'name', 'Alice'), (2, 'name', 'Bob')])
+        self.assertEqual(self.api.get_many('user', [(1, 'name'), (2, 'name'), (3, 'name')]),
+                         {(1, 'name'): 'Alice', (2, 'name'): 'Bob'})
+        self.assertEqual(self.api.get_row('user', 1, ['name']), {'name': 'Alice'})
+        self.api.invalidate_many('user', [1, 2])
+        self.assertEqual(self.api.get_many('user', [(1, 'name'), (2, 'name')]), {})
+
     def test_query(self):
         # 结构化查询在无源模式下应返回空列表
         if self.no_db_mode:
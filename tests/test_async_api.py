@@ -0,0 +1,81 @@
+import asyncio
+import time
+import unittest
+from src.async_api import AsyncPgCacheAPI
+from src.async_db_client import to_native_sql
+from helpers import AsyncFakeDB, make_config, update_table
+
+class TestAsyncPgCacheAPI(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.config = make_config([{'table': 'user', 'key_field': 'id', 'fields': ['name', 'status'],
+                                    'negative_ttl': 30, 'indexes': ['status']}], no_db_mode=False)
+        self.db = AsyncFakeDB({'user': {i: {'name': f'u{i}', 'status': i % 3} for i in range(10)}}, latency=0.01)
+        self.api = AsyncPgCacheAPI(self.config, db_client=self.db)
+
+    async def asyncTearDown(self):
+        await self.api.close()
+
+    async def test_get_with_fallback_coalesces_misses(self):
+        results = await asyncio.gather(*[self.api.get_with_fallback('user', 1, 'name') for _ in range(20)])
+        self.assertEqual(results, ['u1'] * 20)
+        self.assertEqual(len(self.db.calls), 1)
+        self.assertEqual(self.api.get_stats()['coalesced_waits'], 19)
+        # 命中不访问数据库
+        self.assertEqual(await self.api.get_with_fallback('user', 1, 'name'), 'u1')
+        self.assertEqual(len(self.db.calls), 1)
+
+    async def test_cancelled_leader_does_not_cancel_waiters(self):
+        leader = asyncio.create_task(self.api.get_with_fallback('user', 2, 'name'))
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(self.api.get_with_fallback('user', 2, 'name'))
+        await asyncio.sleep(0)
+        leader.cancel()
+        self.assertEqual(await waiter, 'u2')
+        with self.assertRaises(asyncio.CancelledError):
+            await leader
+        self.assertEqual(len(self.db.calls), 1)
+        self.assertEqual(self.api.cache.get('user', 2, 'name'), 'u2')
+
+    async def test_negative_lookup(self):
+        self.assertIsNone(await self.api.get_with_fallback('user', 99, 'name'))
+        self.assertIsNone(await self.api.get_with_fallback('user', 99, 'name'))
+        self.assertEqual(len(self.db.calls), 1)
+        self.assertEqual(self.api.get_stats()['negative_hits'], 1)
+
+    async def test_concurrent_pages_share_one_full_query(self):
+        config = make_config([{'table': 'user', 'key_field': 'id', 'fields': ['name']}], no_db_mode=False,
+                             query_paging={'enabled': True})
+        api = AsyncPgCacheAPI(config, db_client=self.db)
+        self.addAsyncCleanup(api.close)
+        pages = await asyncio.gather(*[api.query('user', {}, ['id'], limit=2, offset=i * 2) for i in range(5)])
+        self.assertEqual(pages, [[(i * 2,), (i * 2 + 1,)] for i in range(5)])
+        self.assertEqual(len(self.db.calls), 1)
+
+    async def test_query_and_batch_sync(self):
+        rows = await asyncio.gather(*[self.api.query('user', {'status': 1}, ['id', 'name']) for _ in range(5)])
+        self.assertEqual(rows[0], [(1, 'u1'), (4, 'u4'), (7, 'u7')])
+        self.assertEqual(len(self.db.calls), 1)
+        self.assertEqual(await self.api.batch_sync('user'), 10)
+        self.assertTrue(self.api.cache.is_resident('user'))
+        calls = len(self.db.calls)
+        self.assertEqual(await self.api.query('user', {'status': 2}, ['id'], limit=2), [(2,), (5,)])
+        self.assertEqual(len(self.db.calls), calls)
+
+    async def test_stale_value_refreshed_in_background(self):
+        update_table(self.config, ttl=0.1, stale_grace=5)
+        api = AsyncPgCacheAPI(self.config, db_client=self.db)
+        self.assertEqual(await api.get_with_fallback('user', 3, 'name'), 'u3')
+        time.sleep(0.15)
+        self.db.tables['user'][3]['name'] = 'new'
+        self.assertEqual(await api.get_with_fallback('user', 3, 'name'), 'u3')
+        await api.close()
+        self.assertEqual(await api.get_with_fallback('user', 3, 'name'), 'new')
+        self.assertEqual(api.get_stats()['refresh']['user']['stale_serves'], 1)
+        self.assertEqual(len(self.db.calls), 2)
+
+    def test_native_placeholders(self):
+        self.assertEqual(to_native_sql('SELECT a FROM t WHERE a = %s AND b IN (%s,%s)'),
+                         'SELECT a FROM t WHERE a = $1 AND b IN ($2,$3)')
+
+if __name__ == '__main__':
+    unittest.main()
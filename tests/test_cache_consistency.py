@@ -0,0 +1,138 @@
+import time
+import unittest
+from src.cache_manager import CacheManager
+from src.cache_consistency import CacheConsistency
+from src.write_behind import WriteBehindBuffer
+from helpers import FakeDB, make_config
+
+class TestWriteModes(unittest.TestCase):
+    def setUp(self):
+        self.tables = [{'table': 'user', 'key_field': 'id', 'fields': ['name', 'age'], 'ttl': 600}]
+        self.db = FakeDB({'user': {i: {'name': f'u{i}', 'age': i} for i in range(5)}})
+
+    def make(self, **write):
+        config = make_config(self.tables, no_db_mode=False, write=write)
+        self.cache = CacheManager(config)
+        self.consistency = CacheConsistency(self.cache, config_loader=config, db_client=self.db)
+        self.addCleanup(self.consistency.close)
+        return self.consistency
+
+    def test_write_through_updates_database_first(self):
+        cc = self.make(mode='write_through')
+        cc.update_and_sync('user', 1, 'name', 'x')
+        self.assertEqual(self.db.tables['user'][1]['name'], 'x')
+        self.assertEqual(self.cache.get('user', 1, 'name'), 'x')
+        # 数据库中不存在的行不写入缓存
+        self.cache.set('user', 404, 'name', 'stale')
+        self.assertFalse(cc.update_and_sync('user', 404, 'name', 'x'))
+        self.assertIsNone(self.cache.get('user', 404, 'name'))
+        with self.assertRaises(ValueError):
+            cc.update_and_sync('user', 1, 'name = name; --', 'x')
+        # 写库异常时失效已缓存的旧值并重新抛出
+        self.cache.set('user', 2, 'name', 'u2')
+        self.db.execute = lambda sql, params: 1 / 0
+        with self.assertRaises(ZeroDivisionError):
+            cc.update_and_sync('user', 2, 'name', 'y')
+        self.assertIsNone(self.cache.get('user', 2, 'name'))
+
+    def test_write_behind_merges_and_flushes_on_close(self):
+        cc = self.make(mode='write_behind', flush_interval=10)
+        with self.assertRaises(ValueError):
+            cc.update_and_sync('user', 1, 'email', 'a')
+        cc.update_and_sync('user', 1, 'name', 'a')
+        cc.update_and_sync('user', 1, 'name', 'b')
+        cc.update_row_and_sync('user', 2, {'name': 'c', 'age': 20})
+        self.assertEqual(self.cache.get('user', 1, 'name'), 'b')
+        self.assertEqual(self.db.tables['user'][1]['name'], 'u1')
+        self.assertEqual(cc.close(), [])
+        self.assertEqual(self.db.tables['user'][1], {'name': 'b', 'age': 1})
+        self.assertEqual(self.db.tables['user'][2], {'name': 'c', 'age': 20})
+        self.assertEqual(len(self.db.calls), 2)  # 按字段组合分为两条批量 UPDATE
+        stats = cc.get_write_stats()
+        self.assertEqual((stats['writes'], stats['merged'], stats['flushed'], stats['pending']), (4, 1, 3, 0))
+
+    def test_write_behind_flushes_when_batch_is_full(self):
+        cc = self.make(mode='write_behind', flush_interval=10, max_batch=2)
+        cc.update_and_sync('user', 1, 'age', 10)
+        cc.update_and_sync('user', 2, 'age', 20)
+        deadline = time.time() + 2
+        while self.db.tables['user'][2]['age'] != 20 and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(self.db.tables['user'][1]['age'], 10)
+        self.assertEqual(self.db.tables['user'][2]['age'], 20)
+
+    def test_write_behind_invalidates_missing_rows(self):
+        cc = self.make(mode='write_behind', flush_interval=10)
+        cc.update_and_sync('user', 1, 'name', 'a')
+        cc.update_and_sync('user', 404, 'name', 'b')
+        self.assertEqual(self.cache.get('user', 404, 'name'), 'b')
+        self.assertEqual(cc.flush_writes(), 2)
+        self.assertEqual(self.db.tables['user'][1]['name'], 'a')
+        self.assertEqual(self.cache.get('user', 1, 'name'), 'a')
+        self.assertIsNone(self.cache.get('user', 404, 'name'))
+        self.assertEqual(cc.get_write_stats()['missed'], 1)
+        # 一条 UPDATE ... FROM (VALUES ...) RETURNING 即得到更新到的主键，不再额外查询
+        (sql, params), = self.db.calls
+        self.assertIn('FROM (VALUES ((NULL::user).name, (NULL::user).id), %s) AS v(name, id)', sql)
+        self.assertTrue(sql.endswith('RETURNING user.id'))
+        self.assertEqual(params, [('a', 1), ('b', 404)])
+
+    def test_failed_batch_is_retried_and_requeued(self):
+        cc = self.make(mode='write_behind', flush_interval=10, max_retries=2, retry_backoff=0.001)
+        execute_values = self.db.execute_values
+        self.db.execute_values = lambda sql, params: 1 / 0
+        cc.update_and_sync('user', 3, 'name', 'z')
+        self.assertEqual(cc.flush_writes(), 0)
+        stats = cc.get_write_stats()
+        self.assertEqual((stats['retries'], stats['failures'], stats['failed_batches']), (2, 1, 1))
+        self.assertIn('ZeroDivisionError', stats['last_error'])
+        self.db.execute_values = execute_values
+        cc.update_and_sync('user', 3, 'age', 30)
+        self.assertEqual(cc.write_behind.retry_failed(), 1)
+        self.assertEqual(cc.flush_writes(), 2)
+        self.assertEqual(self.db.tables['user'][3], {'name': 'z', 'age': 30})
+        self.assertEqual(cc.get_write_stats()['pending'], 0)
+
+    def test_retry_does_not_overwrite_newer_flushed_write(self):
+        cc = self.make(mode='write_behind', flush_interval=10, max_retries=0)
+        execute_values = self.db.execute_values
+        self.db.execute_values = lambda sql, params: 1 / 0
+        cc.update_and_sync('user', 1, 'name', 'v1')
+        self.assertEqual(cc.flush_writes(), 0)
+        self.db.execute_values = execute_values
+        cc.update_and_sync('user', 1, 'name', 'v2')
+        self.assertEqual(cc.flush_writes(), 1)
+        # v1 已被写入数据库的 v2 取代，重试时丢弃
+        self.assertEqual(cc.write_behind.retry_failed(), 0)
+        self.assertEqual(cc.flush_writes(), 0)
+        self.assertEqual(self.db.tables['user'][1]['name'], 'v2')
+        self.assertEqual(self.cache.get('user', 1, 'name'), 'v2')
+        stats = cc.get_write_stats()
+        self.assertEqual((stats['pending'], stats['failed_batches']), (0, 0))
+        self.assertEqual(cc.write_behind.latest, {})
+
+    def test_failed_rows_keep_backpressure_and_are_returned_on_close(self):
+        buffer = WriteBehindBuffer(self.db, lambda table: self.tables[0], max_pending=2, max_retries=0)
+        self.db.execute_values = lambda sql, params: 1 / 0
+        buffer.add('user', 1, {'name': 'a', 'age': 1})
+        buffer.flush()
+        self.assertEqual(buffer.get_stats()['pending'], 2)
+        with self.assertRaises(TimeoutError):
+            buffer.add('user', 2, {'name': 'b'}, timeout=0.01)
+        failed = buffer.close()
+        self.assertEqual([(table, rows) for table, rows, _ in failed], [('user', {1: {'name': 'a', 'age': 1}})])
+
+    def test_backpressure_blocks_writers(self):
+        buffer = WriteBehindBuffer(self.db, lambda table: self.tables[0], max_pending=1)
+        buffer.add('user', 1, {'name': 'a'})
+        buffer.add('user', 1, {'name': 'b'})  # 合并不占用额外容量
+        with self.assertRaises(TimeoutError):
+            buffer.add('user', 2, {'name': 'c'}, timeout=0.01)
+        self.assertEqual(buffer.get_stats()['blocked'], 1)
+        buffer.flush()
+        buffer.add('user', 2, {'name': 'c'}, timeout=0.01)
+        self.assertEqual(buffer.flush(), 1)
+        self.assertEqual(self.db.tables['user'][2]['name'], 'c')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,12 @@
+import os
+import threading
 import time
 import unittest
 from src.cache_manager import CacheManager
+from src.codec import EncodedValue
+from src.config_loader import ConfigWatcher
+from src.storage import ABSENT, query_namespace
+from helpers import make_config, temp_path, update_table
 
 class TestCacheManager(unittest.TestCase):
     def setUp(self):
@@ -48,5 +54,410 @@ class TestCacheManager(unittest.TestCase):
         for i in range(5):
             self.assertEqual(self.cache.get('product', i, 'price'), i * 10)
 
+class TestCacheSharding(unittest.TestCase):
+    def test_table_invalidate_across_shards(self):
+        cache = CacheManager(shards=8)
+        self.assertEqual(len(cache.shards), 8)
+        for i in range(200):
+            cache.set('user', i, 'name', i)
+            cache.set('order', i, 'amount', i)
+        self.assertEqual(cache.table_size('user'), 200)
+        cache.invalidate('user')
+        self.assertEqual(cache.table_size('user'), 0)
+        self.assertEqual(cache.table_size('order'), 200)
+
+    def test_concurrent_stats_are_summed(self):
+        cache = CacheManager(shards=4)
+        for i in range(100):
+            cache.set('user', i, 'name', i)
+
+        def worker():
+            for i in range(200):
+                cache.get('user', i, 'name')
+
+        threads = [threading.Thread(target=worker) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        stats = cache.get_stats()
+        self.assertEqual(stats['hits'], 400)
+        self.assertEqual(stats['misses'], 400)
+
+class TestActiveExpiry(unittest.TestCase):
+    def test_expire_step_reclaims_cold_entries(self):
+        cache = CacheManager(shards=4)
+        cache.set_many('user', [(i, 'name', i) for i in range(100)], ttl=1)
+        cache.set('user', 1000, 'name', 'forever')
+        cache.set('user', 0, 'name', 'refreshed', ttl=60)  # 覆盖后旧的到期记录应失效
+        time.sleep(2.1)
+        self.assertEqual(cache.get_stats()['expiry_backlog'], 100)
+        self.assertEqual(cache.expire_step(max_items=8), 99)
+        self.assertEqual(cache.table_size('user'), 2)
+        stats = cache.get_stats()
+        self.assertEqual(stats['expired'], 99)
+        self.assertEqual(stats['expiry_backlog'], 0)
+        self.assertEqual(cache.get('user', 0, 'name'), 'refreshed')
+
+    def test_background_reaper(self):
+        cache = CacheManager(shards=2)
+        reaper = cache.start_expiry(interval=0.05)
+        try:
+            cache.set_many('user', [(i, 'name', i) for i in range(10)], ttl=1)
+            time.sleep(2.3)
+            self.assertEqual(cache.table_size('user'), 0)
+            self.assertEqual(reaper.expired_total, 10)
+        finally:
+            cache.stop_expiry()
+        self.assertFalse(reaper.is_running())
+
+    def test_stale_grace_only_visible_through_lookup_expiry(self):
+        config = make_config([{'table': 'user', 'key_field': 'id', 'fields': ['name'], 'stale_grace': 1}])
+        cache = CacheManager(config, shards=2)
+        cache.set_many('user', [(1, 'name', 'a'), (2, 'name', 'b')], ttl=0.05)
+        time.sleep(0.1)
+        # 普通读取按逻辑过期时间未命中，宽限期内的条目不被删除
+        self.assertIsNone(cache.get('user', 1, 'name'))
+        self.assertEqual(cache.get_many('user', [(1, 'name'), (2, 'name')]), {})
+        self.assertEqual(cache.get_row('user', 2), {})
+        self.assertEqual(cache.select('user', 'id', {}, ['id'], require_resident=False), [])
+        self.assertEqual(cache.dump_cache(), {'user': {}})
+        value, expire_at = cache.lookup_expiry('user', 1, 'name')
+        self.assertEqual(value, 'a')
+        self.assertLess(expire_at, time.time())
+        self.assertEqual(cache.expire_step(), 0)
+        time.sleep(1.05)
+        self.assertEqual(cache.lookup_expiry('user', 1, 'name'), (ABSENT, None))
+        time.sleep(1)  # 过期桶按秒对齐
+        self.assertEqual(cache.expire_step(), 1)
+        self.assertEqual(cache.table_size('user'), 0)
+
+class TestCompactStorage(unittest.TestCase):
+    def setUp(self):
+        config = make_config([{'table': 'user', 'key_field': 'id', 'fields': ['name', 'age'],
+                               'ttl': 600, 'compact': True}])
+        self.cache = CacheManager(config, shards=2)
+
+    def test_field_semantics(self):
+        self.cache.set('user', 1, 'name', 'Alice')
+        self.cache.set('user', 1, 'age', 20)
+        self.cache.set('user', 1, '__struct_query__', [1])  # 未配置字段
+        self.assertEqual(self.cache.get('user', 1, 'name'), 'Alice')
+        self.assertEqual(self.cache.get('user', 1, '__struct_query__'), [1])
+        self.assertEqual(self.cache.get_row('user', 1), {'name': 'Alice', 'age': 20, '__struct_query__': [1]})
+        self.cache.invalidate('user', 1, 'name')
+        self.assertIsNone(self.cache.get('user', 1, 'name'))
+        self.assertEqual(self.cache.get('user', 1, 'age'), 20)
+        self.cache.invalidate('user', 1, 'age')
+        self.cache.invalidate('user', 1, '__struct_query__')
+        self.assertEqual(self.cache.table_size('user'), 0)
+
+    def test_divergent_ttl_per_field(self):
+        self.cache.set('user', 1, 'name', 'Alice', ttl=1)
+        self.cache.set('user', 1, 'age', 20, ttl=60)
+        time.sleep(1.1)
+        self.assertIsNone(self.cache.get('user', 1, 'name'))
+        self.assertEqual(self.cache.get('user', 1, 'age'), 20)
+
+    def test_shared_expiry_reaped_as_row(self):
+        self.cache.set_many('user', [(i, f, i) for i in range(20) for f in ('name', 'age')], ttl=1)
+        self.assertEqual(self.cache.get_stats()['expiry_scheduled'], 20)
+        time.sleep(2.1)
+        self.assertEqual(self.cache.expire_step(), 40)
+        self.assertEqual(self.cache.table_size('user'), 0)
+
+class TestCacheBatch(unittest.TestCase):
+    def setUp(self):
+        self.cache = CacheManager(shards=4)
+
+    def test_set_many_get_many(self):
+        self.cache.set_many('user', [(i, 'name', f'u{i}') for i in range(50)])
+        self.cache.set_many('user', {(i, 'age'): i for i in range(50)})
+        pairs = [(i, 'name') for i in range(60)] + [(i, 'age') for i in range(10)]
+        result = self.cache.get_many('user', pairs)
+        self.assertEqual(len(result), 60)
+        self.assertEqual(result[(3, 'name')], 'u3')
+        self.assertEqual(result[(9, 'age')], 9)
+        self.assertNotIn((55, 'name'), result)
+        stats = self.cache.get_stats()
+        self.assertEqual(stats['hits'], 60)
+        self.assertEqual(stats['misses'], 10)
+
+    def test_get_many_expired(self):
+        self.cache.set_many('user', [(1, 'name', 'a'), (2, 'name', 'b')], ttl=1)
+        time.sleep(1.1)
+        self.assertEqual(self.cache.get_many('user', [(1, 'name'), (2, 'name')]), {})
+        self.assertEqual(self.cache.table_size('user'), 0)
+
+    def test_duplicate_expired_pairs(self):
+        self.cache.set('user', 1, 'name', 'a', ttl=0.05)
+        time.sleep(0.1)
+        self.assertEqual(self.cache.get_many('user', [(1, 'name'), (1, 'name')]), {})
+        self.cache.set('user', 2, 'name', 'b', ttl=0.05)
+        time.sleep(0.1)
+        self.assertEqual(self.cache.get_row('user', 2, ['name', 'name']), {})
+        self.assertEqual(self.cache.table_size('user'), 0)
+
+    def test_get_row_and_invalidate_many(self):
+        self.cache.set('user', 1, 'name', 'Alice')
+        self.cache.set('user', 1, 'age', 20)
+        self.cache.set('user', 2, 'name', 'Bob')
+        self.assertEqual(self.cache.get_row('user', 1, ['name', 'age', 'email']), {'name': 'Alice', 'age': 20})
+        self.assertEqual(self.cache.get_row('user', 1), {'name': 'Alice', 'age': 20})
+        self.cache.invalidate_many('user', [1, 2], fields=['name'])
+        self.assertEqual(self.cache.get_row('user', 1), {'age': 20})
+        self.cache.invalidate_many('user', [1])
+        self.assertEqual(self.cache.table_size('user'), 0)
+
+class TestCacheEviction(unittest.TestCase):
+    def test_lru_max_entries(self):
+        config = make_config([{'table': 'user', 'key_field': 'id', 'fields': ['name'], 'max_entries': 3}])
+        cache = CacheManager(config, shards=1)
+        for i in range(3):
+            cache.set('user', i, 'name', f'u{i}')
+        cache.get('user', 0, 'name')  # 0 变为最近使用
+        cache.set('user', 3, 'name', 'u3')
+        self.assertIsNone(cache.get('user', 1, 'name'))
+        self.assertEqual(cache.get('user', 0, 'name'), 'u0')
+        stats = cache.get_stats()
+        self.assertEqual(stats['evictions'], 1)
+        self.assertEqual(stats['evictions_by_table'], {'user': 1})
+
+    def test_max_bytes(self):
+        config = make_config([{'table': 'doc', 'key_field': 'id', 'fields': ['body'], 'max_bytes': 2000}])
+        cache = CacheManager(config, shards=1)
+        for i in range(10):
+            cache.set('doc', i, 'body', 'x' * 500)
+        self.assertLessEqual(cache.table_size('doc'), 3)
+        self.assertEqual(cache.get('doc', 9, 'body'), 'x' * 500)
+
+    def test_limit_split_across_shards_does_not_overshoot(self):
+        config = make_config([{'table': 'user', 'key_field': 'id', 'fields': ['name'], 'max_entries': 10}])
+        cache = CacheManager(config, shards=16)
+        self.assertEqual(sum(shard.limits['user'][0] for shard in cache.shards), 10)
+        for i in range(1000):
+            cache.set('user', i, 'name', i)
+        self.assertLessEqual(cache.table_size('user'), 10)
+
+    def test_tinylfu_keeps_hot_keys_under_scan(self):
+        config = make_config([{'table': 'user', 'key_field': 'id', 'fields': ['name'],
+                               'max_entries': 100, 'eviction': 'tinylfu'}])
+        cache = CacheManager(config, shards=1)
+        for i in range(100):
+            cache.set('user', i, 'name', i)
+        for _ in range(5):
+            for i in range(50):
+                cache.get('user', i, 'name')
+        # 一次性扫描大量冷 key
+        for i in range(1000, 2000):
+            cache.set('user', i, 'name', i)
+        hot_left = sum(1 for i in range(50) if cache.get('user', i, 'name') is not None)
+        self.assertGreaterEqual(hot_left, 45)
+        self.assertLessEqual(cache.table_size('user'), 100)
+
+class TestConfigReload(unittest.TestCase):
+    def setUp(self):
+        self.config = make_config([{'table': 'user', 'key_field': 'id', 'fields': ['name', 'age'], 'ttl': 60},
+                                   {'table': 'order', 'key_field': 'id', 'fields': ['amount']}])
+        self.cache = CacheManager(self.config, shards=2)
+        self.config.add_reload_listener(self.cache.apply_config)
+
+    def test_compiled_lookup(self):
+        compiled = self.config.get_compiled()
+        self.assertEqual(self.config.get_table_config('user')['key_field'], 'id')
+        self.assertIsNone(self.config.get_table_config('missing'))
+        self.assertEqual(compiled.columns['user'], frozenset(['id', 'name', 'age']))
+        self.assertEqual(compiled.positions['user'], {'name': 0, 'age': 1})
+        self.assertEqual(update_table(self.config, ttl=30).version, compiled.version + 1)
+        self.assertEqual(compiled.ttls['user'], 60)  # 旧快照不变
+
+    def test_removed_fields_purged_and_ttl_shifted(self):
+        self.cache.set_many('user', [(i, f, i) for i in range(100) for f in ('name', 'age')], ttl=60)
+        self.cache.set('order', 1, 'amount', 10)
+        update_table(self.config, fields=['name'], ttl=10)
+        self.cache.reconciler.join()
+        self.assertIsNone(self.cache.get('user', 1, 'age'))
+        self.assertEqual(self.cache.get('user', 1, 'name'), 1)
+        _, expire_at = self.cache.lookup_expiry('user', 1, 'name')
+        self.assertAlmostEqual(expire_at, time.time() + 10, delta=1)
+        self.assertEqual(self.cache.get('order', 1, 'amount'), 10)
+
+    def test_compact_rows_keep_shared_expiry(self):
+        config = make_config([{'table': 'user', 'key_field': 'id', 'fields': ['name', 'age', 'city'],
+                               'ttl': 600, 'compact': True}])
+        cache = CacheManager(config, shards=1)
+        config.add_reload_listener(cache.apply_config)
+        cache.set_many('user', [(1, f, 'v') for f in ('name', 'age', 'city')], ttl=600)
+        scheduled = cache.get_stats()['expiry_scheduled']
+        update_table(config, ttl=1200)
+        cache.reconciler.join()
+        row = cache._shard('user', 1).tables['user'][1]
+        self.assertIsNone(row.expires)
+        self.assertAlmostEqual(row.expire_at, time.time() + 1200, delta=1)
+        self.assertEqual(cache.get_stats()['expiry_scheduled'], scheduled + 1)
+
+    def test_removed_table_invalidated(self):
+        self.cache.set('order', 1, 'amount', 10)
+        path = os.path.join(self.config.config_dir, 'cache.yaml')
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write('no_db_mode: true\ncache:\n  - {table: user, key_field: id, fields: [name, age], ttl: 60}\n')
+        self.assertIsNone(self.config.reload().table('order'))
+        self.assertIsNone(self.cache.reconciler)
+        self.assertEqual(self.cache.table_size('order'), 0)
+
+    def test_watcher_keeps_config_on_invalid_file(self):
+        watcher = ConfigWatcher(self.config)
+        self.assertFalse(watcher.check())
+        path = os.path.join(self.config.config_dir, 'cache.yaml')
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write('cache: [unclosed\n')
+        os.utime(path, ns=(0, 0))
+        self.assertFalse(watcher.check())
+        self.assertEqual(watcher.failures, 1)
+        self.assertIsNotNone(self.config.get_table_config('order'))
+
+class TestValueEncoding(unittest.TestCase):
+    def setUp(self):
+        config = make_config([{'table': 'doc', 'key_field': 'id', 'fields': ['title', 'body', 'tags'],
+                               'indexes': ['title'], 'encoding': {'compress_above': 256, 'decode_cache': 2}}])
+        self.cache = CacheManager(config, shards=2)
+
+    def test_values_stored_encoded_and_decoded_on_read(self):
+        body = 'lorem ipsum ' * 200
+        self.cache.set('doc', 1, 'title', 'a' * 100)
+        self.cache.set_many('doc', [(1, 'body', body), (1, 'tags', ['x'] * 50), (2, 'tags', [])])
+        row = self.cache._shard('doc', 1).tables['doc'][1]
+        self.assertEqual(row.peek('title'), 'a' * 100)  # 索引字段不编码
+        self.assertIsInstance(row.peek('body'), EncodedValue)
+        self.assertLess(len(row.peek('body')), len(body) // 10)
+        self.assertEqual(self.cache.get('doc', 1, 'body'), body)
+        self.assertEqual(self.cache.get_many('doc', [(1, 'tags'), (2, 'tags')]), {(1, 'tags'): ['x'] * 50, (2, 'tags'): []})
+        self.assertEqual(self.cache.get_row('doc', 1)['body'], body)
+        self.assertEqual(self.cache.lookup_expiry('doc', 1, 'body'), (body, None))
+        self.assertEqual(self.cache.dump_cache()['doc'][2], {'tags': []})
+        self.assertEqual(self.cache.select('doc', 'id', {'title': 'a' * 100}, ['id', 'tags'], require_resident=False),
+                         [(1, ['x'] * 50)])
+        self.assertIsNone(self.cache.select('doc', 'id', {'body': body}, ['id'], require_resident=False))
+        stats = self.cache.get_stats()['encoding']['doc']
+        self.assertEqual((stats['encoded'], stats['compressed']), (3, 1))
+        self.assertGreater(stats['bytes_saved'], 0)
+        self.assertGreaterEqual(stats['decode_cache_hits'], 1)
+
+    def test_query_results_and_snapshot(self):
+        rows = [(i, f'name-{i}') for i in range(100)]
+        self.cache.set(query_namespace('doc'), 'q', '__struct_query__', rows)
+        self.assertIsInstance(self.cache.lookup(query_namespace('doc'), 'q', '__struct_query__'), list)
+        self.assertEqual(self.cache.get(query_namespace('doc'), 'q', '__struct_query__'), rows)
+        self.cache.set('doc', 1, 'body', 'x' * 500)
+        path = temp_path(self, 'cache.snapshot')
+        self.cache.save_snapshot(path)
+        plain = CacheManager(make_config([]))
+        plain.load_snapshot(path)
+        self.assertEqual(plain._shard('doc', 1).tables['doc'][1].peek('body'), 'x' * 500)
+
+    def test_snapshot_restore_encodes_outside_shard_lock(self):
+        plain = CacheManager(make_config([]))
+        plain.set_many('doc', [(i, 'body', 'x' * 500) for i in range(20)])
+        path = temp_path(self, 'cache.snapshot')
+        plain.save_snapshot(path)
+        codec = self.cache.codecs['doc']
+        encode = codec.encode
+        locked = []
+        codec.encode = lambda value: locked.append(any(s.lock._is_owned() for s in self.cache.shards)) or encode(value)
+        self.cache.load_snapshot(path)
+        self.assertEqual(locked, [False] * 20)
+        self.assertIsInstance(self.cache._shard('doc', 3).tables['doc'][3].peek('body'), EncodedValue)
+
+    def test_json_keeps_types_of_values_it_cannot_round_trip(self):
+        cache = CacheManager(make_config([{'table': 'doc', 'key_field': 'id', 'fields': ['body', 'meta'],
+                                           'encoding': {'format': 'json', 'min_bytes': 0}}]))
+        values = {'body': ['x'] * 50, 'meta': {1: ('a', 'b')}}
+        cache.set_many('doc', [(1, field, value) for field, value in values.items()])
+        row = cache._shard('doc', 1).tables['doc'][1]
+        self.assertIsInstance(row.peek('body'), EncodedValue)
+        self.assertEqual(row.peek('meta'), {1: ('a', 'b')})  # 非 str 键、元组不编码
+        self.assertEqual(cache.get_row('doc', 1), values)
+        # 查询结果的行为元组，json 格式下不编码
+        self.assertNotIn(query_namespace('doc'), cache.codecs)
+        rows = [(i, f'name-{i}') for i in range(100)]
+        cache.set(query_namespace('doc'), 'q', '__struct_query__', rows)
+        self.assertEqual(cache.get(query_namespace('doc'), 'q', '__struct_query__'), rows)
+
+class TestEpochInvalidation(unittest.TestCase):
+    def setUp(self):
+        config = make_config([{'table': 'order', 'key_field': 'id', 'fields': ['amount'], 'indexes': ['amount'],
+                               'max_entries': 10000}], reclaim={'slice_items': 100, 'sweep_keys': 50})
+        self.cache = CacheManager(config, shards=4)
+        self.cache.set_many('order', [((user, i), 'amount', i) for user in range(10) for i in range(100)])
+
+    def test_table_invalidation_reclaimed_in_background(self):
+        self.cache.invalidate('order')
+        self.assertIsNone(self.cache.get('order', (1, 1), 'amount'))
+        self.assertEqual(self.cache.table_size('order'), 0)
+        self.cache.set('order', (1, 1), 'amount', 5)
+        self.assertTrue(self.cache.reclaimer.wait(5))
+        self.assertEqual(self.cache.get('order', (1, 1), 'amount'), 5)
+        self.assertGreaterEqual(self.cache.get_stats()['reclaimed'], 1000)
+        self.cache.clear()
+        self.assertEqual(self.cache.table_size('order'), 0)
+        self.assertTrue(self.cache.reclaimer.wait(5))
+
+    def test_prefix_invalidation(self):
+        self.cache.reclaimer.pause = 0.05  # 清扫放慢，验证清扫完成前的读写语义
+        self.cache.invalidate_prefix('order', 3)
+        self.assertIsNone(self.cache.get('order', (3, 1), 'amount'))
+        self.assertEqual(self.cache.get_many('order', [((3, 2), 'amount'), ((4, 2), 'amount')]),
+                         {((4, 2), 'amount'): 2})
+        self.assertEqual(self.cache.get_row('order', (3, 5)), {})
+        self.assertEqual(self.cache.select('order', 'id', {'amount': 7}, ['id'], require_resident=False),
+                         [((i, 7),) for i in range(10) if i != 3])
+        self.cache.set('order', (3, 1), 'amount', 42)
+        self.assertEqual(self.cache.get_row('order', (3, 1)), {'amount': 42})
+        self.assertNotIn((3, 2), self.cache.dump_cache()['order'])
+        self.assertTrue(self.cache.reclaimer.wait(10))
+        self.assertEqual(self.cache.table_size('order'), 901)
+        self.assertEqual(self.cache.get('order', (3, 1), 'amount'), 42)
+        self.assertEqual(self.cache.get('order', (4, 1), 'amount'), 1)
+        self.assertFalse(any(shard.sweeps for shard in self.cache.shards))
+
+class TestSnapshot(unittest.TestCase):
+    def setUp(self):
+        self.path = temp_path(self, 'cache.snapshot')
+
+    def test_roundtrip_keeps_types_and_ttl(self):
+        cache = CacheManager(make_config([]))
+        cache.set('user', 1, 'name', 'Alice')
+        cache.set('user', (2, 'a'), 'tags', ['x', 'y'], ttl=60)
+        cache.set('user', 3, 'name', 'short', ttl=0.05)
+        cache.set('__struct_query__:user', 'q', '__struct_query__', [(1,)])
+        stats = cache.save_snapshot(self.path, chunk_keys=1)
+        self.assertEqual(stats['keys'], 3)
+        time.sleep(0.06)
+        restored = CacheManager(make_config([]))
+        result = restored.load_snapshot(self.path)
+        self.assertEqual(result['entries'], 2)
+        self.assertEqual(result['blocks_skipped'], 1)
+        self.assertEqual(restored.get('user', 1, 'name'), 'Alice')
+        self.assertEqual(restored.get('user', (2, 'a'), 'tags'), ['x', 'y'])
+        self.assertIsNone(restored.get('user', 3, 'name'))
+        self.assertEqual(restored.table_size('__struct_query__:user'), 0)
+        # 过期时间按绝对时间恢复
+        expire_at = next(e for f, v, e in restored._shard('user', (2, 'a')).tables['user'][(2, 'a')].entries())
+        self.assertAlmostEqual(expire_at, time.time() + 60, delta=1)
+
+    def test_table_filter_and_invalid_file(self):
+        cache = CacheManager(make_config([]))
+        cache.set_many('user', [(i, 'name', f'u{i}') for i in range(100)])
+        cache.set('order', 1, 'amount', 10)
+        cache.save_snapshot(self.path)
+        restored = CacheManager(make_config([]))
+        restored.load_snapshot(self.path, tables=['order'])
+        self.assertEqual(restored.table_size('user'), 0)
+        self.assertEqual(restored.get('order', 1, 'amount'), 10)
+        with open(self.path, 'wb') as f:
+            f.write(b'not a snapshot' * 10)
+        with self.assertRaises(ValueError):
+            restored.load_snapshot(self.path)
+
 if __name__ == '__main__':
     unittest.main() 
\ No newline at end of file
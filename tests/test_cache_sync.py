@@ -0,0 +1,189 @@
+import threading
+import time
+import unittest
+from src.cache_manager import CacheManager
+from src.cache_sync import CacheSync
+from src.refresh import RefreshAhead
+from helpers import FakeDB, make_config, update_table
+
+class TestCacheSync(unittest.TestCase):
+    def setUp(self):
+        self.config = make_config([{'table': 'user', 'key_field': 'id', 'fields': ['name', 'age'],
+                                    'ttl': 600, 'negative_ttl': 30}], no_db_mode=False)
+        self.db = FakeDB({'user': {i: {'name': f'u{i}', 'age': i} for i in range(10)}})
+        self.cache = CacheManager(self.config)
+        self.sync = CacheSync(self.cache, db_client=self.db, config_loader=self.config)
+
+    def test_get_with_fallback(self):
+        self.assertEqual(self.sync.get_with_fallback('user', 1, 'name'), 'u1')
+        self.assertEqual(self.sync.get_with_fallback('user', 1, 'name'), 'u1')
+        self.assertEqual(len(self.db.calls), 1)
+
+    def test_negative_cache(self):
+        self.assertIsNone(self.sync.get_with_fallback('user', 404, 'name'))
+        self.assertIsNone(self.sync.get_with_fallback('user', 404, 'name'))
+        self.assertEqual(len(self.db.calls), 1)
+        self.assertEqual(self.sync.get_stats()['negative_hits'], 1)
+        # 负缓存对普通读取表现为未命中
+        self.assertIsNone(self.cache.get('user', 404, 'name'))
+        self.assertEqual(self.cache.get_many('user', [(404, 'name')]), {})
+
+    def test_concurrent_misses_are_coalesced(self):
+        self.db.latency = 0.2
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(self.sync.get_with_fallback('user', 2, 'age')))
+                   for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(results, [2] * 8)
+        self.assertEqual(len(self.db.calls), 1)
+        self.assertEqual(self.sync.get_stats()['coalesced_waits'], 7)
+
+    def test_load_many_fetches_missing_rows_in_chunks(self):
+        update_table(self.config, load_chunk_size=4)
+        self.cache.set('user', 0, 'name', 'cached')
+        self.cache.set('user', 0, 'age', 0)
+        result = self.sync.load_many('user', list(range(10)) + [404])
+        self.assertEqual(len(result), 10)
+        self.assertEqual(result[0], {'name': 'cached', 'age': 0})
+        self.assertEqual(result[5], {'name': 'u5', 'age': 5})
+        self.assertEqual(len(self.db.calls), 3)  # 10 个缺失 key，每块 4 个
+        self.assertEqual(self.cache.get('user', 7, 'age'), 7)
+        self.db.calls.clear()
+        self.assertEqual(len(self.sync.load_many('user', [3, 404])), 1)
+        self.assertEqual(self.db.calls, [])
+
+    def test_micro_batching_merges_concurrent_misses(self):
+        update_table(self.config, batch_window=0.05)
+        results = {}
+
+        def worker(key):
+            results[key] = self.sync.get_with_fallback('user', key, 'name')
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(6)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(results, {i: f'u{i}' for i in range(6)})
+        self.assertEqual(len(self.db.calls), 1)
+        self.assertEqual(self.sync.get_stats()['micro_batch_merged'], 5)
+
+    def test_refresh_ahead_refreshes_in_background(self):
+        update_table(self.config, ttl=0.3, refresh_ahead=0.25)
+        self.sync = CacheSync(self.cache, db_client=self.db, config_loader=self.config)
+        self.assertEqual(self.sync.get_with_fallback('user', 1, 'name'), 'u1')
+        time.sleep(0.1)
+        self.db.tables['user'][1]['name'] = 'new'
+        # 进入提前刷新窗口：立即返回当前值，后台回源
+        self.assertEqual(self.sync.get_with_fallback('user', 1, 'name'), 'u1')
+        self.sync.close()
+        self.assertEqual(self.cache.get('user', 1, 'name'), 'new')
+        self.assertEqual(self.sync.get_stats()['refresh']['user'],
+                         {'refreshes': 1, 'refresh_failures': 0, 'refresh_dropped': 0, 'stale_serves': 0})
+
+    def test_refresh_rejected_after_close(self):
+        refresher = RefreshAhead(workers=1)
+        ran = threading.Event()
+        self.assertTrue(refresher.submit('user', 1, ran.set))
+        refresher.close()
+        self.assertTrue(ran.is_set())
+        self.assertFalse(refresher.submit('user', 2, ran.set))
+        self.assertIsNone(refresher.executor)
+        # close 在 submit 释放锁之后关闭线程池：任务被拒绝且不残留在 pending 中
+        refresher = RefreshAhead(workers=1)
+        refresher.submit('user', 1, lambda: None)
+        refresher.executor.shutdown()
+        self.assertFalse(refresher.submit('user', 2, lambda: None))
+        self.assertEqual(refresher.in_flight(), 0)
+        refresher.close()
+
+    def test_stale_value_served_during_grace(self):
+        update_table(self.config, ttl=0.1, stale_grace=5)
+        self.cache = CacheManager(self.config)
+        self.sync = CacheSync(self.cache, db_client=self.db, config_loader=self.config)
+        self.assertEqual(self.sync.get_with_fallback('user', 2, 'name'), 'u2')
+        time.sleep(0.15)
+        self.db.tables['user'][2]['name'] = 'new'
+        self.db.latency = 0.3
+        start = time.perf_counter()
+        self.assertEqual(self.sync.get_with_fallback('user', 2, 'name'), 'u2')
+        self.assertEqual(self.sync.get_with_fallback('user', 2, 'name'), 'u2')
+        self.assertLess(time.perf_counter() - start, 0.2)
+        self.sync.close()
+        self.assertEqual(self.sync.get_with_fallback('user', 2, 'name'), 'new')
+        stats = self.sync.get_stats()['refresh']['user']
+        self.assertEqual((stats['refreshes'], stats['stale_serves']), (1, 2))
+        self.assertEqual(len(self.db.calls), 2)
+
+    def test_batch_sync_uses_copy_when_available(self):
+        copied = []
+        self.db.copy_query = lambda sql, params=None: copied.append(sql) or self.db.query(sql, params)
+        self.assertEqual(self.sync.batch_sync('user'), 10)
+        self.assertEqual(copied, ['SELECT id,name,age FROM user'])
+        self.assertEqual(self.cache.get('user', 9, 'age'), 9)
+
+    def test_stream_sync_resumes_after_failure(self):
+        self.db.tables['user'] = {i: {'name': f'u{i}', 'age': i} for i in range(25)}
+        original = self.db.query
+
+        def flaky_query(sql, params=None):
+            if len(self.db.calls) == 2:
+                self.db.calls.append((sql, params))
+                raise ConnectionError('connection lost')
+            return original(sql, params)
+
+        self.db.query = flaky_query
+        with self.assertRaises(ConnectionError):
+            self.sync.stream_sync('user', chunk_size=10)
+        self.assertEqual(self.sync.get_sync_progress('user'), 19)
+        self.assertFalse(self.sync.get_sync_state('user')['done'])
+        self.db.query = original
+        self.assertEqual(self.sync.stream_sync('user', chunk_size=10), 5)
+        self.assertEqual(self.db.calls[-1][1], (19, 10))
+        state = self.sync.get_sync_state('user')
+        self.assertTrue(state['done'])
+        self.assertEqual(state['rows'], 25)
+        self.assertGreater(state['rows_per_sec'], 0)
+        self.assertEqual(self.sync.get_sync_progress('user'), 'ALL')
+        self.assertEqual(self.cache.get('user', 24, 'name'), 'u24')
+
+    def test_stream_sync_key_range(self):
+        self.assertEqual(self.sync.stream_sync('user', key_range=(3, 6), chunk_size=2), 4)
+        self.assertEqual(self.sync.get_sync_progress('user'), 6)
+        self.assertIsNone(self.cache.get('user', 7, 'name'))
+
+    def test_parallel_sync_partitions(self):
+        self.db.tables['user'] = {i: {'name': f'u{i}', 'age': i} for i in range(1, 101)}
+        self.assertEqual(self.sync.parallel_sync('user', partitions=4, chunk_size=10), 100)
+        partitions = self.sync.get_sync_progress('user', partitions=True)
+        self.assertEqual([p['rows'] for p in partitions], [25, 25, 25, 25])
+        self.assertEqual([p['last_key'] for p in partitions], [25, 50, 75, 100])
+        self.assertTrue(all(p['done'] for p in partitions))
+        self.assertEqual(self.sync.get_sync_progress('user'), 'ALL')
+        self.assertEqual(self.cache.table_size('user'), 100)
+
+    def test_parallel_sync_leaves_connections_for_fallback(self):
+        self.db.tables['user'] = {i: {'name': f'u{i}', 'age': i} for i in range(1, 101)}
+        self.db.latency = 0.01
+        active, peak, lock = [0], [0], threading.Lock()
+        query = self.db.query
+        def tracked(sql, params=None):
+            with lock:
+                active[0] += 1
+                peak[0] = max(peak[0], active[0])
+            try:
+                return query(sql, params)
+            finally:
+                with lock:
+                    active[0] -= 1
+        self.db.query = tracked
+        self.assertEqual(self.sync.parallel_sync('user', partitions=8, chunk_size=10), 100)
+        self.assertLessEqual(peak[0], self.db.maxconn // 2)
+        self.sync.parallel_sync('user', partitions=8, workers=100, chunk_size=10)
+        self.assertLessEqual(peak[0], self.db.maxconn)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+import time
+import unittest
+from src.cache_manager import CacheManager
+from src.cache_consistency import CacheConsistency
+from src.cdc import CDCConsumer, ChangeEvent, InMemoryEventSource, ListenNotifySource
+from helpers import make_config
+
+class TestCDC(unittest.TestCase):
+    def setUp(self):
+        config = make_config([{'table': 'user', 'key_field': 'id', 'fields': ['name', 'age'], 'ttl': 600,
+                               'cdc_update': True}])
+        self.cache = CacheManager(config)
+        self.consistency = CacheConsistency(self.cache, config_loader=config)
+        self.source = InMemoryEventSource()
+        for i in range(5):
+            self.cache.set_many('user', [(i, 'name', f'u{i}'), (i, 'age', i)])
+
+    def test_invalidate_mode(self):
+        consumer = CDCConsumer(self.source, self.consistency, poll_timeout=0.01)
+        self.source.publish(ChangeEvent('user', 'update', 1, {'id': 1, 'name': 'x'}, commit_time=time.time() - 2,
+                                        position=10))
+        self.source.publish(ChangeEvent('user', 'delete', None, {'id': 2}, position=11))
+        self.assertEqual(consumer.run_once(), 2)
+        self.assertIsNone(self.cache.get('user', 1, 'name'))
+        self.assertIsNone(self.cache.get('user', 2, 'name'))
+        self.assertEqual(self.cache.get('user', 3, 'name'), 'u3')
+        self.assertEqual(self.source.acked, 11)
+        stats = consumer.get_stats()
+        self.assertEqual(stats['events_applied'], 2)
+        self.assertGreaterEqual(stats['lag_seconds'], 2)
+
+    def test_update_mode_applies_last_event_per_key(self):
+        events = [
+            ChangeEvent('user', 'update', 1, {'id': 1, 'name': 'new', 'age': 9}),
+            ChangeEvent('user', 'update', 2, {'id': 2, 'name': 'partial'}),      # 字段不全则失效
+            ChangeEvent('user', 'insert', 7, {'id': 7, 'name': 'u7', 'age': 7}),
+            ChangeEvent('user', 'delete', 7),
+            ChangeEvent('user', 'update', 9, {'id': 9, 'name': 'moved', 'age': 3}, old_key=3),
+        ]
+        self.consistency.apply_changes(events, mode='update')
+        self.assertEqual(self.cache.get_row('user', 1), {'name': 'new', 'age': 9})
+        self.assertEqual(self.cache.get_row('user', 2), {})
+        self.assertEqual(self.cache.get_row('user', 7), {})
+        self.assertEqual(self.cache.get_row('user', 3), {})
+        self.assertEqual(self.cache.get_row('user', 9), {'name': 'moved', 'age': 3})
+        # 未开启 cdc_update 的表只失效，不写入 JSON 解码后的值
+        config = make_config([{'table': 'user', 'key_field': 'id', 'fields': ['name', 'age'], 'ttl': 600}])
+        consistency = CacheConsistency(self.cache, config_loader=config)
+        consistency.apply_changes([ChangeEvent('user', 'update', 4, {'id': 4, 'name': '2024-01-01', 'age': 4})],
+                                  mode='update')
+        self.assertEqual(self.cache.get_row('user', 4), {})
+
+    def test_failed_batch_is_retried_then_falls_back_to_table_invalidation(self):
+        consumer = CDCConsumer(self.source, self.consistency, poll_timeout=0.01, max_retries=1, retry_backoff=0)
+        apply_changes, calls = self.consistency.apply_changes, []
+        def flaky(events, mode):
+            calls.append(len(events))
+            if len(calls) == 1:
+                raise RuntimeError('boom')
+            apply_changes(events, mode)
+        self.consistency.apply_changes = flaky
+        self.source.publish(ChangeEvent('user', 'update', 1, {'id': 1}, position=1))
+        with self.assertLogs('pg-cache', 'ERROR'):
+            self.assertEqual(consumer.run_once(), 1)
+        self.assertEqual(calls, [1, 1])
+        self.assertIsNone(self.cache.get('user', 1, 'name'))
+        self.assertEqual(self.cache.get('user', 2, 'name'), 'u2')
+
+        self.consistency.apply_changes = lambda events, mode: 1 / 0
+        self.source.publish(ChangeEvent('user', 'update', 2, {'id': 2}, position=2))
+        with self.assertLogs('pg-cache', 'WARNING'):
+            self.assertEqual(consumer.run_once(), 1)
+        self.assertEqual(self.cache.table_size('user'), 0)
+        self.assertEqual(self.source.acked, 2)
+        stats = consumer.get_stats()
+        self.assertEqual((stats['apply_failures'], stats['fallback_invalidations']), (3, 1))
+
+    def test_truncate_and_background_consumer(self):
+        consumer = self.consistency.start_cdc(self.source, poll_timeout=0.01)
+        try:
+            self.source.publish(ChangeEvent('user', 'truncate'))
+            deadline = time.time() + 2
+            while self.cache.table_size('user') and time.time() < deadline:
+                time.sleep(0.01)
+            self.assertEqual(self.cache.table_size('user'), 0)
+            self.assertTrue(consumer.is_running())
+        finally:
+            self.consistency.stop_cdc()
+        self.assertFalse(consumer.is_running())
+
+    def test_trigger_sql_notifies_truncate(self):
+        ddl = ListenNotifySource.trigger_sql('user', 'id', channel='changes')
+        self.assertIn('CREATE TRIGGER pg_cache_notify AFTER INSERT OR UPDATE OR DELETE ON user\n'
+                      '    FOR EACH ROW EXECUTE FUNCTION pg_cache_notify_user();', ddl)
+        self.assertIn('CREATE TRIGGER pg_cache_notify_truncate AFTER TRUNCATE ON user\n'
+                      '    FOR EACH STATEMENT EXECUTE FUNCTION pg_cache_notify_truncate_user();', ddl)
+        self.assertIn('DROP TRIGGER IF EXISTS pg_cache_notify_truncate ON user;', ddl)
+        truncate = ddl[ddl.index('FUNCTION pg_cache_notify_truncate_user()'):]
+        self.assertIn("PERFORM pg_notify('changes', json_build_object(", truncate)
+        self.assertIn("'op', 'truncate'", truncate)
+        self.assertIn("'ts', extract(epoch from clock_timestamp())", truncate)
+
+if __name__ == '__main__':
+    unittest.main()
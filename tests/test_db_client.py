@@ -0,0 +1,141 @@
+import threading
+import unittest
+import psycopg2.extensions
+import psycopg2.pool
+from collections import OrderedDict
+from src.db_client import CopyReader, PostgresClient, parse_copy_line
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql, params=None):
+        self.conn.executed.append((sql, params))
+
+    def fetchall(self):
+        return [(1,)]
+
+    def fetchone(self):
+        return (1,)
+
+class FakeConnection:
+    def __init__(self):
+        self.prepared = OrderedDict()
+        self.executed = []
+
+    def cursor(self):
+        return FakeCursor(self)
+
+class FakePool:
+    """
+    与 ThreadedConnectionPool 相同：连接耗尽时立即抛出 PoolError。
+    """
+    def __init__(self, maxconn=1):
+        self.conn = FakeConnection()
+        self.maxconn = maxconn
+        self.used = 0
+
+    def getconn(self):
+        if self.used >= self.maxconn:
+            raise psycopg2.pool.PoolError('connection pool exhausted')
+        self.used += 1
+        return self.conn
+
+    def putconn(self, conn):
+        self.used -= 1
+
+def make_client(threshold=2, max_prepared=2, pool_timeout=1):
+    # 绕过单例与真实连接池，只验证语句准备与借出逻辑
+    client = object.__new__(PostgresClient)
+    client.maxconn = 1
+    client.pool_timeout = pool_timeout
+    client.prepare_threshold = threshold
+    client.max_prepared = max_prepared
+    client.copy_sync = True
+    client.pool = FakePool()
+    client.metrics = None
+    client._reset_state()
+    return client
+
+class TestPreparedStatements(unittest.TestCase):
+    def test_prepares_after_threshold(self):
+        client = make_client()
+        sql = 'SELECT name FROM user WHERE id = %s'
+        for key in range(3):
+            client.query_one(sql, (key,))
+        executed = client.pool.conn.executed
+        self.assertEqual(executed[0], (sql, (0,)))
+        self.assertEqual(executed[1], ('PREPARE pgc_1 AS SELECT name FROM user WHERE id = $1', None))
+        self.assertEqual(executed[2], ('EXECUTE pgc_1 (%s)', (1,)))
+        self.assertEqual(executed[3], ('EXECUTE pgc_1 (%s)', (2,)))
+        stats = client.get_stats()
+        self.assertEqual((stats['prepares'], stats['prepared_executions'], stats['checkouts']), (1, 2, 3))
+        self.assertEqual(stats['in_use'], 0)
+
+    def test_least_recently_used_statement_is_deallocated(self):
+        client = make_client(threshold=1, max_prepared=2)
+        for table in ('a', 'b', 'c'):
+            client.query(f'SELECT * FROM {table}')
+        conn = client.pool.conn
+        self.assertIn(('DEALLOCATE pgc_1', None), conn.executed)
+        self.assertEqual(list(conn.prepared.values()), ['pgc_2', 'pgc_3'])
+
+    def test_execution_counts_are_not_lost_across_threads(self):
+        client = make_client(threshold=100000)
+        sql = 'SELECT name FROM user WHERE id = %s'
+
+        def run():
+            conn = FakeConnection()
+            with conn.cursor() as cur:
+                for key in range(2000):
+                    client._execute(conn, cur, sql, (key,))
+
+        threads = [threading.Thread(target=run) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(client._seen[sql], 16000)
+
+class TestPoolCheckout(unittest.TestCase):
+    def test_checkout_blocks_until_connection_returned(self):
+        client = make_client()
+        conn = client._getconn()
+        threading.Timer(0.1, client._putconn, (conn,)).start()
+        self.assertEqual(client.query('SELECT 1'), [(1,)])
+        stats = client.get_stats()
+        self.assertGreaterEqual(stats['max_wait'], 0.05)
+        self.assertEqual((stats['checkouts'], stats['exhausted'], stats['in_use']), (2, 0, 0))
+
+    def test_timeout_is_counted_as_exhausted(self):
+        client = make_client(pool_timeout=0.01)
+        conn = client._getconn()
+        with self.assertRaises(psycopg2.pool.PoolError):
+            client.query('SELECT 1')
+        client._putconn(conn)
+        client.pool.maxconn = 0  # 连接池自身报错时归还许可
+        with self.assertRaises(psycopg2.pool.PoolError):
+            client.query('SELECT 1')
+        client.pool.maxconn = 1
+        client.query('SELECT 1')
+        self.assertEqual(client.get_stats()['exhausted'], 2)
+
+class TestCopyParser(unittest.TestCase):
+    def test_parse_escapes_and_nulls(self):
+        self.assertEqual(parse_copy_line('1\\ta\\\\b\t\\N\tx\\ny'), ('1\ta\\b', None, 'x\ny'))
+
+    def test_reader_casts_across_chunks(self):
+        casters = [psycopg2.extensions.INTEGER, None, psycopg2.extensions.FLOAT]
+        reader = CopyReader(casters)
+        for chunk in ('1\tu1\t1.5\n2\tu', '2\t\\N\n3\tu3\t', '3.0'):
+            reader.write(chunk)
+        self.assertEqual(reader.finish(), [(1, 'u1', 1.5), (2, 'u2', None), (3, 'u3', 3.0)])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+import threading
+import unittest
+import urllib.request
+from src.cache_manager import CacheManager
+from src.cache_sync import CacheSync
+from src.metrics import MetricsRegistry
+from src.monitor import CacheMonitor
+from helpers import FakeDB, make_config
+
+class TestMetricsRegistry(unittest.TestCase):
+    def test_per_thread_counters_are_merged(self):
+        registry = MetricsRegistry(buckets=(0.01, 0.1))
+
+        def work():
+            for _ in range(1000):
+                registry.inc('ops_total', ('user',))
+                registry.observe('latency_seconds', ('user',), 0.05)
+
+        threads = [threading.Thread(target=work) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        registry.inc('ops_total', ('user',))
+        self.assertEqual(registry.value('ops_total', ('user',)), 4001)
+        self.assertEqual(registry.value('latency_seconds', ('user',)), 4000)
+        self.assertEqual(registry.quantile('latency_seconds', 0.99), 0.1)
+        # 退出线程的数据并入 retired 后仍保留
+        self.assertEqual(len(registry._threads), 1)
+
+    def test_prometheus_format(self):
+        registry = MetricsRegistry(buckets=(0.01, 0.1))
+        registry.describe('latency_seconds', 'histogram', 'latency', ('table',))
+        registry.register_callback('entries', 'gauge', 'entries', ('table',), lambda: {('user',): 3})
+        registry.observe('latency_seconds', ('us"er',), 0.05)
+        text = registry.export_prometheus()
+        self.assertIn('# TYPE latency_seconds histogram', text)
+        self.assertIn('latency_seconds_bucket{table="us\\"er",le="0.01"} 0', text)
+        self.assertIn('latency_seconds_bucket{table="us\\"er",le="+Inf"} 1', text)
+        self.assertIn('latency_seconds_count{table="us\\"er"} 1', text)
+        self.assertIn('entries{table="user"} 3', text)
+
+class TestCacheMonitor(unittest.TestCase):
+    def test_fallback_and_sync_metrics(self):
+        config = make_config([{'table': 'user', 'key_field': 'id', 'fields': ['name']}], no_db_mode=False)
+        cache = CacheManager(config)
+        monitor = CacheMonitor(cache)
+        sync = CacheSync(cache, db_client=FakeDB({'user': {i: {'name': f'u{i}'} for i in range(5)}}),
+                         config_loader=config)
+        sync.metrics = monitor.metrics
+        sync.get_with_fallback('user', 1, 'name')
+        sync.get_with_fallback('user', 1, 'name')
+        sync.batch_sync('user')
+        metrics = monitor.get_metrics()
+        self.assertEqual(metrics['back_source_count'], 1)
+        self.assertEqual(metrics['tables']['user']['keys'], 5)
+        self.assertEqual(metrics['tables']['user']['hits'], 1)
+        self.assertEqual(metrics['tables']['user']['misses'], 1)
+        self.assertGreater(metrics['tables']['user']['bytes'], 0)
+        self.assertEqual(monitor.metrics.value('pg_cache_sync_rows_total', ('user', 'batch_sync')), 5)
+
+    def test_http_endpoint(self):
+        monitor = CacheMonitor(CacheManager(make_config([])))
+        server = monitor.start_http_server('127.0.0.1', 0)
+        try:
+            body = urllib.request.urlopen(f'http://127.0.0.1:{server.port}/metrics', timeout=5).read().decode()
+            self.assertIn('# TYPE pg_cache_hits_total counter', body)
+        finally:
+            monitor.stop_http_server()
+
+if __name__ == '__main__':
+    unittest.main()
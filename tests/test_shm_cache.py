@@ -0,0 +1,113 @@
+import multiprocessing
+import time
+import unittest
+from src.cache_manager import CacheManager, create_cache_manager
+from src.shm_cache import SharedMemoryCache
+from src.structured_query import StructuredQuery
+from helpers import make_config, temp_path, update_table
+
+def _worker(path, action):
+    cache = SharedMemoryCache(make_config([]), path=path)
+    if action == 'write':
+        cache.set('user', 1, 'name', 'from-child')
+        cache.set('user', 2, 'name', 'other')
+    elif action == 'invalidate':
+        cache.invalidate('user', 1)
+        cache.invalidate('order')
+    cache.close()
+
+class TestSharedMemoryCache(unittest.TestCase):
+    def setUp(self):
+        self.path = temp_path(self, 'pg_cache.shm')
+        self.config = make_config([{'table': 'user', 'key_field': 'id', 'fields': ['name', 'age']}],
+                                  backend='shared_memory',
+                                  shared_memory={'path': self.path, 'groups': 64, 'ways': 4, 'slot_size': 128})
+        self.cache = create_cache_manager(self.config)
+
+    def tearDown(self):
+        self.cache.close()
+
+    def _run(self, action):
+        process = multiprocessing.get_context('fork').Process(target=_worker, args=(self.path, action))
+        process.start()
+        process.join()
+        self.assertEqual(process.exitcode, 0)
+
+    def test_invalidate_prefix(self):
+        self.cache.set_many('user', [('a:1', 'name', 1), ('a:2', 'name', 2), ('b:1', 'name', 3), (('a', 1), 'name', 4)])
+        self.cache.invalidate_prefix('user', 'a:')
+        self.assertEqual(self.cache.get_many('user', [(k, 'name') for k in ('a:1', 'a:2', 'b:1', ('a', 1))]),
+                         {('b:1', 'name'): 3, (('a', 1), 'name'): 4})
+        self.cache.invalidate_prefix('user', ('a',))  # 元组前缀匹配复合主键的前几列
+        self.assertIsNone(self.cache.get('user', ('a', 1), 'name'))
+
+    def test_basic_operations(self):
+        self.assertIsInstance(self.cache, SharedMemoryCache)
+        self.cache.set('user', 1, 'name', 'Alice')
+        self.cache.set_many('user', [(1, 'age', 30), (2, 'name', 'Bob')])
+        self.assertEqual(self.cache.get_row('user', 1), {'name': 'Alice', 'age': 30})
+        self.assertEqual(self.cache.get_many('user', [(1, 'name'), (3, 'name')]), {(1, 'name'): 'Alice'})
+        self.cache.invalidate('user', 1)
+        self.assertIsNone(self.cache.get('user', 1, 'age'))
+        self.assertEqual(self.cache.get('user', 2, 'name'), 'Bob')
+        self.cache.invalidate('user')
+        self.assertIsNone(self.cache.get('user', 2, 'name'))
+        # 过大的值不缓存，并移除旧值
+        self.cache.set('user', 5, 'name', 'short')
+        self.cache.set('user', 5, 'name', 'x' * 500)
+        self.assertIsNone(self.cache.get('user', 5, 'name'))
+        self.assertEqual(self.cache.get_stats()['oversize'], 1)
+
+    def test_group_overflow_evicts_oldest(self):
+        for i in range(6):
+            self.cache.set('user', 1, f'f{i}', i)
+        row = self.cache.get_row('user', 1)
+        self.assertEqual(len(row), 4)
+        self.assertNotIn('f0', row)
+
+    def test_cross_process_visibility_and_invalidation(self):
+        self._run('write')
+        self.assertEqual(self.cache.get('user', 1, 'name'), 'from-child')
+        self.cache.set('order', 7, 'amount', 10)
+        self._run('invalidate')
+        self.assertIsNone(self.cache.get('user', 1, 'name'))
+        self.assertEqual(self.cache.get('user', 2, 'name'), 'other')
+        self.assertIsNone(self.cache.get('order', 7, 'amount'))
+
+    def test_structured_query_in_no_db_mode(self):
+        self.cache.set_many('user', [(1, 'name', 'a'), (2, 'name', 'b'), (3, 'name', 'a')])
+        sq = StructuredQuery(self.cache, config_loader=self.config)
+        self.assertEqual(sq.query('user', {'name': 'a'}, ['id']), [(1,), (3,)])
+
+    def test_stale_grace_only_visible_through_lookup_expiry(self):
+        update_table(self.config, stale_grace=5)
+        cache = SharedMemoryCache(self.config)
+        self.addCleanup(cache.close)
+        cache.set('user', 1, 'name', 'a', ttl=0.05)
+        time.sleep(0.1)
+        self.assertIsNone(cache.get('user', 1, 'name'))
+        self.assertEqual(cache.get_row('user', 1), {})
+        value, expire_at = cache.lookup_expiry('user', 1, 'name')
+        self.assertEqual(value, 'a')
+        self.assertLess(expire_at, time.time())
+        cache.set('user', 1, 'name', 'b', ttl=60)
+        self.assertEqual(cache.lookup_expiry('user', 1, 'name')[0], 'b')
+        self.assertEqual(cache.get('user', 1, 'name'), 'b')
+
+    def test_snapshot_round_trip(self):
+        self.cache.set_many('user', [(1, 'name', 'a'), (1, 'age', 30), (2, 'name', 'b')], ttl=600)
+        self.cache.set('user', 3, 'name', None, ttl=None)
+        self.cache.set('__struct_query__:user', 'q', '__struct_query__', [(1,)])
+        path = temp_path(self, 'shm.snapshot')
+        stats = self.cache.save_snapshot(path, chunk_keys=2)
+        self.assertEqual((stats['keys'], stats['entries'], stats['blocks']), (3, 4, 2))
+        memory = CacheManager(self.config)
+        self.assertEqual(memory.load_snapshot(path)['entries'], 4)
+        self.assertEqual(memory.get_row('user', 1), {'name': 'a', 'age': 30})
+        self.assertEqual(memory.lookup('user', 3, 'name'), None)
+        self.cache.invalidate('user')
+        self.cache.load_snapshot(path)
+        self.assertEqual(self.cache.get('user', 2, 'name'), 'b')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,196 @@
+import time
+import unittest
+from src.cache_manager import CacheManager
+from src.cache_sync import CacheSync
+from src.cache_consistency import CacheConsistency
+from src.cdc import ChangeEvent
+from src.paged_result import OVERSIZED, ColumnarResult
+from src.structured_query import StructuredQuery, query_namespace
+from helpers import FakeDB, make_config
+
+class TestStructuredQuery(unittest.TestCase):
+    def setUp(self):
+        config = make_config([{'table': 'user', 'key_field': 'id', 'fields': ['name', 'status'], 'ttl': 600}],
+                             no_db_mode=False)
+        self.db = FakeDB({'user': {i: {'name': f'u{i}', 'status': i % 3} for i in range(30)}})
+        self.cache = CacheManager(config)
+        self.sq = StructuredQuery(self.cache, db_client=self.db, config_loader=config)
+
+    def test_query_is_cached_in_own_namespace(self):
+        rows = self.sq.query('user', {'status': 1}, ['id', 'name'], limit=3)
+        self.assertEqual(rows, [(1, 'u1'), (4, 'u4'), (7, 'u7')])
+        self.assertEqual(self.sq.query('user', {'status': 1}, ['id', 'name'], limit=3), rows)
+        self.assertEqual(len(self.db.calls), 1)
+        self.assertEqual(self.cache.table_size('user'), 0)
+        self.assertEqual(self.cache.table_size(query_namespace('user')), 1)
+
+    def test_invalidate_query_cache_keeps_rows(self):
+        self.cache.set('user', 1, 'name', 'u1')
+        self.sq.query('user', {'status': 1}, ['id'])
+        self.sq.invalidate_query_cache('user')
+        self.assertEqual(self.cache.get('user', 1, 'name'), 'u1')
+        self.sq.query('user', {'status': 1}, ['id'])
+        self.assertEqual(len(self.db.calls), 2)
+
+    def test_precise_invalidation_by_key_and_value(self):
+        self.sq.query('user', {'id': [1, 2]}, ['name'])     # A: 主键 IN
+        self.sq.query('user', {'id': 5}, ['name'])          # B: 主键等值
+        self.sq.query('user', {'status': 2}, ['id'])        # C: 非主键过滤
+        self.sq.query('user', {}, ['id'], limit=5)           # D: 无过滤
+        # 写主键 2：A 可能包含，B 不可能；C、D 不约束主键
+        self.assertEqual(self.sq.invalidate_for_write('user', key=2), 3)
+        self.assertIsNotNone(self.cache.get(query_namespace('user'),
+                                            self.sq._make_cache_key('user', {'id': 5}, ['name'], None, None),
+                                            '__struct_query__'))
+        self.sq.query('user', {'status': 2}, ['id'])
+        self.sq.query('user', {'status': 0}, ['id'])
+        # 新插入 status=0 的行只影响 status=0 的查询
+        self.assertEqual(self.sq.invalidate_for_write('user', key=100, values={'status': 0}), 1)
+        calls = len(self.db.calls)
+        self.sq.query('user', {'status': 2}, ['id'])
+        self.assertEqual(len(self.db.calls), calls)
+
+    def test_write_between_register_and_set_drops_result(self):
+        cache_set = self.cache.set
+
+        def racing_set(*args):
+            self.sq.invalidate_for_write('user', key=1)
+            cache_set(*args)
+
+        self.cache.set = racing_set
+        self.sq.query('user', {'id': 1}, ['name'])
+        self.cache.set = cache_set
+        self.assertEqual(self.cache.table_size(query_namespace('user')), 0)
+        self.assertEqual(self.sq.dependencies.queries['user'], {})
+        self.sq.query('user', {'id': 1}, ['name'])
+        self.assertEqual(len(self.db.calls), 2)
+
+    def test_expired_dependencies_are_pruned_when_full(self):
+        self.sq.dependencies.max_queries = 2
+        self.sq.query('user', {'status': 0}, ['id'], ttl=0.01)
+        self.sq.query('user', {'status': 1}, ['id'], ttl=0.01)
+        self.sq.query('user', {'status': 2}, ['id'])
+        self.assertEqual(self.sq.dependencies.rejected, 1)
+        time.sleep(1.02)
+        self.sq.query('user', {'status': 2}, ['id'])
+        self.sq.query('user', {'status': 2}, ['id'])
+        self.assertEqual(len(self.db.calls), 4)
+        self.assertEqual(len(self.sq.dependencies.queries['user']), 1)
+
+class TestLocalQueryEngine(unittest.TestCase):
+    def setUp(self):
+        self.config = make_config([{'table': 'user', 'key_field': 'id', 'fields': ['name', 'status'],
+                                    'indexes': ['status']}], no_db_mode=False)
+        self.db = FakeDB({'user': {i: {'name': f'u{i}', 'status': i % 3} for i in range(30)}})
+        self.cache = CacheManager(self.config)
+        self.sync = CacheSync(self.cache, db_client=self.db, config_loader=self.config)
+        self.sq = StructuredQuery(self.cache, db_client=self.db, config_loader=self.config)
+
+    def test_not_resident_queries_database(self):
+        self.sync.batch_sync('user', key_range=(0, 9))
+        self.assertFalse(self.cache.is_resident('user'))
+        calls = len(self.db.calls)
+        self.sq.query('user', {'status': 1}, ['id'], cache_result=False)
+        self.assertEqual(len(self.db.calls), calls + 1)
+
+    def test_resident_table_served_locally(self):
+        self.sync.stream_sync('user', chunk_size=7)
+        self.assertTrue(self.cache.is_resident('user'))
+        calls = len(self.db.calls)
+        rows = self.sq.query('user', {'status': [1, 2], 'id': [1, 2, 3, 4, 5]}, ['id', 'name'],
+                             limit=2, offset=1, cache_result=False)
+        self.assertEqual(rows, [(2, 'u2'), (4, 'u4')])
+        self.assertEqual(self.sq.query('user', {'name': 'u7'}, ['status'], cache_result=False), [(1,)])
+        self.assertEqual(len(self.sq.query('user', {}, ['id'], cache_result=False)), 30)
+        self.assertEqual(len(self.db.calls), calls)
+        # 未缓存的列无法在本地过滤或投影，回源执行
+        self.assertIsNone(self.cache.select('user', 'id', {'email': 'x'}, ['id']))
+        self.sq.query('user', {'status': 1}, ['id', 'email'], cache_result=False)
+        self.assertEqual(len(self.db.calls), calls + 1)
+        # 写入同步更新二级索引
+        self.cache.set('user', 3, 'status', 1)
+        self.assertEqual(self.sq.query('user', {'status': 1}, ['id'], limit=2, cache_result=False), [(1,), (3,)])
+
+    def test_data_loss_drops_residency(self):
+        self.sync.parallel_sync('user', partitions=3, workers=2)
+        self.assertTrue(self.cache.is_resident('user'))
+        # 删除事件保持常驻
+        CacheConsistency(self.cache, self.config).apply_changes([ChangeEvent('user', 'delete', 1)])
+        self.assertTrue(self.cache.is_resident('user'))
+        self.assertEqual(self.sq.query('user', {'status': 1}, ['id'], limit=1, cache_result=False), [(4,)])
+        self.cache.invalidate('user', 4)
+        self.assertFalse(self.cache.is_resident('user'))
+        calls = len(self.db.calls)
+        self.sq.query('user', {'status': 1}, ['id'], limit=1, cache_result=False)
+        self.assertEqual(len(self.db.calls), calls + 1)
+
+    def test_no_db_mode_queries_cache(self):
+        config = make_config([{'table': 'user', 'key_field': 'id', 'fields': ['name', 'status'],
+                               'indexes': ['status']}])
+        cache = CacheManager(config)
+        sq = StructuredQuery(cache, config_loader=config)
+        cache.set_many('user', [(1, 'status', 'a'), (2, 'status', 'b'), (3, 'status', 'a'), (3, 'name', 'c')])
+        self.assertEqual(sq.query('user', {'status': 'a'}, ['id', 'name']), [(1, None), (3, 'c')])
+        cache.invalidate('user', 3, 'status')
+        self.assertEqual(sq.query('user', {'status': 'a'}, ['id'], cache_result=False), [(1,)])
+
+class TestPagedResults(unittest.TestCase):
+    def setUp(self):
+        config = make_config([{'table': 'user', 'key_field': 'id', 'fields': ['name', 'score']}], no_db_mode=False,
+                             query_paging={'enabled': True, 'max_rows': 20})
+        self.db = FakeDB({'user': {i: {'name': f'u{i}', 'score': i / 2} for i in range(30)}})
+        self.cache = CacheManager(config)
+        self.sq = StructuredQuery(self.cache, db_client=self.db, config_loader=config)
+
+    def test_pages_sliced_from_one_columnar_result(self):
+        self.assertEqual(self.sq.query('user', {'id': list(range(15))}, ['id', 'name'], limit=5),
+                         [(i, f'u{i}') for i in range(5)])
+        self.assertEqual(self.sq.query('user', {'id': list(range(15))}, ['id', 'name'], limit=5, offset=10),
+                         [(i, f'u{i}') for i in range(10, 15)])
+        self.assertEqual(self.sq.query('user', {'id': list(range(15))}, ['id', 'name']),
+                         [(i, f'u{i}') for i in range(15)])
+        self.assertEqual(len(self.db.calls), 1)
+        self.assertEqual(self.sq.paged_queries, 1)
+        full = self.cache.get(query_namespace('user'),
+                              self.sq._make_cache_key('user', {'id': list(range(15))}, ['id', 'name'], None, None),
+                              '__struct_query__')
+        self.assertIsInstance(full, ColumnarResult)
+        ids, names = full.columns(2, 3)
+        self.assertIsInstance(ids, memoryview)
+        self.assertEqual((ids.tolist(), names), ([2, 3, 4], ('u2', 'u3', 'u4')))
+        # 写入仍按依赖索引失效完整结果
+        self.assertEqual(self.sq.invalidate_for_write('user', key=3), 1)
+        self.sq.query('user', {'id': list(range(15))}, ['id', 'name'], limit=5)
+        self.assertEqual(len(self.db.calls), 2)
+
+    def test_oversized_result_falls_back_to_page_queries(self):
+        self.assertEqual(self.sq.query('user', {}, ['id', 'score'], limit=5, offset=5),
+                         [(i, i / 2) for i in range(5, 10)])
+        self.assertEqual(len(self.db.calls), 1)  # 页在截断取回的前 21 行内
+        self.assertEqual(self.cache.get(query_namespace('user'),
+                                        self.sq._make_cache_key('user', {}, ['id', 'score'], None, None),
+                                        '__struct_query__'), OVERSIZED)
+        self.assertEqual(self.sq.query('user', {}, ['id'], offset=25), [(i,) for i in range(25, 30)])
+        self.assertEqual(len(self.db.calls), 3)
+        self.sq.query('user', {}, ['id', 'score'], limit=5, offset=20)
+        self.sq.query('user', {}, ['id', 'score'], limit=5, offset=20)
+        self.assertEqual(len(self.db.calls), 4)
+
+    def test_plan_steps_used_by_async_api(self):
+        # 完整结果超限且请求页不在已取回的行中：第一轮转为按页查询，第二轮得到结果
+        plan = self.sq.plan('user', {}, ['id'], limit=5, offset=25)
+        self.assertFalse(plan.done)
+        self.assertTrue(plan.paged)
+        rounds = 0
+        while not plan.done:
+            sql, params = self.sq.statement(plan)
+            rows = self.db.query(sql, params)
+            self.sq.finish(plan, self.sq.store(plan, rows), rows)
+            rounds += 1
+        self.assertEqual((rounds, plan.result), (2, [(i,) for i in range(25, 30)]))
+        cached = self.sq.plan('user', {}, ['id'], limit=5, offset=25)
+        self.assertTrue(cached.done)
+        self.assertEqual(cached.result, plan.result)
+
+if __name__ == '__main__':
+    unittest.main()